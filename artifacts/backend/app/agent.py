@@ -3,52 +3,447 @@
 Routes call into this module to run the core study flow.
 """
 
-from agents import Agent, Runner
+from agents import Agent, AgentOutputSchema, Runner
+from agents.exceptions import ModelBehaviorError
+from contextlib import asynccontextmanager
 from dotenv import load_dotenv
+from fastapi.concurrency import run_in_threadpool
 from pathlib import Path
-from app.prompts import CHAT_PROMPT, FLASHCARD_PROMPT, QUIZ_PROMPT
-from app.tools.retrieve import retrieve_context
+from app import generation_cache, generation_pool, hedging, llm_scheduler, metrics, model_router, question_bank, retrieval_policy
+from app.llm_scheduler import scheduler
+from app.hedging import Hedger
+from app.single_flight import SingleFlight
+from app.models.generation import GeneratedFlashcards, GeneratedQuiz
+from app.prompts import (
+    CHAT_PROMPT, CLASS_PROMPT, FLASHCARD_PROMPT, HISTORY_PROMPT, NO_RETRIEVAL_NOTE, QUIZ_PROMPT,
+    REQUEST_PROMPT, SUMMARY_PROMPT, SUMMARY_REQUEST_PROMPT,
+)
+from app.tools.context import CONTEXT_TOKEN_BUDGETS, abuild_context, estimate_tokens, merge_chunks
+from app.tools.json_repair import repair_json
+from app.vector_store import corpus_version, list_class_chunks
+import asyncio
+import hashlib
+import os
+import re
+import time
 
 # Load environment variables
 load_dotenv(Path(__file__).resolve().parents[2] / ".env")
 
-def _build_context_block(class_id: str, query: str) -> str:
-    chunks = retrieve_context(class_id=class_id, query=query, top_k=5)
-    if not chunks:
+PROMPTS = {
+    "chat": CHAT_PROMPT,
+    "flashcard": FLASHCARD_PROMPT,
+    "quiz": QUIZ_PROMPT,
+}
+
+# Editing a prompt changes its version, which retires cached generations made with it.
+PROMPT_VERSIONS = {
+    mode: hashlib.sha256((template + CLASS_PROMPT + REQUEST_PROMPT).encode("utf-8")).hexdigest()[:12]
+    for mode, template in PROMPTS.items()
+}
+
+GENERATION_REQUESTS = {
+    "flashcard": "Generate {count} flashcards",
+    "quiz": "Generate {count} quiz questions",
+}
+
+# Interactive chat is admitted before bulk generation when model calls queue up.
+MODE_PRIORITIES = {
+    "chat": llm_scheduler.INTERACTIVE,
+    "flashcard": llm_scheduler.BULK,
+    "quiz": llm_scheduler.BULK,
+}
+
+# Output tokens reserved against the scheduler's token budget until a run reports its usage.
+OUTPUT_TOKEN_ESTIMATES = {"chat": 500, "flashcard": 1500, "quiz": 2500, "summary": 400}
+
+# Upper bound the summarizer is asked to keep a conversation summary under.
+CHAT_SUMMARY_MAX_WORDS = int(os.getenv("CHAT_SUMMARY_MAX_WORDS", "200"))
+
+# Large flashcard/quiz requests are split into concurrent runs of about this many items.
+GENERATION_SHARD_SIZE = int(os.getenv("GENERATION_SHARD_SIZE", "10"))
+GENERATION_MAX_SHARDS = int(os.getenv("GENERATION_MAX_SHARDS", "5"))
+
+# Seconds a caller waits for a flashcard/quiz generation before giving up.
+GENERATION_TIMEOUT_SECONDS = float(os.getenv("GENERATION_TIMEOUT_SECONDS", "120"))
+
+# Concurrent identical generations share one run.
+generation_flights = SingleFlight()
+
+# Slow interactive runs get a backup run when hedging is on.
+hedger = Hedger()
+
+# Field that identifies a generated item when merging shards.
+_ITEM_KEYS = {"flashcard": "front", "quiz": "question"}
+
+
+class GenerationFormatError(Exception):
+    """The model's output could not be parsed into flashcards or questions, even after repair."""
+
+
+class RepairingOutputSchema(AgentOutputSchema):
+    """Typed agent output that gets one local repair pass before the run fails.
+
+    Near-valid JSON (code fences, trailing commas, a bare array, output cut off
+    mid-item) is fixed in-process instead of paying for another model call.
+    """
+
+    def validate_json(self, json_str):
+        try:
+            return super().validate_json(json_str)
+        except ModelBehaviorError as error:
+            wrap_key = next(iter(self.output_type.model_fields))
+            try:
+                repaired = repair_json(json_str, wrap_key=wrap_key)
+            except ValueError:
+                raise error
+            return super().validate_json(repaired)
+
+
+OUTPUT_TYPES = {
+    "flashcard": RepairingOutputSchema(GeneratedFlashcards),
+    "quiz": RepairingOutputSchema(GeneratedQuiz),
+}
+
+def _format_passages(passages) -> str:
+    if not passages:
         return "No indexed content found for this class yet."
 
     lines = []
-    for index, chunk in enumerate(chunks, start=1):
-        lines.append(f"[{index}] Source: {chunk['source']}\n{chunk['text']}")
+    for index, passage in enumerate(passages, start=1):
+        page = f" (page {passage['page']})" if passage.get("page") else ""
+        lines.append(f"[{index}] Source: {passage['source']}{page}\n{passage['text']}")
     return "\n\n".join(lines)
 
-async def run(mode, class_id, message=None, focus=None):
+async def _chat_context_block(session_id, class_id, message, focus):
+    """Excerpts for a chat turn, retrieved only when the retrieval policy says the turn needs them."""
+    decision, passages = retrieval_policy.decide(session_id, message, focus)
+    if decision == retrieval_policy.SKIP:
+        return NO_RETRIEVAL_NOTE
+    if decision == retrieval_policy.RETRIEVE:
+        passages = await abuild_context(class_id=class_id, query=message or focus or "general study guidance", mode="chat")
+        retrieval_policy.remember(session_id, focus, passages)
+    return _format_passages(passages)
 
-    if mode == "chat":
-        prompt_template = CHAT_PROMPT
-    elif mode == "flashcard":
-        prompt_template = FLASHCARD_PROMPT
-    elif mode == "quiz":
-        prompt_template = QUIZ_PROMPT
-    else:
+async def _build_agent(mode, class_id, message=None, focus=None, passages=None, history=None, session_id=None):
+    """Return the agent and its input for a request.
+
+    The instructions are the static mode prompt followed by the class line.
+    Conversation history, retrieved excerpts, focus and message change per
+    request and go last, in the user input.
+    ``passages`` replaces retrieval with an already packed context. Retrieval
+    is awaited, so a slow vector store query never stalls the event loop.
+    Chat turns of a session (``session_id``) go through the retrieval policy,
+    which may reuse the session's last excerpts or skip retrieval.
+    """
+    if mode not in PROMPTS:
         raise ValueError(f"Unsupported mode: {mode}")
 
-    user_query = message or focus or "general study guidance"
-    retrieved_chunks = _build_context_block(class_id=class_id, query=user_query)
+    if passages is not None:
+        retrieved_chunks = _format_passages(passages)
+    elif mode == "chat" and session_id is not None:
+        retrieved_chunks = await _chat_context_block(session_id, class_id, message, focus)
+    else:
+        user_query = message or focus or "general study guidance"
+        retrieved_chunks = _format_passages(await abuild_context(class_id=class_id, query=user_query, mode=mode))
 
-    system_prompt = prompt_template.format(
-        class_name=class_id,
+    instructions = PROMPTS[mode] + CLASS_PROMPT.format(class_name=class_id)
+    agent_input = REQUEST_PROMPT.format(
         retrieved_chunks=retrieved_chunks,
         user_focus_prompt=focus or "No specific focus provided",
+        message=message or "Help me study this class.",
+    )
+    if history:
+        agent_input = HISTORY_PROMPT.format(history=history) + agent_input
+
+    agent = Agent(
+        name="Assistant",
+        instructions=instructions,
+        output_type=OUTPUT_TYPES.get(mode),
     )
+    return agent, agent_input
 
-    # call OpenAI and return response (async)
-    agent = Agent(name="Assistant", instructions=system_prompt)
-    result = await Runner.run(agent, message or "Help me study this class.")
+def _estimated_tokens(mode, agent, agent_input):
+    return estimate_tokens(agent.instructions + agent_input) + OUTPUT_TOKEN_ESTIMATES[mode]
+
+def _routed(mode, agent, tokens):
+    """Return the agent on the model the router picks for the request, and that model."""
+    model = model_router.choose(mode, tokens)
+    return (agent.clone(model=model) if model else agent), model
+
+def _hedge_delay(mode, model):
+    """Seconds after which a run of ``mode`` on ``model`` is hedged, or None to run it unhedged."""
+    if not hedging.LLM_HEDGE_ENABLED or mode not in hedging.LLM_HEDGE_MODES:
+        return None
+    delay = model_router.percentile(mode, model, hedging.LLM_HEDGE_PERCENTILE)
+    return None if delay is None else max(delay, hedging.LLM_HEDGE_MIN_DELAY_SECONDS)
+
+async def _run_routed(mode, agent, agent_input, priority):
+    """Run on the routed model through the scheduler, reporting the run's latency to the router.
+
+    In hedged modes a run slower than the model's usual latency gets an
+    identical backup run; the first to finish is used.
+    """
+    tokens = _estimated_tokens(mode, agent, agent_input)
+    agent, model = _routed(mode, agent, tokens)
+
+    async def timed_run():
+        started = time.monotonic()
+        result = await Runner.run(agent, agent_input)
+        model_router.record(mode, model, time.monotonic() - started)
+        return result
+
+    delay = _hedge_delay(mode, model)
+    if delay is None:
+        result = await scheduler.run(timed_run, priority=priority, tokens=tokens)
+    else:
+        result = await hedger.run(
+            lambda: scheduler.run(timed_run, priority=priority, tokens=tokens),
+            delay,
+            has_capacity=scheduler.has_free_slot,
+        )
+    metrics.record_usage(mode, result.context_wrapper.usage)
     return result
 
+async def run(mode, class_id, message=None, focus=None, passages=None, priority=None, history=None, session_id=None):
+    """
+    Run the agent through the LLM scheduler and return the RunResult.
+
+    ``history`` is the conversation memory block for chat follow-ups and
+    ``session_id`` the chat session, for adaptive retrieval. ``priority``
+    defaults to the mode's priority. The model is picked by
+    ``model_router``. Raises SchedulerBusy when the scheduler's queue is full
+    or provider rate limits persist.
+    """
+    agent, agent_input = await _build_agent(
+        mode, class_id, message=message, focus=focus, passages=passages, history=history, session_id=session_id
+    )
+    return await _run_routed(mode, agent, agent_input, MODE_PRIORITIES[mode] if priority is None else priority)
+
+@asynccontextmanager
+async def run_streamed(mode, class_id, message=None, focus=None, history=None, session_id=None):
+    """
+    Start a streamed run and yield the RunResultStreaming.
+
+    Retrieval happens before the run starts; tokens arrive through
+    ``result.stream_events()`` and ``result.final_output`` is set once it ends.
+    The run holds a scheduler slot until the ``async with`` block exits, and
+    is cancelled if the block exits before the stream completes. Callers
+    record ``result.context_wrapper.usage`` after the stream completes.
+    """
+    agent, agent_input = await _build_agent(
+        mode, class_id, message=message, focus=focus, history=history, session_id=session_id
+    )
+    tokens = _estimated_tokens(mode, agent, agent_input)
+    agent, model = _routed(mode, agent, tokens)
+    async with scheduler.slot(MODE_PRIORITIES[mode], tokens) as slot:
+        started = time.monotonic()
+        result = Runner.run_streamed(agent, agent_input)
+        try:
+            yield result
+        finally:
+            if result.is_complete:
+                model_router.record(mode, model, time.monotonic() - started)
+            else:
+                result.cancel()
+            slot[1] = result.context_wrapper.usage.total_tokens or slot[1]
+
+async def summarize_conversation(summary, transcript):
+    """
+    Fold ``transcript`` into the running conversation ``summary`` and return the new summary.
+
+    Runs at background priority, so it never delays a student's request.
+    """
+    agent = Agent(
+        name="Summarizer",
+        instructions=SUMMARY_PROMPT.format(max_words=CHAT_SUMMARY_MAX_WORDS),
+    )
+    agent_input = SUMMARY_REQUEST_PROMPT.format(summary=summary or "None yet.", transcript=transcript)
+    result = await _run_routed("summary", agent, agent_input, llm_scheduler.BACKGROUND)
+    return str(result.final_output).strip()
+
+async def generate(mode, class_id, focus=None, count=10, use_cache=True):
+    """
+    Generate flashcards or quiz questions and return the parsed JSON items.
+
+    Requests the class's pre-generated pool can cover are sampled from it
+    without a model call. Other results are cached per (mode, class, focus, count, prompt version, corpus
+    version), so repeating a request before new material is ingested skips the
+    model call, and concurrent requests with the same key share one run.
+    Raises GenerationFormatError if the model output cannot be parsed and
+    TimeoutError after GENERATION_TIMEOUT_SECONDS.
+    """
+    if mode not in GENERATION_REQUESTS:
+        raise ValueError(f"Unsupported generation mode: {mode}")
+
+    if generation_pool.GENERATION_POOL_ENABLED and use_cache:
+        pooled = await run_in_threadpool(
+            generation_pool.sample, class_id, mode, PROMPT_VERSIONS[mode], count, focus
+        )
+        if pooled is not None:
+            return pooled
+
+    version = await run_in_threadpool(corpus_version, class_id)
+    key = generation_cache.cache_key(mode, class_id, focus, count, PROMPT_VERSIONS[mode], version)
+    if generation_cache.GENERATION_CACHE_ENABLED and use_cache:
+        # Opting out skips the lookup but still refreshes the entry.
+        cached = generation_cache.get(key)
+        if cached is not None:
+            return cached
+
+    items = await generation_flights.do(
+        key,
+        lambda: _generate_uncached(mode, class_id, focus, count),
+        timeout=GENERATION_TIMEOUT_SECONDS,
+    )
+
+    # Only well-formed, complete results are worth replaying; a short set (e.g. a
+    # sharded run that lost a shard) would be served to every repeat request.
+    well_formed = isinstance(items, list) and all(isinstance(item, dict) for item in items)
+    complete = well_formed and (not count or len(items) >= count)
+    if generation_cache.GENERATION_CACHE_ENABLED and complete:
+        generation_cache.put(key, items)
+    if mode == "quiz" and well_formed:
+        await run_in_threadpool(question_bank.add_questions, class_id, items)
+    return items
+
+async def _generate_uncached(mode, class_id, focus, count):
+    shards = min(-(-count // GENERATION_SHARD_SIZE), GENERATION_MAX_SHARDS) if count else 1
+    if shards > 1:
+        return await _generate_sharded(mode, class_id, focus, count, shards)
+    return await _generate_batch(mode, class_id, focus, count)
+
+def _generation_message(mode, count, focus=None):
+    return GENERATION_REQUESTS[mode].format(count=count) + (f" focusing on: {focus}" if focus else "")
+
+async def _generate_batch(mode, class_id, focus, count, passages=None, priority=None):
+    try:
+        result = await run(
+            mode=mode,
+            class_id=class_id,
+            focus=focus,
+            message=_generation_message(mode, count, focus),
+            passages=passages,
+            priority=priority,
+        )
+    except ModelBehaviorError as error:
+        raise GenerationFormatError(str(error)) from error
+    output = result.final_output
+    items = output.flashcards if mode == "flashcard" else output.questions
+    return [item.model_dump() for item in items]
+
+def _item_key(mode, item):
+    return " ".join(re.findall(r"[a-z0-9]+", str(item.get(_ITEM_KEYS[mode], "")).lower()))
+
+async def _generate_sharded(mode, class_id, focus, count, shards):
+    """
+    Generate ``count`` items as ``shards`` concurrent runs over different context slices.
+
+    One retrieval packs enough passages for every shard and they are dealt out
+    round-robin, so each run sees different material. Each shard asks for one
+    extra item to absorb duplicates; results are merged, de-duplicated and
+    trimmed. A shard that fails or returns unparseable output is run once
+    more; if it fails again it is dropped unless every shard failed, so the
+    result can be shorter than ``count``.
+    """
+    query = _generation_message(mode, count, focus)
+    budget = CONTEXT_TOKEN_BUDGETS[mode] * shards
+    passages = await abuild_context(class_id, query, mode, budget)
+    if len(passages) >= shards:
+        slices = [passages[shard::shards] for shard in range(shards)]
+    else:
+        slices = [passages] * shards
+
+    per_shard = -(-count // shards) + 1
+    results = await asyncio.gather(
+        *(_generate_batch(mode, class_id, focus, per_shard, passages=context) for context in slices),
+        return_exceptions=True,
+    )
+    failed = [shard for shard, result in enumerate(results) if isinstance(result, Exception)]
+    if failed:
+        retries = await asyncio.gather(
+            *(_generate_batch(mode, class_id, focus, per_shard, passages=slices[shard]) for shard in failed),
+            return_exceptions=True,
+        )
+        for shard, result in zip(failed, retries):
+            results[shard] = result
+
+    items = []
+    seen = set()
+    errors = []
+    for result in results:
+        if isinstance(result, Exception):
+            errors.append(result)
+            continue
+        if not isinstance(result, list):
+            continue
+        for item in result:
+            if not isinstance(item, dict):
+                continue
+            key = _item_key(mode, item)
+            if key in seen:
+                continue
+            seen.add(key)
+            items.append(item)
+
+    if not items and errors:
+        raise errors[0]
+    return items[:count]
+
+async def refresh_pool(class_id):
+    """
+    Bring the class's flashcard and quiz pools up to date with its corpus.
+
+    Items from removed chunks or older prompts are dropped, then every window
+    of chunks no remaining item covers gets a small batch of each kind, at
+    background priority. New questions also go into the question bank. Returns {"generated": items added, "failed": windows}.
+    """
+    chunks = await run_in_threadpool(list_class_chunks, class_id)
+    live_hashes = {chunk["content_hash"] for chunk in chunks}
+    covered = await run_in_threadpool(generation_pool.prune, class_id, PROMPT_VERSIONS, live_hashes)
+    limit = asyncio.Semaphore(generation_pool.GENERATION_POOL_CONCURRENCY)
+
+    async def fill(mode, window):
+        async with limit:
+            items = await _generate_batch(
+                mode,
+                class_id,
+                None,
+                generation_pool.GENERATION_POOL_ITEMS_PER_WINDOW,
+                passages=merge_chunks(window),
+                priority=llm_scheduler.BACKGROUND,
+            )
+        if mode == "quiz":
+            await run_in_threadpool(question_bank.add_questions, class_id, items, window[0]["source"])
+        return await run_in_threadpool(
+            generation_pool.add_items,
+            class_id,
+            mode,
+            window[0]["source"],
+            PROMPT_VERSIONS[mode],
+            [chunk["content_hash"] for chunk in window],
+            [(_item_key(mode, item), item) for item in items],
+        )
+
+    results = await asyncio.gather(
+        *(
+            fill(mode, window)
+            for mode in GENERATION_REQUESTS
+            for window in generation_pool.plan_windows(chunks, covered.get(mode, set()), CONTEXT_TOKEN_BUDGETS[mode])
+        ),
+        return_exceptions=True,
+    )
+    return {
+        "generated": sum(result for result in results if isinstance(result, int)),
+        "failed": sum(1 for result in results if isinstance(result, Exception)),
+    }
+
+def schedule_pool_refresh(class_id):
+    """Refresh the class's pre-generated pools in the background after its corpus changed."""
+    if generation_pool.GENERATION_POOL_ENABLED:
+        generation_pool.schedule_refresh(class_id, lambda: refresh_pool(class_id))
+
 # use this to test this functionality running
 if __name__ == "__main__":
-    import asyncio
     result = asyncio.run(run(mode="chat", class_id="demo-class", message="Write a haiku"))
     print(result.final_output)
\ No newline at end of file
@@ -0,0 +1,65 @@
+"""Request-scoped cancellation.
+
+Plain (non-streamed) responses keep running after their client goes away, so
+the routes that call the model run that work through ``cancel_on_disconnect``.
+It watches the connection while the work runs and cancels it as soon as the
+client disconnects. The cancellation unwinds through the LLM scheduler (the
+queued or running call gives up its slot) and the generation coalescer (a
+shared run stops once no caller is left). Cancellations are counted per route
+for GET /api/metrics.
+"""
+
+from __future__ import annotations
+
+from pathlib import Path
+from typing import Any, Awaitable
+import asyncio
+import os
+
+from dotenv import load_dotenv
+from starlette.requests import Request
+
+load_dotenv(Path(__file__).resolve().parents[2] / ".env")
+
+CLIENT_DISCONNECT_POLL_SECONDS = float(os.getenv("CLIENT_DISCONNECT_POLL_SECONDS", "0.5"))
+
+# nginx's "client closed request"; never reaches the client, but shows up in access logs.
+CLIENT_CLOSED_REQUEST = 499
+
+_STATS: dict[str, int] = {}
+
+
+class ClientDisconnected(Exception):
+	"""The client went away before the response was ready; its work was cancelled."""
+
+	def __init__(self, route: str):
+		super().__init__(f"Client disconnected from {route}")
+		self.route = route
+
+
+def record(route: str) -> None:
+	_STATS[route] = _STATS.get(route, 0) + 1
+
+
+async def cancel_on_disconnect(request: Request, work: Awaitable[Any], route: str) -> Any:
+	"""Await ``work``, cancelling it and raising ClientDisconnected if the client disconnects first."""
+	task = asyncio.ensure_future(work)
+	try:
+		while True:
+			done, _ = await asyncio.wait({task}, timeout=CLIENT_DISCONNECT_POLL_SECONDS)
+			if done:
+				return task.result()
+			if await request.is_disconnected():
+				task.cancel()
+				# Let the work unwind (release its scheduler slot) before answering.
+				await asyncio.gather(task, return_exceptions=True)
+				record(route)
+				raise ClientDisconnected(route)
+	finally:
+		if not task.done():
+			# The handler itself was cancelled, e.g. on server shutdown.
+			task.cancel()
+
+
+def stats() -> dict[str, int]:
+	return {**_STATS, "total": sum(_STATS.values())}
@@ -0,0 +1,73 @@
+"""Circuit breaker.
+
+Guards a dependency that can be slow or down. After ``failure_threshold``
+consecutive failures the circuit opens and callers take their fallback at once
+instead of waiting on the dependency. After ``reset_seconds`` one probe call is
+let through (half-open); its success closes the circuit, its failure opens it
+again for another ``reset_seconds``.
+"""
+
+from __future__ import annotations
+
+from threading import Lock
+import time
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+
+class CircuitBreaker:
+	"""Thread-safe, so it can guard calls made from the event loop and from worker threads."""
+
+	def __init__(self, name: str, failure_threshold: int, reset_seconds: float):
+		self.name = name
+		self.failure_threshold = failure_threshold
+		self.reset_seconds = reset_seconds
+		self._state = CLOSED
+		self._failures = 0
+		self._opened_at = 0.0
+		self._probe_started_at = 0.0
+		self._lock = Lock()
+		self._stats = {"failures": 0, "opened": 0, "probes": 0, "rejected": 0}
+
+	def allow(self) -> bool:
+		"""Whether a call may go to the dependency now. False means: use the fallback."""
+		with self._lock:
+			if self._state == CLOSED:
+				return True
+			now = time.monotonic()
+			if self._state == OPEN and now - self._opened_at < self.reset_seconds:
+				self._stats["rejected"] += 1
+				return False
+			# A probe that never reported back (e.g. its caller was cancelled) is replaced.
+			if self._state == HALF_OPEN and now - self._probe_started_at < self.reset_seconds:
+				self._stats["rejected"] += 1
+				return False
+			self._state = HALF_OPEN
+			self._probe_started_at = now
+			self._stats["probes"] += 1
+			return True
+
+	def record_success(self) -> None:
+		with self._lock:
+			self._state = CLOSED
+			self._failures = 0
+
+	def record_failure(self) -> None:
+		with self._lock:
+			self._stats["failures"] += 1
+			self._failures += 1
+			if self._state == HALF_OPEN or self._failures >= self.failure_threshold:
+				if self._state != OPEN:
+					self._stats["opened"] += 1
+				self._state = OPEN
+				self._opened_at = time.monotonic()
+
+	@property
+	def state(self) -> str:
+		return self._state
+
+	def stats(self) -> dict[str, object]:
+		with self._lock:
+			return {**self._stats, "state": self._state, "consecutive_failures": self._failures}
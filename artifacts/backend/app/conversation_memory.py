@@ -0,0 +1,127 @@
+"""Conversation memory for chat sessions.
+
+The chat routes send the agent a bounded view of the session: the most recent
+messages verbatim, newest first until ``CHAT_HISTORY_TOKEN_BUDGET`` is spent,
+preceded by a rolling summary of everything older. After each answer the
+messages that have left the recent window are folded into the summary by a
+background agent run, so the prompt size stays flat however long a session
+gets. Until a fold finishes, messages between the summary and the window are
+left out rather than growing the prompt.
+"""
+
+from __future__ import annotations
+
+from pathlib import Path
+from typing import Any
+import asyncio
+import os
+
+from dotenv import load_dotenv
+
+from app import agent
+from app.tools.context import estimate_tokens
+
+load_dotenv(Path(__file__).resolve().parents[2] / ".env")
+
+CHAT_HISTORY_TOKEN_BUDGET = int(os.getenv("CHAT_HISTORY_TOKEN_BUDGET", "800"))
+
+_SPEAKERS = {"user": "Student", "assistant": "Study Buddy"}
+# Guard against a summarizer that ignores its word limit: six characters a word, twice over.
+_MAX_SUMMARY_CHARS = agent.CHAT_SUMMARY_MAX_WORDS * 12
+
+# session_id -> {"text": summary, "through_id": ID of the last message it covers}
+_SUMMARIES: dict[str, dict[str, str]] = {}
+_TASKS: dict[str, asyncio.Task] = {}
+_STATS = {"folds": 0, "failures": 0}
+
+
+def _line(message: dict[str, Any]) -> str:
+	return f"{_SPEAKERS.get(message['role'], message['role'])}: {message.get('content') or ''}"
+
+
+def _window_start(messages: list[dict[str, Any]], budget: int) -> int:
+	"""Index of the oldest message in the recent window that fits ``budget`` tokens."""
+	used = 0
+	for index in range(len(messages) - 1, -1, -1):
+		used += estimate_tokens(_line(messages[index]))
+		if used > budget:
+			# The newest message is always kept, trimmed if it alone is too long.
+			return index + 1 if index < len(messages) - 1 else index
+	return 0
+
+
+def _covered(session_id: str, messages: list[dict[str, Any]]) -> tuple[str, int]:
+	"""Return the session's summary and how many leading messages it covers.
+
+	A summary whose last message is no longer in the list (cleared history) is ignored.
+	"""
+	summary = _SUMMARIES.get(session_id)
+	if summary is not None:
+		for index, message in enumerate(messages):
+			if message["id"] == summary["through_id"]:
+				return summary["text"], index + 1
+	return "", 0
+
+
+def history_block(session_id: str, messages: list[dict[str, Any]]) -> str:
+	"""Format the memory to send with the next message; ``messages`` excludes that message.
+
+	Returns an empty string for a session without earlier messages.
+	"""
+	if not messages:
+		return ""
+	summary, covered = _covered(session_id, messages)
+	start = max(_window_start(messages, CHAT_HISTORY_TOKEN_BUDGET), covered)
+	lines = [_line(message) for message in messages[start:]]
+	if len(lines) == 1 and estimate_tokens(lines[0]) > CHAT_HISTORY_TOKEN_BUDGET:
+		lines = ["..." + lines[0][-CHAT_HISTORY_TOKEN_BUDGET * 4 :]]
+
+	parts = []
+	if summary:
+		parts.append(f"Summary of earlier messages: {summary}")
+	if lines:
+		parts.append("\n".join(lines))
+	return "\n\n".join(parts)
+
+
+async def _fold(session_id: str, messages: list[dict[str, Any]]) -> None:
+	# Loops because more messages may leave the window while a summary is being written.
+	while True:
+		summary, covered = _covered(session_id, messages)
+		start = _window_start(messages, CHAT_HISTORY_TOKEN_BUDGET)
+		if start <= covered:
+			return
+		folded = messages[covered:start]
+		try:
+			text = await agent.summarize_conversation(summary, "\n".join(_line(message) for message in folded))
+		except Exception:
+			# Keep the previous summary; the next answer schedules another attempt.
+			_STATS["failures"] += 1
+			return
+		_SUMMARIES[session_id] = {"text": text[:_MAX_SUMMARY_CHARS], "through_id": folded[-1]["id"]}
+		_STATS["folds"] += 1
+
+
+def schedule_update(session_id: str, messages: list[dict[str, Any]]) -> None:
+	"""Fold messages that left the recent window into the summary, in the background.
+
+	``messages`` is the session's live message list. At most one fold runs per session.
+	"""
+	task = _TASKS.get(session_id)
+	if task is not None and not task.done():
+		return
+	task = asyncio.create_task(_fold(session_id, messages))
+	_TASKS[session_id] = task
+	task.add_done_callback(lambda done: _TASKS.pop(session_id, None) if _TASKS.get(session_id) is done else None)
+
+
+def forget(session_id: str) -> None:
+	"""Drop a session's summary and stop any fold in progress."""
+	_SUMMARIES.pop(session_id, None)
+	task = _TASKS.pop(session_id, None)
+	if task is not None:
+		task.cancel()
+
+
+def stats() -> dict[str, int]:
+	return {**_STATS, "sessions": len(_SUMMARIES), "folding": len(_TASKS)}
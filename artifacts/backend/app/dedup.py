@@ -0,0 +1,168 @@
+"""Near-duplicate chunk detection.
+
+The vector store calls into this module at ingest to drop chunks that are
+near-duplicates (slide footers, repeated headers, copied handouts) of chunks
+already indexed for the same class. Uses MinHash signatures over word
+shingles and a banded LSH index per class.
+
+Each process caches a class's index together with the corpus version it
+reflects. An ingest that changed the class through the index advances that
+version after committing. A version changed by anything else, such as another
+worker, the CLI or a snapshot import, makes the next use rebuild the index
+from the store.
+"""
+
+from __future__ import annotations
+
+import hashlib
+import os
+import random
+import re
+from pathlib import Path
+from threading import Lock
+from typing import Callable, Iterable
+
+from dotenv import load_dotenv
+
+load_dotenv(Path(__file__).resolve().parents[2] / ".env")
+
+DEDUP_ENABLED = os.getenv("DEDUP_ENABLED", "true").lower() == "true"
+DEDUP_JACCARD_THRESHOLD = float(os.getenv("DEDUP_JACCARD_THRESHOLD", "0.85"))
+
+NUM_PERMUTATIONS = 64
+SHINGLE_SIZE = 5
+
+_MERSENNE_PRIME = (1 << 61) - 1
+_MAX_HASH = (1 << 32) - 1
+_rng = random.Random(1337)
+_PERMUTATIONS = [
+	(_rng.randrange(1, _MERSENNE_PRIME), _rng.randrange(0, _MERSENNE_PRIME))
+	for _ in range(NUM_PERMUTATIONS)
+]
+
+# class_id -> (corpus version, index)
+_INDEXES: dict[str, tuple[int, "LSHIndex"]] = {}
+_INDEXES_LOCK = Lock()
+
+
+def _shingles(text: str) -> set[int]:
+	words = re.findall(r"[a-z0-9]+", text.lower())
+	if len(words) <= SHINGLE_SIZE:
+		grams = [" ".join(words)]
+	else:
+		grams = [" ".join(words[i : i + SHINGLE_SIZE]) for i in range(len(words) - SHINGLE_SIZE + 1)]
+	return {
+		int.from_bytes(hashlib.blake2b(gram.encode("utf-8"), digest_size=4).digest(), "big")
+		for gram in grams
+	}
+
+
+def minhash(text: str) -> tuple[int, ...]:
+	shingles = _shingles(text)
+	return tuple(
+		min(((a * shingle + b) % _MERSENNE_PRIME) & _MAX_HASH for shingle in shingles)
+		for a, b in _PERMUTATIONS
+	)
+
+
+def estimate_jaccard(left: tuple[int, ...], right: tuple[int, ...]) -> float:
+	return sum(1 for x, y in zip(left, right) if x == y) / NUM_PERMUTATIONS
+
+
+def _band_layout(threshold: float) -> tuple[int, int]:
+	"""Pick (bands, rows) for the LSH index.
+
+	Takes the layout whose S-curve midpoint sits just below the threshold so
+	that true near-duplicates almost always become candidates; candidates are
+	then verified against the threshold with the full signature.
+	"""
+	best = (NUM_PERMUTATIONS, 1)
+	best_midpoint = 0.0
+	for rows in range(1, NUM_PERMUTATIONS + 1):
+		if NUM_PERMUTATIONS % rows:
+			continue
+		bands = NUM_PERMUTATIONS // rows
+		midpoint = (1 / bands) ** (1 / rows)
+		if best_midpoint < midpoint <= threshold - 0.05:
+			best, best_midpoint = (bands, rows), midpoint
+	return best
+
+
+class LSHIndex:
+	"""Banded MinHash LSH over chunk ids for a single class."""
+
+	def __init__(self, threshold: float = DEDUP_JACCARD_THRESHOLD):
+		self.threshold = threshold
+		self.bands, self.rows = _band_layout(threshold)
+		self._buckets: list[dict[tuple[int, ...], set[str]]] = [{} for _ in range(self.bands)]
+		self._signatures: dict[str, tuple[int, ...]] = {}
+		self._lock = Lock()
+
+	def _band_keys(self, signature: tuple[int, ...]) -> list[tuple[int, ...]]:
+		return [signature[band * self.rows : (band + 1) * self.rows] for band in range(self.bands)]
+
+	def add(self, key: str, signature: tuple[int, ...]) -> None:
+		with self._lock:
+			self._signatures[key] = signature
+			for buckets, band_key in zip(self._buckets, self._band_keys(signature)):
+				buckets.setdefault(band_key, set()).add(key)
+
+	def remove(self, key: str) -> None:
+		with self._lock:
+			signature = self._signatures.pop(key, None)
+			if signature is None:
+				return
+			for buckets, band_key in zip(self._buckets, self._band_keys(signature)):
+				members = buckets.get(band_key)
+				if members is not None:
+					members.discard(key)
+					if not members:
+						del buckets[band_key]
+
+	def find_duplicate(self, signature: tuple[int, ...]) -> str | None:
+		"""Return the id of an indexed chunk at or above the Jaccard threshold, if any."""
+		with self._lock:
+			candidates: set[str] = set()
+			for buckets, band_key in zip(self._buckets, self._band_keys(signature)):
+				candidates |= buckets.get(band_key, set())
+			for key in candidates:
+				if estimate_jaccard(signature, self._signatures[key]) >= self.threshold:
+					return key
+		return None
+
+	def __len__(self) -> int:
+		return len(self._signatures)
+
+
+def class_index(class_id: str, version: int, load_chunks: Callable[[], Iterable[tuple[str, str]]]) -> LSHIndex:
+	"""Return the class's LSH index at corpus ``version``, (re)building it from ``(id, text)`` pairs if needed."""
+	with _INDEXES_LOCK:
+		entry = _INDEXES.get(class_id)
+		if entry is None or entry[0] != version:
+			index = LSHIndex()
+			for chunk_id, text in load_chunks():
+				index.add(chunk_id, minhash(text))
+			entry = (version, index)
+			_INDEXES[class_id] = entry
+		return entry[1]
+
+
+def advance_class_index(class_id: str, before: int, after: int) -> None:
+	"""Record a committed ingest that moved the class from ``before`` to ``after`` through its index.
+
+	If anything else changed the class in between, the index is dropped instead.
+	"""
+	with _INDEXES_LOCK:
+		entry = _INDEXES.get(class_id)
+		if entry is None:
+			return
+		if entry[0] == before and after == before + 1:
+			_INDEXES[class_id] = (after, entry[1])
+		else:
+			del _INDEXES[class_id]
+
+
+def drop_class_index(class_id: str) -> None:
+	"""Forget a class's index so it is rebuilt from the store on next use."""
+	with _INDEXES_LOCK:
+		_INDEXES.pop(class_id, None)
@@ -0,0 +1,408 @@
+"""Online re-embedding migrations.
+
+Moves study_chunks to a new embedding model without downtime: a new
+generation gets its own vector column, background batches fill it (new
+ingests are dual-written meanwhile), queries keep using the active
+generation, and the new one is switched in atomically once every live
+chunk has been embedded. Progress is written to embedding_generations so
+it outlives the process that ran it. Used by the embeddings routes and
+manage.py.
+"""
+
+from __future__ import annotations
+
+from datetime import datetime, timezone
+from threading import Event, RLock, Thread
+from typing import Any, Callable
+import logging
+import re
+import time
+
+from app import vector_store
+
+logger = logging.getLogger(__name__)
+
+# pgvector cannot build HNSW (or IVFFlat) indexes on vector columns wider than this.
+_INDEX_MAX_DIMENSIONS = 2000
+# A persisted in-flight migration whose progress has not been written for this
+# long belongs to a process that is gone.
+_STALE_AFTER_SECONDS = 15 * 60
+_ACTIVE_STATUSES = ("running", "indexing", "switching")
+
+_MIGRATIONS: dict[str, dict[str, Any]] = {}
+_MIGRATIONS_LOCK = RLock()
+
+
+def _generation_name(model: str, dimensions: int) -> str:
+	slug = re.sub(r"[^a-z0-9]+", "_", model.lower()).strip("_")
+	return f"{slug}_{dimensions}"[:50]
+
+
+def _require_supabase() -> None:
+	if not vector_store._use_supabase_backend():
+		raise ValueError("Embedding migrations require the Supabase vector backend")
+
+
+def _count_remaining(cursor, column: str) -> int:
+	cursor.execute(f"SELECT COUNT(*) FROM study_chunks WHERE deleted_at IS NULL AND {column} IS NULL")
+	return cursor.fetchone()[0]
+
+
+def _other_migration_in_progress(cursor, name: str) -> bool:
+	cursor.execute(
+		"SELECT 1 FROM embedding_generations WHERE status = 'migrating' AND name <> %s LIMIT 1",
+		(name,),
+	)
+	return cursor.fetchone() is not None
+
+
+def _prepare_generation(model: str, dimensions: int) -> dict[str, Any]:
+	vector_store._ensure_supabase_schema()
+	name = _generation_name(model, dimensions)
+	column = f"embedding_{name}"
+
+	with vector_store._get_db_connection() as connection:
+		with connection.cursor() as cursor:
+			cursor.execute("SELECT status FROM embedding_generations WHERE name = %s", (name,))
+			row = cursor.fetchone()
+			if row and row[0] == "active":
+				raise ValueError(f"Embedding generation '{name}' is already active")
+			if _other_migration_in_progress(cursor, name):
+				raise ValueError("Another embedding migration is already in progress")
+
+			# Rows ingested after the switch only carry the new column, so no
+			# generation column can stay NOT NULL.
+			cursor.execute("ALTER TABLE study_chunks ALTER COLUMN embedding DROP NOT NULL")
+			cursor.execute(f"ALTER TABLE study_chunks ADD COLUMN IF NOT EXISTS {column} vector({int(dimensions)})")
+			cursor.execute(
+				"""
+				INSERT INTO embedding_generations (name, model, dimensions, column_name, status)
+				VALUES (%s, %s, %s, %s, 'migrating')
+				ON CONFLICT (name) DO UPDATE SET status = 'migrating'
+				""",
+				(name, model, dimensions, column),
+			)
+
+	vector_store._embedding_generations(refresh=True)
+	return {"name": name, "model": model, "dimensions": dimensions, "column_name": column, "status": "migrating"}
+
+
+def _backfill_batch(generation: dict[str, Any], batch_size: int) -> int:
+	from psycopg2.extras import execute_values
+
+	column = generation["column_name"]
+	with vector_store._get_db_connection() as connection:
+		with connection.cursor() as cursor:
+			cursor.execute(
+				f"""
+				SELECT id, content FROM study_chunks
+				WHERE deleted_at IS NULL AND {column} IS NULL
+				LIMIT %s
+				FOR UPDATE SKIP LOCKED
+				""",
+				(batch_size,),
+			)
+			rows = cursor.fetchall()
+			if not rows:
+				return 0
+
+			embeddings = vector_store._embed_texts([row[1] for row in rows], generation)
+			execute_values(
+				cursor,
+				f"""
+				UPDATE study_chunks AS chunk
+				SET {column} = data.embedding::vector
+				FROM (VALUES %s) AS data (id, embedding)
+				WHERE chunk.id = data.id::uuid
+				""",
+				[(str(row[0]), vector_store._to_pgvector_literal(vector)) for row, vector in zip(rows, embeddings)],
+			)
+			return len(rows)
+
+
+def _build_vector_index(generation: dict[str, Any]) -> None:
+	column = generation["column_name"]
+	if generation["dimensions"] > _INDEX_MAX_DIMENSIONS:
+		# Retrieval is filtered by class_id, so an exact scan of one class stays usable.
+		logger.warning(
+			"Skipping the vector index for %s: %d dimensions exceed pgvector's limit of %d",
+			generation["name"],
+			generation["dimensions"],
+			_INDEX_MAX_DIMENSIONS,
+		)
+		return
+	connection = vector_store._get_db_connection()
+	try:
+		# CREATE INDEX CONCURRENTLY cannot run inside a transaction block.
+		connection.autocommit = True
+		with connection.cursor() as cursor:
+			cursor.execute(
+				f"""
+				CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_study_chunks_{column}_hnsw
+				ON study_chunks USING hnsw ({column} vector_cosine_ops)
+				"""
+			)
+	finally:
+		connection.close()
+
+
+def _switch_generation(generation: dict[str, Any]) -> bool:
+	"""Activate the generation if every live chunk has a vector for it. Returns False otherwise."""
+	with vector_store._get_db_connection() as connection:
+		with connection.cursor() as cursor:
+			cursor.execute("LOCK TABLE embedding_generations IN EXCLUSIVE MODE")
+			# Block concurrent inserts while checking, so nothing slips in unembedded.
+			cursor.execute("LOCK TABLE study_chunks IN SHARE MODE")
+			if _count_remaining(cursor, generation["column_name"]):
+				return False
+			cursor.execute("UPDATE embedding_generations SET status = 'retired' WHERE status = 'active'")
+			cursor.execute(
+				"UPDATE embedding_generations SET status = 'active', activated_at = NOW() WHERE name = %s",
+				(generation["name"],),
+			)
+
+	vector_store._embedding_generations(refresh=True)
+	return True
+
+
+def _timestamp(value: str | None) -> datetime | None:
+	return datetime.fromisoformat(value).replace(tzinfo=timezone.utc) if value else None
+
+
+def _save_progress(state: dict[str, Any]) -> None:
+	generation = state["generation"]
+	with vector_store._get_db_connection() as connection:
+		with connection.cursor() as cursor:
+			cursor.execute(
+				"""
+				UPDATE embedding_generations
+				SET migration_status = %s, migration_total = %s, migration_embedded = %s,
+					migration_error = %s, migration_started_at = %s, migration_completed_at = %s,
+					migration_updated_at = NOW()
+				WHERE name = %s
+				""",
+				(
+					state["status"],
+					state["total"],
+					state["embedded"],
+					state["error"],
+					_timestamp(state["started_at"]),
+					_timestamp(state["completed_at"]),
+					generation["name"],
+				),
+			)
+
+
+def _load_progress(name: str) -> dict[str, Any] | None:
+	"""The persisted status of a migration this process is not running, or None."""
+	if not vector_store._use_supabase_backend():
+		return None
+	vector_store._ensure_supabase_schema()
+	with vector_store._get_db_connection() as connection:
+		with connection.cursor() as cursor:
+			cursor.execute(
+				"""
+				SELECT model, dimensions, migration_status, migration_total, migration_embedded,
+					migration_error, migration_started_at, migration_completed_at,
+					migration_updated_at < NOW() - make_interval(secs => %s)
+				FROM embedding_generations
+				WHERE name = %s AND migration_status IS NOT NULL
+				""",
+				(_STALE_AFTER_SECONDS, name),
+			)
+			row = cursor.fetchone()
+	if row is None:
+		return None
+	model, dimensions, status, total, embedded, error, started_at, completed_at, stale = row
+	if status in _ACTIVE_STATUSES and stale:
+		status = "interrupted"
+	remaining = max(total - embedded, 0)
+	return {
+		"name": name,
+		"model": model,
+		"dimensions": dimensions,
+		"status": status,
+		"total": total,
+		"embedded": embedded,
+		"remaining": remaining,
+		"progress": round(embedded / total, 4) if total else 1.0,
+		"rows_per_second": 0.0,
+		"eta_seconds": None,
+		"started_at": started_at.isoformat(),
+		"completed_at": completed_at.isoformat() if completed_at else None,
+		"error": error,
+	}
+
+
+def _set_status(state: dict[str, Any], status: str) -> None:
+	state["status"] = status
+	_save_progress(state)
+
+
+def _run_migration(state: dict[str, Any], batch_size: int, rows_per_second: float, stop: Event) -> None:
+	generation = state["generation"]
+	try:
+		while not stop.is_set():
+			started = time.monotonic()
+			embedded = _backfill_batch(generation, batch_size)
+			if embedded:
+				state["embedded"] += embedded
+				state["remaining"] = max(state["total"] - state["embedded"], 0)
+				elapsed = time.monotonic() - state["started_monotonic"]
+				migrated = state["embedded"] - state["embedded_at_start"]
+				state["rows_per_second"] = round(migrated / elapsed, 2) if elapsed else 0.0
+				_save_progress(state)
+				# Throttle to the configured rate so migration does not starve live traffic.
+				pause = embedded / rows_per_second - (time.monotonic() - started) if rows_per_second else 0
+				if pause > 0:
+					stop.wait(pause)
+				continue
+
+			_set_status(state, "indexing")
+			_build_vector_index(generation)
+			_set_status(state, "switching")
+			if _switch_generation(generation):
+				state["remaining"] = 0
+				state["completed_at"] = datetime.utcnow().isoformat()
+				_set_status(state, "completed")
+				return
+			# Chunks were ingested between the last batch and the switch; keep going.
+			_set_status(state, "running")
+
+		_set_status(state, "stopped")
+	except Exception as error:
+		state["status"] = "failed"
+		state["error"] = str(error)
+		try:
+			_save_progress(state)
+		except Exception:
+			logger.exception("Could not record the failure of embedding migration %s", generation["name"])
+
+
+def start_migration(
+	model: str,
+	dimensions: int,
+	batch_size: int = 100,
+	rows_per_second: float = 200.0,
+	background: bool = True,
+	on_progress: Callable[[dict[str, Any]], None] | None = None,
+) -> dict[str, Any]:
+	"""Start re-embedding every live chunk with ``model`` and return the migration status.
+
+	With ``background`` the backfill runs on a daemon thread; otherwise it runs
+	in the caller (the CLI) and ``on_progress`` is called every few seconds.
+	"""
+	_require_supabase()
+	generation = _prepare_generation(model, dimensions)
+
+	with _MIGRATIONS_LOCK:
+		existing = _MIGRATIONS.get(generation["name"])
+		if existing and existing["status"] in ("running", "indexing", "switching"):
+			return migration_status(generation["name"])
+
+		with vector_store._get_db_connection() as connection:
+			with connection.cursor() as cursor:
+				cursor.execute("SELECT COUNT(*) FROM study_chunks WHERE deleted_at IS NULL")
+				total = cursor.fetchone()[0]
+				remaining = _count_remaining(cursor, generation["column_name"])
+
+		state = {
+			"generation": generation,
+			"status": "running",
+			"total": total,
+			"embedded": total - remaining,
+			# Throughput only counts rows embedded by this run, not by earlier ones.
+			"embedded_at_start": total - remaining,
+			"remaining": remaining,
+			"rows_per_second": 0.0,
+			"started_at": datetime.utcnow().isoformat(),
+			"started_monotonic": time.monotonic(),
+			"completed_at": None,
+			"error": None,
+			"stop": Event(),
+		}
+		_MIGRATIONS[generation["name"]] = state
+		_save_progress(state)
+
+	if background:
+		Thread(
+			target=_run_migration,
+			args=(state, batch_size, rows_per_second, state["stop"]),
+			name=f"embedding-migration-{generation['name']}",
+			daemon=True,
+		).start()
+		return migration_status(generation["name"])
+
+	worker = Thread(target=_run_migration, args=(state, batch_size, rows_per_second, state["stop"]))
+	worker.start()
+	while worker.is_alive():
+		worker.join(timeout=5)
+		if on_progress:
+			on_progress(migration_status(generation["name"]))
+	return migration_status(generation["name"])
+
+
+def stop_migration(name: str) -> dict[str, Any]:
+	"""Ask a running migration to stop after its current batch. It can be restarted later."""
+	with _MIGRATIONS_LOCK:
+		state = _MIGRATIONS.get(name)
+		if state is None:
+			raise KeyError(name)
+		state["stop"].set()
+	return migration_status(name)
+
+
+def migration_status(name: str) -> dict[str, Any]:
+	"""Status of a migration; ones this process is not running are read from the database."""
+	with _MIGRATIONS_LOCK:
+		state = _MIGRATIONS.get(name)
+	if state is None:
+		persisted = _load_progress(name)
+		if persisted is None:
+			raise KeyError(name)
+		return persisted
+
+	with _MIGRATIONS_LOCK:
+		generation = state["generation"]
+		rate = state["rows_per_second"]
+		return {
+			"name": name,
+			"model": generation["model"],
+			"dimensions": generation["dimensions"],
+			"status": state["status"],
+			"total": state["total"],
+			"embedded": state["embedded"],
+			"remaining": state["remaining"],
+			"progress": round(state["embedded"] / state["total"], 4) if state["total"] else 1.0,
+			"rows_per_second": rate,
+			"eta_seconds": round(state["remaining"] / rate, 1) if rate else None,
+			"started_at": state["started_at"],
+			"completed_at": state["completed_at"],
+			"error": state["error"],
+		}
+
+
+def list_generations() -> list[dict[str, Any]]:
+	_require_supabase()
+	vector_store._ensure_supabase_schema()
+	with vector_store._get_db_connection() as connection:
+		with connection.cursor() as cursor:
+			cursor.execute(
+				"""
+				SELECT name, model, dimensions, status, created_at, activated_at
+				FROM embedding_generations
+				ORDER BY created_at
+				"""
+			)
+			rows = cursor.fetchall()
+	return [
+		{
+			"name": row[0],
+			"model": row[1],
+			"dimensions": row[2],
+			"status": row[3],
+			"created_at": row[4].isoformat() if row[4] else None,
+			"activated_at": row[5].isoformat() if row[5] else None,
+		}
+		for row in rows
+	]
@@ -0,0 +1,64 @@
+"""Generation result cache.
+
+The orchestrator checks here before running a flashcard or quiz generation.
+Entries are keyed by the request parameters, the prompt version and the
+class's corpus version, so ingesting new material invalidates them without
+an explicit purge. Least recently used entries are evicted past the size bound.
+"""
+
+from __future__ import annotations
+
+from collections import OrderedDict
+from pathlib import Path
+from threading import Lock
+from typing import Any, Hashable
+import copy
+import os
+
+from dotenv import load_dotenv
+
+load_dotenv(Path(__file__).resolve().parents[2] / ".env")
+
+GENERATION_CACHE_ENABLED = os.getenv("GENERATION_CACHE_ENABLED", "true").lower() == "true"
+GENERATION_CACHE_MAX_ENTRIES = int(os.getenv("GENERATION_CACHE_MAX_ENTRIES", "256"))
+
+_ENTRIES: OrderedDict[Hashable, Any] = OrderedDict()
+_LOCK = Lock()
+
+
+def normalize_focus(focus: str | None) -> str:
+	"""Case- and whitespace-insensitive form of a focus prompt."""
+	return " ".join((focus or "").lower().split())
+
+
+def cache_key(
+	mode: str,
+	class_id: str,
+	focus: str | None,
+	count: int,
+	prompt_version: str,
+	corpus_version: int,
+) -> tuple:
+	return (mode, class_id, normalize_focus(focus), count, prompt_version, corpus_version)
+
+
+def get(key: Hashable) -> Any | None:
+	with _LOCK:
+		if key not in _ENTRIES:
+			return None
+		_ENTRIES.move_to_end(key)
+		# Callers may mutate what they get back; the cached copy stays intact.
+		return copy.deepcopy(_ENTRIES[key])
+
+
+def put(key: Hashable, value: Any) -> None:
+	with _LOCK:
+		_ENTRIES[key] = copy.deepcopy(value)
+		_ENTRIES.move_to_end(key)
+		while len(_ENTRIES) > GENERATION_CACHE_MAX_ENTRIES:
+			_ENTRIES.popitem(last=False)
+
+
+def clear() -> None:
+	with _LOCK:
+		_ENTRIES.clear()
@@ -0,0 +1,243 @@
+"""Pre-generated flashcard and quiz question pools.
+
+After ingest, the orchestrator fills a pool per class in the background: each
+source document is cut into windows of consecutive chunks and a small batch of
+flashcards and questions is generated per window, at the LLM scheduler's
+background priority. Items are stored in the application database tagged with
+their source and the content hashes of the chunks they came from. Requests
+are then served by sampling the pool; a request whose focus the pool does not
+cover enough falls back to live generation.
+
+A refresh drops items whose chunks were removed or whose prompt changed, and
+only generates for windows with chunks no remaining item covers, so
+re-ingesting a file costs model calls for the changed parts only.
+"""
+
+from __future__ import annotations
+
+from pathlib import Path
+from threading import Lock
+from typing import Any, Awaitable, Callable
+import asyncio
+import json
+import os
+import random
+import uuid
+
+from dotenv import load_dotenv
+from sqlalchemy import func
+from sqlalchemy.exc import SQLAlchemyError
+
+from app import vector_store
+from app.db import SessionLocal, init_db
+from app.models.database import PoolItem
+from app.tools.context import estimate_tokens
+
+load_dotenv(Path(__file__).resolve().parents[2] / ".env")
+
+GENERATION_POOL_ENABLED = os.getenv("GENERATION_POOL_ENABLED", "true").lower() == "true"
+GENERATION_POOL_ITEMS_PER_WINDOW = int(os.getenv("GENERATION_POOL_ITEMS_PER_WINDOW", "5"))
+# Windows generated per kind in one refresh; the rest are picked up by later refreshes.
+GENERATION_POOL_MAX_WINDOWS = int(os.getenv("GENERATION_POOL_MAX_WINDOWS", "20"))
+GENERATION_POOL_CONCURRENCY = int(os.getenv("GENERATION_POOL_CONCURRENCY", "2"))
+
+# Focus words shorter than this are ignored when matching items to a focus.
+_MIN_FOCUS_TOKEN_LENGTH = 3
+
+_schema_ready = False
+_schema_lock = Lock()
+_REFRESHES: dict[str, asyncio.Task] = {}
+_PENDING: set[str] = set()
+_STATS = {"hits": 0, "misses": 0, "generated": 0, "refreshes": 0, "failed_refreshes": 0, "failed_windows": 0}
+
+
+def _ensure_schema() -> None:
+	global _schema_ready
+	if _schema_ready:
+		return
+	with _schema_lock:
+		if not _schema_ready:
+			init_db()
+			_schema_ready = True
+
+
+def plan_windows(
+	chunks: list[dict[str, Any]],
+	covered: set[str],
+	budget: int,
+	max_windows: int = GENERATION_POOL_MAX_WINDOWS,
+) -> list[list[dict[str, Any]]]:
+	"""Cut each source's chunks into windows of about ``budget`` tokens and return those to generate.
+
+	A window is returned if any of its chunks is not in ``covered``. Windows
+	are taken round-robin across sources, so every document gets items before
+	any document gets many.
+	"""
+	by_source: dict[str, list[list[dict[str, Any]]]] = {}
+	window_tokens: dict[str, int] = {}
+	for chunk in chunks:
+		windows = by_source.setdefault(chunk["source"], [[]])
+		tokens = estimate_tokens(chunk["text"])
+		if windows[-1] and window_tokens[chunk["source"]] + tokens > budget:
+			windows.append([])
+			window_tokens[chunk["source"]] = 0
+		windows[-1].append(chunk)
+		window_tokens[chunk["source"]] = window_tokens.get(chunk["source"], 0) + tokens
+
+	pending = [
+		[window for window in windows if any(c["content_hash"] not in covered for c in window)]
+		for windows in by_source.values()
+	]
+	planned: list[list[dict[str, Any]]] = []
+	for position in range(max((len(windows) for windows in pending), default=0)):
+		for windows in pending:
+			if position < len(windows) and len(planned) < max_windows:
+				planned.append(windows[position])
+	return planned
+
+
+def prune(class_id: str, prompt_versions: dict[str, str], live_hashes: set[str]) -> dict[str, set[str]]:
+	"""Delete items whose prompt changed or whose chunks are gone.
+
+	Returns, per kind, the chunk hashes the remaining items cover.
+	"""
+	_ensure_schema()
+	covered: dict[str, set[str]] = {}
+	with SessionLocal() as session:
+		for row in session.query(PoolItem).filter(PoolItem.class_id == class_id):
+			hashes = set(json.loads(row.chunk_hashes_json))
+			if row.prompt_version != prompt_versions.get(row.kind) or not hashes <= live_hashes:
+				session.delete(row)
+			else:
+				covered.setdefault(row.kind, set()).update(hashes)
+		session.commit()
+	return covered
+
+
+def add_items(
+	class_id: str,
+	kind: str,
+	source: str,
+	prompt_version: str,
+	chunk_hashes: list[str],
+	keyed_items: list[tuple[str, dict[str, Any]]],
+) -> int:
+	"""Store ``(key, item)`` pairs generated from one window, skipping keys the pool already has."""
+	_ensure_schema()
+	with SessionLocal() as session:
+		existing = {
+			key
+			for (key,) in session.query(PoolItem.item_key).filter(
+				PoolItem.class_id == class_id,
+				PoolItem.kind == kind,
+			)
+		}
+		added = 0
+		for key, item in keyed_items:
+			if not key or key in existing:
+				continue
+			existing.add(key)
+			session.add(
+				PoolItem(
+					id=str(uuid.uuid4()),
+					class_id=class_id,
+					kind=kind,
+					source=source,
+					prompt_version=prompt_version,
+					item_key=key,
+					chunk_hashes_json=json.dumps(chunk_hashes),
+					item_json=json.dumps(item),
+				)
+			)
+			added += 1
+		session.commit()
+	_STATS["generated"] += added
+	return added
+
+
+def _matches_focus(item: dict[str, Any], focus_tokens: set[str]) -> bool:
+	text = " ".join(str(value) for value in item.values())
+	return focus_tokens <= set(vector_store._tokenize(text))
+
+
+def sample(
+	class_id: str,
+	kind: str,
+	prompt_version: str,
+	count: int | None,
+	focus: str | None = None,
+	source: str | None = None,
+) -> list[dict[str, Any]] | None:
+	"""Return ``count`` random pooled items, or None if the pool cannot cover the request.
+
+	Without a focus the database draws the sample, so only ``count`` rows are
+	read. With a focus, rows are narrowed in SQL to those containing every
+	focus word and then checked word by word. A database error is treated as
+	a miss so requests fall back to live generation. A request without a
+	count is always a miss.
+	"""
+	if not count or count <= 0:
+		_STATS["misses"] += 1
+		return None
+
+	focus_tokens = {
+		token for token in vector_store._tokenize(focus or "") if len(token) >= _MIN_FOCUS_TOKEN_LENGTH
+	}
+	try:
+		_ensure_schema()
+		with SessionLocal() as session:
+			query = session.query(PoolItem.item_json).filter(
+				PoolItem.class_id == class_id,
+				PoolItem.kind == kind,
+				PoolItem.prompt_version == prompt_version,
+			)
+			if source is not None:
+				query = query.filter(PoolItem.source == source)
+			if focus_tokens:
+				for token in focus_tokens:
+					query = query.filter(func.lower(PoolItem.item_json).contains(token, autoescape=True))
+				items = [json.loads(item_json) for (item_json,) in query]
+				items = [item for item in items if _matches_focus(item, focus_tokens)]
+				items = random.sample(items, count) if len(items) >= count else []
+			else:
+				items = [json.loads(item_json) for (item_json,) in query.order_by(func.random()).limit(count)]
+	except SQLAlchemyError:
+		items = []
+
+	if len(items) < count:
+		_STATS["misses"] += 1
+		return None
+	_STATS["hits"] += 1
+	return items
+
+
+async def _run_refreshes(class_id: str, refresh: Callable[[], Awaitable[dict[str, int]]]) -> None:
+	try:
+		# Corpus changes that arrive during a refresh are handled by one more pass.
+		while True:
+			_PENDING.discard(class_id)
+			try:
+				result = await refresh()
+			except Exception:
+				_STATS["failed_refreshes"] += 1
+			else:
+				_STATS["refreshes"] += 1
+				_STATS["failed_windows"] += result.get("failed", 0)
+			if class_id not in _PENDING:
+				return
+	finally:
+		if _REFRESHES.get(class_id) is asyncio.current_task():
+			del _REFRESHES[class_id]
+
+
+def schedule_refresh(class_id: str, refresh: Callable[[], Awaitable[dict[str, int]]]) -> None:
+	"""Run ``refresh()`` for the class in the background; at most one runs per class at a time."""
+	task = _REFRESHES.get(class_id)
+	if task is not None and not task.done():
+		_PENDING.add(class_id)
+		return
+	_REFRESHES[class_id] = asyncio.create_task(_run_refreshes(class_id, refresh))
+
+
+def stats() -> dict[str, int]:
+	return {**_STATS, "refreshing": len(_REFRESHES)}
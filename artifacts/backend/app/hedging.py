@@ -0,0 +1,90 @@
+"""Hedged model calls.
+
+Interactive chat runs can be hedged to cut tail latency: if a run has not
+finished within a delay taken from the model's rolling latency percentile, an
+identical second run is started, the first to finish is used and the other is
+cancelled. Hedges are capped at a share of all hedgeable runs and are only
+fired when the LLM scheduler has a free slot, so they never queue behind
+(or in front of) other requests.
+"""
+
+from __future__ import annotations
+
+from pathlib import Path
+from typing import Any, Awaitable, Callable
+import asyncio
+import os
+
+from dotenv import load_dotenv
+
+load_dotenv(Path(__file__).resolve().parents[2] / ".env")
+
+LLM_HEDGE_ENABLED = os.getenv("LLM_HEDGE_ENABLED", "false").lower() == "true"
+LLM_HEDGE_MODES = {mode.strip() for mode in os.getenv("LLM_HEDGE_MODES", "chat").split(",") if mode.strip()}
+# A run is hedged once it has taken longer than this share of its model's recent runs.
+LLM_HEDGE_PERCENTILE = float(os.getenv("LLM_HEDGE_PERCENTILE", "0.95"))
+LLM_HEDGE_MIN_DELAY_SECONDS = float(os.getenv("LLM_HEDGE_MIN_DELAY_SECONDS", "1"))
+# At most this share of hedgeable runs may fire a hedge.
+LLM_HEDGE_BUDGET = float(os.getenv("LLM_HEDGE_BUDGET", "0.05"))
+
+
+class Hedger:
+	"""Fires a backup run for slow calls, within a budget. Use from a single event loop."""
+
+	def __init__(self, budget: float = LLM_HEDGE_BUDGET):
+		self.budget = budget
+		self._stats = {"runs": 0, "fired": 0, "won": 0, "over_budget": 0, "busy": 0}
+
+	def _may_fire(self, has_capacity: Callable[[], bool]) -> bool:
+		if self._stats["fired"] + 1 > self.budget * self._stats["runs"]:
+			self._stats["over_budget"] += 1
+			return False
+		if not has_capacity():
+			self._stats["busy"] += 1
+			return False
+		return True
+
+	async def run(
+		self,
+		factory: Callable[[], Awaitable[Any]],
+		delay: float | None,
+		has_capacity: Callable[[], bool] = lambda: True,
+	) -> Any:
+		"""Return the result of ``factory()``, starting a second call after ``delay`` seconds.
+
+		``delay`` of None runs the call unhedged. If one call fails the other is
+		still awaited; the first error is raised only if both fail.
+		"""
+		self._stats["runs"] += 1
+		primary = asyncio.ensure_future(factory())
+		if delay is None:
+			return await primary
+
+		hedge = None
+		try:
+			done, _ = await asyncio.wait({primary}, timeout=delay)
+			if done or not self._may_fire(has_capacity):
+				return await primary
+
+			hedge = asyncio.ensure_future(factory())
+			self._stats["fired"] += 1
+			pending = {primary, hedge}
+			error: BaseException | None = None
+			while pending:
+				done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+				for task in (primary, hedge):
+					if task not in done:
+						continue
+					if task.exception() is None:
+						if task is hedge:
+							self._stats["won"] += 1
+						return task.result()
+					error = error or task.exception()
+			raise error
+		finally:
+			for task in (primary, hedge):
+				if task is not None and not task.done():
+					task.cancel()
+
+	def stats(self) -> dict[str, int]:
+		return dict(self._stats)
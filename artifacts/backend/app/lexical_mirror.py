@@ -0,0 +1,94 @@
+"""Lexical mirror of the Supabase chunk index.
+
+The vector store keeps a local copy of every class's live chunks (text,
+position and tokens) so retrieval can fall back to lexical overlap scoring
+when the embeddings API or pgvector is unavailable. The mirror is rebuilt
+from the database after each ingest or snapshot import that changes a class,
+stored as one JSON file per class, and served from an in-memory inverted
+index, so a fallback lookup never touches the network. A lookup reloads the
+index when the file's mtime has changed, so every worker serves the mirror
+another worker last wrote.
+"""
+
+from __future__ import annotations
+
+from collections import Counter
+from pathlib import Path
+from threading import Lock
+from typing import Any
+import hashlib
+import json
+
+LEXICAL_MIRROR_PATH = Path(__file__).resolve().parents[1] / "data" / "lexical_mirror"
+
+# class_id -> {"chunks": [...], "postings": {token: [chunk position, ...]}, "mtime": file mtime_ns}
+_INDEXES: dict[str, dict[str, Any]] = {}
+_LOCK = Lock()
+
+
+def _path(class_id: str) -> Path:
+	return LEXICAL_MIRROR_PATH / f"{hashlib.sha256(class_id.encode('utf-8')).hexdigest()[:24]}.json"
+
+
+def _index(chunks: list[dict[str, Any]]) -> dict[str, Any]:
+	postings: dict[str, list[int]] = {}
+	for position, chunk in enumerate(chunks):
+		for token in set(chunk["tokens"]):
+			postings.setdefault(token, []).append(position)
+	return {"chunks": chunks, "postings": postings}
+
+
+def replace(class_id: str, chunks: list[dict[str, Any]]) -> None:
+	"""Replace the class's mirror with ``chunks`` (retrieval fields plus ``tokens``)."""
+	LEXICAL_MIRROR_PATH.mkdir(parents=True, exist_ok=True)
+	path = _path(class_id)
+	staging = path.with_suffix(".tmp")
+	staging.write_text(json.dumps({"class_id": class_id, "chunks": chunks}), encoding="utf-8")
+	index = _index(chunks)
+	with _LOCK:
+		staging.replace(path)
+		index["mtime"] = path.stat().st_mtime_ns
+		_INDEXES[class_id] = index
+
+
+def _class_index(class_id: str) -> dict[str, Any] | None:
+	path = _path(class_id)
+	with _LOCK:
+		try:
+			mtime = path.stat().st_mtime_ns
+		except FileNotFoundError:
+			_INDEXES.pop(class_id, None)
+			return None
+		index = _INDEXES.get(class_id)
+		if index is None or index["mtime"] != mtime:
+			index = _index(json.loads(path.read_text(encoding="utf-8"))["chunks"])
+			index["mtime"] = mtime
+			_INDEXES[class_id] = index
+		return index
+
+
+def has_class(class_id: str) -> bool:
+	return _class_index(class_id) is not None
+
+
+def search(class_id: str, query_tokens: set[str], top_k: int) -> list[tuple[int, dict[str, Any]]]:
+	"""Return ``(score, chunk)`` for the best ``top_k`` chunks by query token overlap.
+
+	Like the local backend, the class's last ``top_k`` chunks are returned
+	with score 0 when no chunk shares a token with the query.
+	"""
+	index = _class_index(class_id)
+	if index is None or not index["chunks"]:
+		return []
+	scores: Counter[int] = Counter()
+	for token in query_tokens:
+		for position in index["postings"].get(token, ()):
+			scores[position] += 1
+	if not scores:
+		return [(0, chunk) for chunk in index["chunks"][-top_k:]]
+	return [(score, index["chunks"][position]) for position, score in scores.most_common(top_k)]
+
+
+def stats() -> dict[str, int]:
+	with _LOCK:
+		return {"classes_loaded": len(_INDEXES), "chunks_loaded": sum(len(i["chunks"]) for i in _INDEXES.values())}
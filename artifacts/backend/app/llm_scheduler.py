@@ -0,0 +1,242 @@
+"""LLM call scheduler.
+
+Every agent run goes through the scheduler, which bounds how many model calls
+are in flight and how many tokens they spend per minute. Callers beyond the
+limits wait in a bounded priority queue (interactive chat before bulk
+generation before background work); when the queue is full they are turned
+away at once with a retry hint. Provider 429s pause dispatch, halve the
+concurrency limit and retry; successful calls grow the limit back.
+"""
+
+from __future__ import annotations
+
+from collections import deque
+from contextlib import asynccontextmanager
+from pathlib import Path
+from typing import Any, AsyncIterator, Awaitable, Callable
+import asyncio
+import heapq
+import itertools
+import math
+import os
+import time
+
+import openai
+from dotenv import load_dotenv
+
+load_dotenv(Path(__file__).resolve().parents[2] / ".env")
+
+LLM_MAX_CONCURRENCY = int(os.getenv("LLM_MAX_CONCURRENCY", "8"))
+# 0 disables the token budget.
+LLM_TOKENS_PER_MINUTE = int(os.getenv("LLM_TOKENS_PER_MINUTE", "0"))
+LLM_MAX_QUEUE = int(os.getenv("LLM_MAX_QUEUE", "64"))
+LLM_QUEUE_TIMEOUT_SECONDS = float(os.getenv("LLM_QUEUE_TIMEOUT_SECONDS", "30"))
+LLM_MAX_RETRIES = int(os.getenv("LLM_MAX_RETRIES", "3"))
+
+INTERACTIVE = 0
+BULK = 1
+BACKGROUND = 2
+
+_WINDOW_SECONDS = 60.0
+_MAX_BACKOFF_SECONDS = 60.0
+
+
+class SchedulerBusy(Exception):
+	"""The scheduler cannot take the call now; retry after ``retry_after`` seconds."""
+
+	def __init__(self, retry_after: float):
+		super().__init__(f"LLM capacity exhausted, retry after {retry_after:.0f}s")
+		self.retry_after = max(1, math.ceil(retry_after))
+
+
+def _usage_tokens(result: Any) -> int | None:
+	usage = getattr(getattr(result, "context_wrapper", None), "usage", None)
+	return getattr(usage, "total_tokens", None) or None
+
+
+def _retry_after_header(error: openai.RateLimitError) -> float | None:
+	response = getattr(error, "response", None)
+	value = response.headers.get("retry-after") if response is not None else None
+	try:
+		return float(value) if value is not None else None
+	except ValueError:
+		return None
+
+
+class LLMScheduler:
+	"""Admission control for model calls. Use from a single event loop."""
+
+	def __init__(
+		self,
+		max_concurrency: int = LLM_MAX_CONCURRENCY,
+		tokens_per_minute: int = LLM_TOKENS_PER_MINUTE,
+		max_queue: int = LLM_MAX_QUEUE,
+	):
+		self.max_concurrency = max_concurrency
+		self.tokens_per_minute = tokens_per_minute
+		self.max_queue = max_queue
+		self._limit = max_concurrency
+		self._active = 0
+		self._queue: list[tuple[int, int, asyncio.Future, int]] = []
+		self._sequence = itertools.count()
+		# [started_at, tokens] per admitted call over the last minute.
+		self._window: deque[list[float]] = deque()
+		self._paused_until = 0.0
+		self._consecutive_rate_limits = 0
+		self._timer: asyncio.TimerHandle | None = None
+		self._average_seconds = 5.0
+		self._stats = {"admitted": 0, "queued": 0, "rejected": 0, "rate_limited": 0}
+
+	def _window_tokens(self, now: float) -> int:
+		while self._window and now - self._window[0][0] >= _WINDOW_SECONDS:
+			self._window.popleft()
+		return sum(int(entry[1]) for entry in self._window)
+
+	def _delay(self, tokens: int, now: float) -> float:
+		"""Seconds until a call of ``tokens`` may start, ignoring the concurrency limit."""
+		if now < self._paused_until:
+			return self._paused_until - now
+		if self.tokens_per_minute and self._window:
+			used = self._window_tokens(now)
+			# A call larger than the whole budget is let through on an empty window.
+			if used and used + tokens > self.tokens_per_minute:
+				return max(_WINDOW_SECONDS - (now - self._window[0][0]), 0.01)
+		return 0.0
+
+	def _start(self, tokens: int, now: float) -> list[float]:
+		self._active += 1
+		self._stats["admitted"] += 1
+		entry = [now, tokens]
+		self._window.append(entry)
+		return entry
+
+	def _wake_later(self, delay: float) -> None:
+		if self._timer is not None:
+			self._timer.cancel()
+		self._timer = asyncio.get_running_loop().call_later(delay, self._dispatch)
+
+	def _dispatch(self) -> None:
+		self._timer = None
+		now = time.monotonic()
+		while self._queue:
+			_, _, future, tokens = self._queue[0]
+			if future.done():
+				# The waiter timed out or went away.
+				heapq.heappop(self._queue)
+				continue
+			if self._active >= self._limit:
+				return
+			delay = self._delay(tokens, now)
+			if delay > 0:
+				self._wake_later(delay)
+				return
+			heapq.heappop(self._queue)
+			future.set_result(self._start(tokens, now))
+
+	def retry_after(self) -> float:
+		"""Rough wait until a newly queued call would start."""
+		now = time.monotonic()
+		backlog = len(self._queue) / max(self._limit, 1) * self._average_seconds
+		return max(self._paused_until - now, backlog, 1.0)
+
+	def check_admission(self) -> None:
+		"""Raise SchedulerBusy right away if a new call would not even be queued."""
+		if len(self._queue) >= self.max_queue:
+			self._stats["rejected"] += 1
+			raise SchedulerBusy(self.retry_after())
+
+	def has_free_slot(self) -> bool:
+		"""Whether a call could start right now without waiting."""
+		return not self._queue and self._active < self._limit and time.monotonic() >= self._paused_until
+
+	async def acquire(self, priority: int, tokens: int) -> list[float]:
+		now = time.monotonic()
+		if not self._queue and self._active < self._limit and self._delay(tokens, now) == 0:
+			return self._start(tokens, now)
+
+		self.check_admission()
+		future = asyncio.get_running_loop().create_future()
+		heapq.heappush(self._queue, (priority, next(self._sequence), future, tokens))
+		self._stats["queued"] += 1
+		self._dispatch()
+		try:
+			return await asyncio.wait_for(future, LLM_QUEUE_TIMEOUT_SECONDS)
+		except TimeoutError:
+			self._stats["rejected"] += 1
+			raise SchedulerBusy(self.retry_after())
+		except asyncio.CancelledError:
+			# Admitted just as the caller went away: hand the slot on.
+			if future.done() and not future.cancelled():
+				self.release(future.result())
+			raise
+
+	def release(self, entry: list[float], tokens: int | None = None) -> None:
+		self._active -= 1
+		if tokens is not None:
+			entry[1] = tokens
+		elapsed = time.monotonic() - entry[0]
+		self._average_seconds = 0.8 * self._average_seconds + 0.2 * elapsed
+		self._dispatch()
+
+	def rate_limited(self, retry_after: float | None = None) -> float:
+		"""Record a provider 429: pause dispatch and halve concurrency. Returns the pause."""
+		self._consecutive_rate_limits += 1
+		self._stats["rate_limited"] += 1
+		backoff = min(2.0 ** self._consecutive_rate_limits, _MAX_BACKOFF_SECONDS)
+		pause = max(retry_after or 0.0, backoff)
+		self._paused_until = max(self._paused_until, time.monotonic() + pause)
+		self._limit = max(1, self._limit // 2)
+		return pause
+
+	def succeeded(self) -> None:
+		self._consecutive_rate_limits = 0
+		if self._limit < self.max_concurrency:
+			self._limit += 1
+
+	async def run(self, factory: Callable[[], Awaitable[Any]], priority: int, tokens: int) -> Any:
+		"""Run ``factory()`` under the limits, retrying provider 429s with backoff."""
+		for attempt in range(LLM_MAX_RETRIES + 1):
+			entry = await self.acquire(priority, tokens)
+			try:
+				result = await factory()
+			except openai.RateLimitError as error:
+				self.release(entry)
+				pause = self.rate_limited(_retry_after_header(error))
+				if attempt == LLM_MAX_RETRIES:
+					raise SchedulerBusy(pause) from error
+				continue
+			except BaseException:
+				self.release(entry)
+				raise
+			self.release(entry, _usage_tokens(result))
+			self.succeeded()
+			return result
+
+	@asynccontextmanager
+	async def slot(self, priority: int, tokens: int) -> AsyncIterator[list[float]]:
+		"""Hold a call slot for the body, e.g. while a streamed run is consumed.
+
+		The body can store the run's actual token count in ``entry[1]``.
+		"""
+		entry = await self.acquire(priority, tokens)
+		try:
+			yield entry
+		except openai.RateLimitError as error:
+			self.rate_limited(_retry_after_header(error))
+			raise
+		finally:
+			self.release(entry, int(entry[1]))
+
+	def stats(self) -> dict[str, float]:
+		now = time.monotonic()
+		return {
+			**self._stats,
+			"active": self._active,
+			"waiting": sum(1 for _, _, future, _ in self._queue if not future.done()),
+			"concurrency_limit": self._limit,
+			"tokens_last_minute": self._window_tokens(now),
+			"paused_seconds": round(max(self._paused_until - now, 0.0), 2),
+		}
+
+
+scheduler = LLMScheduler()
@@ -4,7 +4,7 @@ Import routers from app.routes and create the app instance here.
 """
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
-from app.routes import study, quizzes, chat
+from app.routes import study, quizzes, chat, classes, embeddings, metrics
 
 app = FastAPI(title="StudyBuddy API", version="1.0.0")
 
@@ -21,6 +21,9 @@ app.add_middleware(
 app.include_router(chat.router, prefix="/api", tags=["chat"])
 app.include_router(study.router, prefix="/api", tags=["study"])
 app.include_router(quizzes.router, prefix="/api", tags=["quizzes"])
+app.include_router(classes.router, prefix="/api", tags=["classes"])
+app.include_router(embeddings.router, prefix="/api", tags=["embeddings"])
+app.include_router(metrics.router, prefix="/api", tags=["metrics"])
 
 @app.get("/")
 async def root():
@@ -0,0 +1,46 @@
+"""Model usage metrics.
+
+The orchestrator records token usage of every agent run here, per mode, so
+prompt-cache hit rates can be checked at GET /api/metrics. Counters are
+in-memory and per process.
+"""
+
+from __future__ import annotations
+
+from threading import Lock
+from typing import Any
+
+_USAGE: dict[str, dict[str, int]] = {}
+_LOCK = Lock()
+
+
+def record_usage(mode: str, usage: Any) -> None:
+	"""Add an ``agents.Usage`` (from ``result.context_wrapper.usage``) to the mode's counters."""
+	if usage is None:
+		return
+	details = getattr(usage, "input_tokens_details", None)
+	cached_tokens = getattr(details, "cached_tokens", 0) or 0
+	with _LOCK:
+		counters = _USAGE.setdefault(
+			mode,
+			{"runs": 0, "requests": 0, "input_tokens": 0, "cached_tokens": 0, "output_tokens": 0},
+		)
+		counters["runs"] += 1
+		counters["requests"] += usage.requests
+		counters["input_tokens"] += usage.input_tokens
+		counters["cached_tokens"] += cached_tokens
+		counters["output_tokens"] += usage.output_tokens
+
+
+def usage_snapshot() -> dict[str, dict[str, Any]]:
+	"""Per-mode token counters with the share of input tokens served from the prompt cache."""
+	with _LOCK:
+		return {
+			mode: {
+				**counters,
+				"cached_ratio": round(counters["cached_tokens"] / counters["input_tokens"], 4)
+				if counters["input_tokens"]
+				else 0.0,
+			}
+			for mode, counters in _USAGE.items()
+		}
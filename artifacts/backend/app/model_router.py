@@ -0,0 +1,107 @@
+"""Model routing.
+
+The orchestrator asks ``choose`` which model a run should use. Each mode has a
+configured model (``MODEL_CHAT``, ``MODEL_FLASHCARD``, ``MODEL_QUIZ``,
+``MODEL_SUMMARY``; empty means the Agents SDK default) and may name a smaller
+one (``MODEL_<MODE>_SMALL``) for requests of at most ``MODEL_SMALL_MAX_TOKENS``
+estimated tokens, such as short chat turns.
+
+Every finished run reports its latency. When the rolling p95 of the chosen
+model in a mode exceeds that mode's SLO (``MODEL_SLO_SECONDS_<MODE>``), runs
+fail over to ``MODEL_FALLBACK`` until the slow samples have aged out of the
+``MODEL_LATENCY_WINDOW_SECONDS`` window, after which the primary is tried again.
+"""
+
+from __future__ import annotations
+
+from collections import deque
+from pathlib import Path
+import math
+import os
+import time
+
+from dotenv import load_dotenv
+
+load_dotenv(Path(__file__).resolve().parents[2] / ".env")
+
+MODES = ("chat", "flashcard", "quiz", "summary")
+
+MODELS = {mode: os.getenv(f"MODEL_{mode.upper()}", "") for mode in MODES}
+SMALL_MODELS = {mode: os.getenv(f"MODEL_{mode.upper()}_SMALL", "") for mode in MODES}
+MODEL_SMALL_MAX_TOKENS = int(os.getenv("MODEL_SMALL_MAX_TOKENS", "1500"))
+MODEL_FALLBACK = os.getenv("MODEL_FALLBACK", "")
+
+# Seconds a run may take at p95 before the mode fails over; 0 disables failover for the mode.
+_DEFAULT_SLO_SECONDS = {"chat": 10.0, "flashcard": 60.0, "quiz": 90.0, "summary": 30.0}
+MODEL_SLO_SECONDS = {
+	mode: float(os.getenv(f"MODEL_SLO_SECONDS_{mode.upper()}", str(_DEFAULT_SLO_SECONDS[mode]))) for mode in MODES
+}
+MODEL_LATENCY_WINDOW_SECONDS = float(os.getenv("MODEL_LATENCY_WINDOW_SECONDS", "300"))
+# A p95 over fewer samples than this is not trusted to trigger failover.
+MODEL_LATENCY_MIN_SAMPLES = int(os.getenv("MODEL_LATENCY_MIN_SAMPLES", "5"))
+
+# Shown in stats for runs on the SDK's default model.
+_DEFAULT_MODEL_LABEL = "default"
+
+# (mode, model) -> deque of (finished_at, seconds)
+_LATENCIES: dict[tuple[str, str], deque[tuple[float, float]]] = {}
+_STATS = {"routed": 0, "small": 0, "failovers": 0}
+
+
+def _samples(mode: str, model: str, now: float) -> deque[tuple[float, float]]:
+	samples = _LATENCIES.setdefault((mode, model), deque())
+	while samples and now - samples[0][0] > MODEL_LATENCY_WINDOW_SECONDS:
+		samples.popleft()
+	return samples
+
+
+def percentile(mode: str, model: str, quantile: float) -> float | None:
+	"""Rolling latency quantile in seconds of ``model`` in ``mode``, or None with too few samples."""
+	samples = _samples(mode, model, time.monotonic())
+	if len(samples) < MODEL_LATENCY_MIN_SAMPLES:
+		return None
+	ordered = sorted(seconds for _, seconds in samples)
+	return ordered[max(math.ceil(quantile * len(ordered)) - 1, 0)]
+
+
+def p95(mode: str, model: str) -> float | None:
+	return percentile(mode, model, 0.95)
+
+
+def _over_slo(mode: str, model: str) -> bool:
+	latency = p95(mode, model)
+	return latency is not None and latency > MODEL_SLO_SECONDS[mode]
+
+
+def choose(mode: str, tokens: int) -> str:
+	"""Model for a run of ``mode`` estimated at ``tokens``; an empty string means the SDK default."""
+	_STATS["routed"] += 1
+	model = MODELS[mode]
+	if SMALL_MODELS[mode] and tokens <= MODEL_SMALL_MAX_TOKENS:
+		model = SMALL_MODELS[mode]
+		_STATS["small"] += 1
+	if (
+		MODEL_SLO_SECONDS[mode]
+		and MODEL_FALLBACK
+		and model != MODEL_FALLBACK
+		and _over_slo(mode, model)
+		and not _over_slo(mode, MODEL_FALLBACK)
+	):
+		_STATS["failovers"] += 1
+		return MODEL_FALLBACK
+	return model
+
+
+def record(mode: str, model: str, seconds: float) -> None:
+	"""Report how long a successful run of ``mode`` on ``model`` took."""
+	now = time.monotonic()
+	_samples(mode, model, now).append((now, seconds))
+
+
+def stats() -> dict[str, object]:
+	latencies = {}
+	for mode, model in list(_LATENCIES):
+		latency = p95(mode, model)
+		if latency is not None:
+			latencies.setdefault(mode, {})[model or _DEFAULT_MODEL_LABEL] = round(latency, 3)
+	return {**_STATS, "p95_seconds": latencies}
@@ -3,7 +3,7 @@
 These mirror the Pydantic response schemas but represent actual DB rows.
 """
 
-from sqlalchemy import Column, String, Integer, Text, ForeignKey, DateTime
+from sqlalchemy import Column, String, Integer, Text, ForeignKey, DateTime, Index
 from sqlalchemy.sql import func
 from app.db import Base
 
@@ -50,3 +50,44 @@ class FlashcardSet(Base):
     count = Column(Integer, nullable=False)
     created_at = Column(DateTime(timezone=True), server_default=func.now())
     updated_at = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now())
+
+
+class PoolItem(Base):
+    """A pre-generated flashcard or quiz question, tagged with the chunks it was generated from."""
+    __tablename__ = "generation_pool"
+
+    id = Column(String, primary_key=True)
+    class_id = Column(String, nullable=False, index=True)
+    kind = Column(String, nullable=False, index=True)  # 'flashcard' or 'quiz'
+    source = Column(String, nullable=False, index=True)
+    prompt_version = Column(String, nullable=False)
+    item_key = Column(Text, nullable=False)  # normalized front/question text, for de-duplication
+    chunk_hashes_json = Column(Text, nullable=False)  # content hashes of the source chunks, as JSON list
+    item_json = Column(Text, nullable=False)  # stored as JSON string
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+
+
+class BankQuestion(Base):
+    """A generated quiz question kept in the class's question bank."""
+    __tablename__ = "question_bank"
+    __table_args__ = (Index("ix_question_bank_facets", "class_id", "topic", "difficulty"),)
+
+    id = Column(String, primary_key=True)  # hash of class and normalized question text
+    class_id = Column(String, nullable=False, index=True)
+    topic = Column(String, nullable=False, default="")
+    difficulty = Column(String, nullable=False, default="medium")
+    source = Column(String, nullable=False, default="")
+    question_json = Column(Text, nullable=False)  # stored as JSON string
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+
+
+class QuestionAttempt(Base):
+    """How often a student has answered a bank question, and missed it."""
+    __tablename__ = "question_attempts"
+
+    student_id = Column(String, primary_key=True)
+    question_id = Column(String, ForeignKey("question_bank.id", ondelete="CASCADE"), primary_key=True)
+    class_id = Column(String, nullable=False, index=True)
+    attempts = Column(Integer, nullable=False, default=0)
+    misses = Column(Integer, nullable=False, default=0)
+    updated_at = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now())
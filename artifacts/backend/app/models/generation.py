@@ -0,0 +1,28 @@
+"""Generation output schemas.
+
+Used by the orchestrator as typed agent outputs for flashcard and quiz
+generation, so the model is constrained to these shapes.
+"""
+from pydantic import BaseModel
+from typing import List
+from app.models.responses import Flashcard
+
+
+class GeneratedFlashcards(BaseModel):
+    """Structured output of a flashcard generation run."""
+    flashcards: List[Flashcard]
+
+
+class GeneratedQuizQuestion(BaseModel):
+    """A quiz question as produced by the model (IDs are assigned by the API)."""
+    question: str
+    options: List[str]
+    answer: str
+    explanation: str
+    topic: str
+    difficulty: str  # easy, medium or hard
+
+
+class GeneratedQuiz(BaseModel):
+    """Structured output of a quiz generation run."""
+    questions: List[GeneratedQuizQuestion]
@@ -12,6 +12,7 @@ class ChatRequest(BaseModel):
     message: str
     conversation_id: Optional[str] = None
     focus: Optional[str] = None
+    use_cache: bool = True  # False skips the semantic answer cache
 
 
 class FlashcardRequest(BaseModel):
@@ -19,6 +20,7 @@ class FlashcardRequest(BaseModel):
     class_id: str
     focus: Optional[str] = None
     count: Optional[int] = 10
+    use_cache: bool = True  # False forces a fresh generation
 
 
 class QuizRequest(BaseModel):
@@ -26,6 +28,7 @@ class QuizRequest(BaseModel):
     class_id: str
     focus: Optional[str] = None
     count: Optional[int] = 10
+    use_cache: bool = True  # False forces a fresh generation
 
 
 class QuizCreateRequest(BaseModel):
@@ -36,6 +39,7 @@ class QuizCreateRequest(BaseModel):
     focus: Optional[str] = None
     question_count: int = 10
     difficulty: Optional[str] = "medium"
+    use_cache: bool = True  # False forces a fresh generation
 
 
 class QuizUpdateRequest(BaseModel):
@@ -50,9 +54,30 @@ class QuizSubmissionRequest(BaseModel):
     quiz_id: str
     answers: Dict[str, str]  # question_id -> selected_answer
     time_taken: Optional[int] = None  # seconds
+    student_id: Optional[str] = None  # records misses for question bank weighting
+
+
+class QuizFromBankRequest(BaseModel):
+    """Request model for assembling a quiz from the question bank."""
+    class_id: str
+    title: str
+    description: Optional[str] = None
+    question_count: int = 10
+    topic: Optional[str] = None
+    difficulty: Optional[str] = None  # easy, medium or hard
+    source: Optional[str] = None
+    student_id: Optional[str] = None  # favours questions this student has missed
 
 
 class ChatSessionCreateRequest(BaseModel):
     """Request model for creating a new chat session."""
     class_id: str
-    title: Optional[str] = "New Conversation"
\ No newline at end of file
+    title: Optional[str] = "New Conversation"
+
+
+class EmbeddingMigrationRequest(BaseModel):
+    """Request model for starting an online re-embedding migration."""
+    model: str
+    dimensions: int
+    batch_size: int = 100
+    rows_per_second: float = 200.0
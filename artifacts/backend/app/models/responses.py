@@ -3,7 +3,7 @@
 Used by route handlers for structured responses.
 """
 from pydantic import BaseModel
-from typing import Optional, List, Dict
+from typing import Any, Optional, List, Dict
 
 
 class ChatResponse(BaseModel):
@@ -11,6 +11,7 @@ class ChatResponse(BaseModel):
     response: str
     conversation_id: Optional[str] = None
     timestamp: Optional[str] = None
+    cached: bool = False  # True when served from the semantic answer cache
 
 
 class Flashcard(BaseModel):
@@ -43,6 +44,8 @@ class QuizQuestion(BaseModel):
     options: List[str]
     answer: str
     explanation: str
+    topic: Optional[str] = None
+    difficulty: Optional[str] = None
 
 
 class QuizResponse(BaseModel):
@@ -83,6 +86,15 @@ class QuizListResponse(BaseModel):
     total: int
 
 
+class QuestionBankFacets(BaseModel):
+    """Question counts in a class's question bank, per facet value."""
+    class_id: str
+    total: int
+    topic: Dict[str, int]
+    difficulty: Dict[str, int]
+    source: Dict[str, int]
+
+
 class QuizSubmissionResult(BaseModel):
     """Result of quiz submission."""
     id: Optional[str] = None
@@ -140,7 +152,10 @@ class ChatSessionListResponse(BaseModel):
 class IngestedFile(BaseModel):
     """Metadata for a single ingested file."""
     filename: str
-    chunk_count: int
+    chunk_count: int  # chunks newly indexed by this upload
+    chunks_unchanged: int = 0
+    chunks_removed: int = 0
+    chunks_skipped: int = 0  # near-duplicates of chunks already in the class
 
 
 class IngestResponse(BaseModel):
@@ -148,5 +163,83 @@ class IngestResponse(BaseModel):
     class_id: str
     files_indexed: int
     chunks_indexed: int
+    duplicates_skipped: int = 0
     files: List[IngestedFile]
-    timestamp: str
\ No newline at end of file
+    timestamp: str
+
+
+class SnapshotImportResponse(BaseModel):
+    """Response model for class snapshot import."""
+    class_id: str
+    source_class_id: str
+    chunks_imported: int
+    timestamp: str
+
+
+class EmbeddingMigrationStatus(BaseModel):
+    """Progress of an online re-embedding migration."""
+    name: str
+    model: str
+    dimensions: int
+    status: str  # 'running', 'indexing', 'switching', 'completed', 'stopped', 'failed' or 'interrupted'
+    total: int
+    embedded: int
+    remaining: int
+    progress: float
+    rows_per_second: float
+    eta_seconds: Optional[float] = None
+    started_at: str
+    completed_at: Optional[str] = None
+    error: Optional[str] = None
+
+
+class EmbeddingGeneration(BaseModel):
+    """An embedding model generation of the chunk index."""
+    name: str
+    model: str
+    dimensions: int
+    status: str  # 'active', 'migrating' or 'retired'
+    created_at: Optional[str] = None
+    activated_at: Optional[str] = None
+
+
+class EmbeddingGenerationListResponse(BaseModel):
+    """Response model for embedding generation list."""
+    generations: List[EmbeddingGeneration]
+    total: int
+
+
+class ModeUsage(BaseModel):
+    """Token usage counters for one agent mode."""
+    runs: int
+    requests: int
+    input_tokens: int
+    cached_tokens: int
+    output_tokens: int
+    cached_ratio: float
+
+
+class ChatCacheStats(BaseModel):
+    """Semantic chat cache counters."""
+    hits: int
+    misses: int
+    stores: int
+    evictions: int
+    entries: int
+    hit_rate: float
+
+
+class MetricsResponse(BaseModel):
+    """Response model for process metrics."""
+    usage: Dict[str, ModeUsage]
+    chat_cache: ChatCacheStats
+    generation_flights: Dict[str, int]  # started, coalesced, timeouts, abandoned, in_flight
+    llm_scheduler: Dict[str, float]  # admitted, queued, rejected, rate_limited, active, waiting, concurrency_limit, ...
+    conversation_memory: Dict[str, int]  # folds, failures, sessions, folding
+    generation_pool: Dict[str, int]  # hits, misses, generated, refreshes, failed_refreshes, failed_windows, refreshing
+    cancellations: Dict[str, int]  # requests cancelled on client disconnect, per route, plus total
+    retrieval_policy: Dict[str, int]  # retrieve, reuse, skip, retrievals_saved, sessions
+    model_router: Dict[str, Any]  # routed, small, failovers, p95_seconds per mode and model
+    hedging: Dict[str, int]  # runs, fired, won, over_budget, busy
+    retrieval_health: Dict[str, Any]  # retrieval circuit breaker state and counters, lexical fallbacks, mirror size
+    timestamp: str
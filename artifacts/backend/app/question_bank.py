@@ -0,0 +1,373 @@
+"""Question bank.
+
+Every quiz question the orchestrator generates, live or for a pool, is kept
+here with its class, topic, difficulty and source. Quizzes can then be
+assembled from the bank without a model call.
+
+Each class's questions are loaded into a QuestionIndex, which keeps a
+posting set per facet value and caches the matching IDs of every filter it
+has answered, so a filtered draw costs O(k) after the first. The bank is
+append-only, so a draw compares the class's row count with the index and
+loads the rows other workers have added since. Draws can favour
+questions a student has missed: each miss rate adds weight on top of a
+uniform base, and the boosted questions are drawn through an alias table.
+"""
+
+from __future__ import annotations
+
+from pathlib import Path
+from threading import Lock
+from typing import Any, Iterable
+import hashlib
+import json
+import logging
+import os
+import random
+
+from dotenv import load_dotenv
+from sqlalchemy import func
+from sqlalchemy.exc import IntegrityError, SQLAlchemyError
+
+from app import vector_store
+from app.db import SessionLocal, init_db
+from app.models.database import BankQuestion, QuestionAttempt
+
+load_dotenv(Path(__file__).resolve().parents[2] / ".env")
+
+# A question a student always misses is this many times more likely to be drawn (plus one).
+QUESTION_BANK_MISS_WEIGHT = float(os.getenv("QUESTION_BANK_MISS_WEIGHT", "3"))
+
+FACETS = ("topic", "difficulty", "source")
+DIFFICULTIES = ("easy", "medium", "hard")
+
+_schema_ready = False
+_schema_lock = Lock()
+_INDEXES: dict[str, "QuestionIndex"] = {}
+_INDEXES_LOCK = Lock()
+
+logger = logging.getLogger(__name__)
+
+
+def normalize_facet(value: Any) -> str:
+	return " ".join(vector_store._tokenize(str(value or "")))
+
+
+def question_id(class_id: str, question: str) -> str:
+	"""Stable ID of a question within a class, so quiz answers can be traced back to the bank."""
+	text = f"{class_id}\0{normalize_facet(question)}"
+	return hashlib.sha256(text.encode("utf-8")).hexdigest()[:20]
+
+
+class _AliasTable:
+	"""Walker alias table: O(n) to build, O(1) per weighted draw."""
+
+	def __init__(self, items: list[str], weights: list[float]):
+		self.items = items
+		count = len(items)
+		total = sum(weights)
+		scaled = [weight * count / total for weight in weights]
+		self.probability = [1.0] * count
+		self.alias = list(range(count))
+		small = [index for index, value in enumerate(scaled) if value < 1.0]
+		large = [index for index, value in enumerate(scaled) if value >= 1.0]
+		while small and large:
+			low, high = small.pop(), large.pop()
+			self.probability[low] = scaled[low]
+			self.alias[low] = high
+			scaled[high] -= 1.0 - scaled[low]
+			(small if scaled[high] < 1.0 else large).append(high)
+
+	def draw(self, rng: random.Random) -> str:
+		index = rng.randrange(len(self.items))
+		return self.items[index if rng.random() < self.probability[index] else self.alias[index]]
+
+
+class QuestionIndex:
+	"""Questions (dicts with an ``id``) indexed by facet value."""
+
+	def __init__(self, facets: Iterable[str] = FACETS):
+		self.facets = tuple(facets)
+		self.questions: dict[str, dict[str, Any]] = {}
+		self._postings: dict[tuple[str, str], set[str]] = {}
+		# First spelling seen of each normalized facet value, for display.
+		self._labels: dict[tuple[str, str], str] = {}
+		self._matches: dict[tuple[tuple[str, str], ...], tuple[list[str], set[str]]] = {}
+		self._lock = Lock()
+
+	def add(self, question: dict[str, Any]) -> bool:
+		with self._lock:
+			if question["id"] in self.questions:
+				return False
+			self.questions[question["id"]] = question
+			for facet in self.facets:
+				key = (facet, normalize_facet(question.get(facet)))
+				self._postings.setdefault(key, set()).add(question["id"])
+				self._labels.setdefault(key, str(question.get(facet)))
+			self._matches.clear()
+			return True
+
+	def values_containing(self, facet: str, text: str) -> list[str]:
+		"""Values of ``facet`` whose label contains ``text``, case-insensitively; usable as a filter."""
+		needle = str(text or "").lower()
+		with self._lock:
+			return sorted(value for (name, value), label in self._labels.items() if name == facet and needle in label.lower())
+
+	def _posting(self, item: tuple[str, Any]) -> set[str]:
+		facet, value = item
+		if isinstance(value, tuple):
+			return set().union(*(self._postings.get((facet, option), set()) for option in value))
+		return self._postings.get(item, set())
+
+	def _matching(self, filters: dict[str, Any]) -> tuple[list[str], set[str]]:
+		# A list of values matches any of them; an empty list matches nothing.
+		items = []
+		for facet, value in filters.items():
+			if isinstance(value, (list, tuple, set)):
+				items.append((facet, tuple(sorted({normalize_facet(option) for option in value}))))
+			elif value:
+				items.append((facet, normalize_facet(value)))
+		key = tuple(sorted(items, key=lambda item: item[0]))
+		with self._lock:
+			cached = self._matches.get(key)
+			if cached is None:
+				if key:
+					postings = sorted((self._posting(item) for item in key), key=len)
+					ids = postings[0].intersection(*postings[1:])
+				else:
+					ids = set(self.questions)
+				cached = (sorted(ids), ids)
+				self._matches[key] = cached
+			return cached
+
+	def count(self, **filters: Any) -> int:
+		return len(self._matching(filters)[0])
+
+	def facet_counts(self) -> dict[str, dict[str, int]]:
+		with self._lock:
+			counts: dict[str, dict[str, int]] = {facet: {} for facet in self.facets}
+			for (facet, value), ids in self._postings.items():
+				if value:
+					counts[facet][self._labels[(facet, value)]] = len(ids)
+			return counts
+
+	def sample(
+		self,
+		count: int,
+		filters: dict[str, Any] | None = None,
+		boosts: dict[str, float] | None = None,
+		rng: random.Random | None = None,
+	) -> list[dict[str, Any]]:
+		"""Draw up to ``count`` distinct questions matching ``filters``.
+
+		A question with boost ``b`` is drawn with weight ``1 + b``. The uniform
+		part is a random pick from the cached match list and the boosted part an
+		alias-table draw over the boosted matches, so a draw is O(1) and a
+		sample O(count) as long as it is small next to the match set.
+		"""
+		rng = rng or random
+		ids, id_set = self._matching(filters or {})
+		if count >= len(ids):
+			chosen = list(ids)
+			rng.shuffle(chosen)
+			return [self.questions[question_id] for question_id in chosen]
+
+		boosted = [(question_id, boost) for question_id, boost in (boosts or {}).items() if boost > 0 and question_id in id_set]
+		if count * 2 > len(ids):
+			# Most of the set is wanted: weighted sampling without replacement by random keys is cheaper.
+			weights = dict(boosted)
+			keyed = sorted(ids, key=lambda question_id: rng.random() ** (1.0 / (1.0 + weights.get(question_id, 0.0))), reverse=True)
+			return [self.questions[question_id] for question_id in keyed[:count]]
+
+		table = _AliasTable([question_id for question_id, _ in boosted], [boost for _, boost in boosted]) if boosted else None
+		boost_total = sum(boost for _, boost in boosted)
+		chosen_ids: list[str] = []
+		seen: set[str] = set()
+		while len(chosen_ids) < count:
+			if table is not None and rng.random() * (len(ids) + boost_total) >= len(ids):
+				question_id = table.draw(rng)
+			else:
+				question_id = ids[rng.randrange(len(ids))]
+			if question_id not in seen:
+				seen.add(question_id)
+				chosen_ids.append(question_id)
+		return [self.questions[question_id] for question_id in chosen_ids]
+
+
+def _ensure_schema() -> None:
+	global _schema_ready
+	if _schema_ready:
+		return
+	with _schema_lock:
+		if not _schema_ready:
+			init_db()
+			_schema_ready = True
+
+
+def _bank_entry(row_id: str, topic: str, difficulty: str, source: str, question: dict[str, Any]) -> dict[str, Any]:
+	return {**question, "id": row_id, "topic": topic, "difficulty": difficulty, "source": source}
+
+
+def _load_rows(class_id: str, index: QuestionIndex) -> None:
+	with SessionLocal() as session:
+		for row in session.query(BankQuestion).filter(BankQuestion.class_id == class_id):
+			if row.id not in index.questions:
+				index.add(_bank_entry(row.id, row.topic, row.difficulty, row.source, json.loads(row.question_json)))
+
+
+def _class_index(class_id: str, refresh: bool = False) -> QuestionIndex:
+	"""The class's index; ``refresh`` first loads rows other workers have added since it was built."""
+	with _INDEXES_LOCK:
+		index = _INDEXES.get(class_id)
+		if index is None:
+			_ensure_schema()
+			index = QuestionIndex()
+			_load_rows(class_id, index)
+			_INDEXES[class_id] = index
+			return index
+		if refresh:
+			with SessionLocal() as session:
+				stored = session.query(func.count(BankQuestion.id)).filter(BankQuestion.class_id == class_id).scalar()
+			if stored != len(index.questions):
+				_load_rows(class_id, index)
+		return index
+
+
+def add_questions(class_id: str, questions: list[dict[str, Any]], source: str = "") -> int:
+	"""Store generated quiz questions, skipping ones the class's bank already has. Returns how many were new.
+
+	Best effort: the questions were already generated, so a database error is
+	logged and reported as nothing stored rather than failing the request.
+	"""
+	try:
+		return _add_questions(class_id, questions, source)
+	except SQLAlchemyError:
+		logger.exception("Could not add questions to the bank of class %s", class_id)
+		return 0
+
+
+def _add_questions(class_id: str, questions: list[dict[str, Any]], source: str) -> int:
+	index = _class_index(class_id)
+	rows = []
+	for question in questions:
+		if not isinstance(question, dict) or not question.get("question"):
+			continue
+		row_id = question_id(class_id, question["question"])
+		if row_id in index.questions or any(row.id == row_id for row in rows):
+			continue
+		difficulty = normalize_facet(question.get("difficulty"))
+		rows.append(
+			BankQuestion(
+				id=row_id,
+				class_id=class_id,
+				topic=str(question.get("topic") or "").strip(),
+				difficulty=difficulty if difficulty in DIFFICULTIES else "medium",
+				source=source,
+				question_json=json.dumps(question),
+			)
+		)
+	if not rows:
+		return 0
+
+	with SessionLocal() as session:
+		# Another worker may have stored some of these since the index was loaded.
+		existing = {
+			row_id
+			for (row_id,) in session.query(BankQuestion.id).filter(BankQuestion.id.in_([row.id for row in rows]))
+		}
+		rows = [row for row in rows if row.id not in existing]
+		entries = {
+			row.id: _bank_entry(row.id, row.topic, row.difficulty, row.source, json.loads(row.question_json))
+			for row in rows
+		}
+		session.add_all(rows)
+		try:
+			session.commit()
+		except IntegrityError:
+			# A concurrent request stored one of them first; keep the rest, one row at a time.
+			session.rollback()
+			for row in rows:
+				session.add(row)
+				try:
+					session.commit()
+				except IntegrityError:
+					session.rollback()
+					del entries[row.id]
+	for entry in entries.values():
+		index.add(entry)
+	return len(entries)
+
+
+def record_attempts(student_id: str, class_id: str, outcomes: list[tuple[str, bool]]) -> int:
+	"""Record ``(question text, answered correctly)`` outcomes for questions in the bank.
+
+	Best effort, like ``add_questions``: the submission is already graded.
+	"""
+	try:
+		try:
+			return _record_attempts(student_id, class_id, outcomes)
+		except IntegrityError:
+			# A concurrent submission created one of the attempt rows first; count on top of it.
+			return _record_attempts(student_id, class_id, outcomes)
+	except SQLAlchemyError:
+		logger.exception("Could not record quiz attempts of student %s in class %s", student_id, class_id)
+		return 0
+
+
+def _record_attempts(student_id: str, class_id: str, outcomes: list[tuple[str, bool]]) -> int:
+	index = _class_index(class_id)
+	row_ids = [(question_id(class_id, question), correct) for question, correct in outcomes]
+	if any(row_id not in index.questions for row_id, _ in row_ids):
+		# The question may have been banked by another worker.
+		index = _class_index(class_id, refresh=True)
+	results = {row_id: correct for row_id, correct in row_ids if row_id in index.questions}
+
+	if not results:
+		return 0
+	with SessionLocal() as session:
+		attempts = {
+			attempt.question_id: attempt
+			for attempt in session.query(QuestionAttempt).filter(
+				QuestionAttempt.student_id == student_id,
+				QuestionAttempt.question_id.in_(list(results)),
+			)
+		}
+		for row_id, correct in results.items():
+			attempt = attempts.get(row_id)
+			if attempt is None:
+				attempt = QuestionAttempt(student_id=student_id, question_id=row_id, class_id=class_id, attempts=0, misses=0)
+				session.add(attempt)
+			attempt.attempts += 1
+			attempt.misses += 0 if correct else 1
+		session.commit()
+	return len(results)
+
+
+def miss_boosts(student_id: str, class_id: str) -> dict[str, float]:
+	"""Extra draw weight per question: the student's miss rate times QUESTION_BANK_MISS_WEIGHT."""
+	_ensure_schema()
+	with SessionLocal() as session:
+		rows = session.query(QuestionAttempt.question_id, QuestionAttempt.attempts, QuestionAttempt.misses).filter(
+			QuestionAttempt.student_id == student_id,
+			QuestionAttempt.class_id == class_id,
+			QuestionAttempt.misses > 0,
+		)
+		return {row_id: QUESTION_BANK_MISS_WEIGHT * misses / max(attempts, 1) for row_id, attempts, misses in rows}
+
+
+def sample(
+	class_id: str,
+	count: int,
+	topic: str | None = None,
+	difficulty: str | None = None,
+	source: str | None = None,
+	student_id: str | None = None,
+) -> list[dict[str, Any]]:
+	"""Draw up to ``count`` bank questions matching the filters, favouring the student's misses."""
+	boosts = miss_boosts(student_id, class_id) if student_id else None
+	filters = {"topic": topic, "difficulty": difficulty, "source": source}
+	return _class_index(class_id, refresh=True).sample(count, filters, boosts)
+
+
+def facets(class_id: str) -> dict[str, Any]:
+	index = _class_index(class_id, refresh=True)
+	return {"total": len(index.questions), **index.facet_counts()}
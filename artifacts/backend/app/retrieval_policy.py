@@ -0,0 +1,113 @@
+"""Adaptive retrieval for chat turns.
+
+Before a chat turn retrieves excerpts, the orchestrator asks ``decide`` whether
+the turn needs them. Acknowledgements and small talk ("thanks!", "ok got it")
+skip retrieval. A follow-up whose content words all occur in the excerpts the
+session was last sent ("can you rephrase that?", "why is the second step
+needed?") reuses those excerpts, for at most ``RETRIEVAL_REUSE_MAX_TURNS``
+turns in a row. Everything else retrieves fresh. Each decision is logged with
+its reason and counted for GET /api/metrics, so the embedding and vector store
+calls saved can be measured.
+"""
+
+from __future__ import annotations
+
+from pathlib import Path
+from typing import Any
+import logging
+import os
+
+from dotenv import load_dotenv
+
+from app import vector_store
+
+load_dotenv(Path(__file__).resolve().parents[2] / ".env")
+
+RETRIEVAL_POLICY_ENABLED = os.getenv("RETRIEVAL_POLICY_ENABLED", "true").lower() == "true"
+RETRIEVAL_REUSE_MAX_TURNS = int(os.getenv("RETRIEVAL_REUSE_MAX_TURNS", "3"))
+
+RETRIEVE = "retrieve"
+REUSE = "reuse"
+SKIP = "skip"
+
+logger = logging.getLogger(__name__)
+
+# Messages made only of these words carry no question about the material.
+_SMALL_TALK = {
+	"thanks", "thank", "thx", "ty", "you", "so", "much", "a", "lot", "ok", "okay", "k", "cool", "great",
+	"nice", "awesome", "perfect", "got", "it", "makes", "sense", "that", "sounds", "good", "hi", "hello",
+	"hey", "bye", "goodbye", "yes", "yeah", "yep", "no", "nope", "sure", "alright", "right", "i", "see",
+	"understand", "understood", "will", "do", "appreciate", "helpful", "very", "really",
+}
+_MAX_SMALL_TALK_WORDS = 8
+
+# Words that say nothing about which material a follow-up is about.
+_FUNCTION_WORDS = {
+	"the", "and", "but", "for", "with", "that", "this", "these", "those", "what", "which", "who", "whom",
+	"why", "how", "when", "where", "can", "could", "would", "should", "you", "your", "are", "was", "were",
+	"does", "did", "done", "have", "has", "had", "its", "about", "again", "more", "less", "than", "then",
+	"there", "their", "them", "they", "from", "into", "just", "also", "not", "any", "some", "one", "two",
+	"first", "second", "third", "last", "next", "step", "part", "mean", "means", "explain", "rephrase",
+	"simpler", "simply", "clarify", "elaborate", "detail", "details", "example", "examples", "another",
+	"please", "say", "said", "tell", "give", "show", "different", "way", "words", "other",
+	"still", "dont", "don", "get", "need", "needed", "use", "used", "like", "same", "thing", "things",
+	"point", "answer", "question", "above", "previous", "before", "earlier", "talked", "wrote",
+}
+_MIN_CONTENT_WORD_LENGTH = 3
+
+# session_id -> {"focus", "passages", "vocabulary", "reuses"}
+_CONTEXTS: dict[str, dict[str, Any]] = {}
+_STATS = {RETRIEVE: 0, REUSE: 0, SKIP: 0}
+
+
+def _content_words(tokens: list[str]) -> set[str]:
+	return {
+		token
+		for token in tokens
+		if len(token) >= _MIN_CONTENT_WORD_LENGTH and token not in _FUNCTION_WORDS and not token.isdigit()
+	}
+
+
+def _classify(session_id: str, message: str, focus: str | None) -> tuple[str, str]:
+	tokens = vector_store._tokenize(message or "")
+	if not focus and len(tokens) <= _MAX_SMALL_TALK_WORDS and set(tokens) <= _SMALL_TALK:
+		return SKIP, "small talk"
+
+	previous = _CONTEXTS.get(session_id)
+	if previous is None or not previous["passages"]:
+		return RETRIEVE, "no earlier excerpts"
+	if (focus or "") != previous["focus"]:
+		return RETRIEVE, "focus changed"
+	if previous["reuses"] >= RETRIEVAL_REUSE_MAX_TURNS:
+		return RETRIEVE, "reuse limit reached"
+	new_words = _content_words(tokens) - previous["vocabulary"]
+	if new_words:
+		return RETRIEVE, f"{len(new_words)} content words not in earlier excerpts"
+	return REUSE, "follow-up on earlier excerpts"
+
+
+def decide(session_id: str, message: str, focus: str | None = None) -> tuple[str, list[dict[str, Any]] | None]:
+	"""Return the decision for a chat turn and, for REUSE, the excerpts to send again."""
+	decision, reason = _classify(session_id, message, focus) if RETRIEVAL_POLICY_ENABLED else (RETRIEVE, "policy off")
+	_STATS[decision] += 1
+	logger.info("chat retrieval %s for session %s: %s", decision, session_id, reason)
+	if decision == REUSE:
+		_CONTEXTS[session_id]["reuses"] += 1
+		return decision, _CONTEXTS[session_id]["passages"]
+	return decision, None
+
+
+def remember(session_id: str, focus: str | None, passages: list[dict[str, Any]]) -> None:
+	"""Keep the excerpts a turn retrieved, for follow-ups to reuse."""
+	vocabulary: set[str] = set()
+	for passage in passages:
+		vocabulary.update(vector_store._tokenize(passage["text"]))
+	_CONTEXTS[session_id] = {"focus": focus or "", "passages": passages, "vocabulary": vocabulary, "reuses": 0}
+
+
+def forget(session_id: str) -> None:
+	_CONTEXTS.pop(session_id, None)
+
+
+def stats() -> dict[str, int]:
+	return {**_STATS, "retrievals_saved": _STATS[REUSE] + _STATS[SKIP], "sessions": len(_CONTEXTS)}
@@ -1,8 +1,7 @@
-import random
-
 from fastapi import APIRouter
 from pydantic import BaseModel, Field
 from typing import List
+from app.question_bank import QuestionIndex
 
 # ============================
 # Request / Response Models
@@ -64,6 +63,11 @@ QUESTION_BANK = [
 ]
 
 
+_INDEX = QuestionIndex(facets=("topic", "difficulty"))
+for _question in QUESTION_BANK:
+    _INDEX.add(_question)
+
+
 # ============================
 # Endpoint
 # ============================
@@ -74,10 +78,10 @@ def generate_quiz(payload: GenerateQuizRequest):
     # from app.tools.chatbot_adapter import generate_quiz
     # return generate_quiz(payload.topic, payload.num_questions)
 
-    matching = [q for q in QUESTION_BANK if payload.topic.lower() in q["topic"].lower()]
-    pool = matching if len(matching) >= 1 else QUESTION_BANK
-
-    chosen = random.sample(pool, k=min(payload.num_questions, len(pool)))
+    # Like the original substring match: "list" selects every topic whose name contains it.
+    topics = _INDEX.values_containing("topic", payload.topic)
+    filters = {"topic": topics} if _INDEX.count(topic=topics) >= 1 else {}
+    chosen = _INDEX.sample(payload.num_questions, filters)
 
     return {
         "topic": payload.topic,
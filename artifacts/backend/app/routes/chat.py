@@ -2,15 +2,25 @@
 
 Handles chat sessions, message history, and conversation management.
 """
-from fastapi import APIRouter, HTTPException
+from fastapi import APIRouter, HTTPException, Request
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import StreamingResponse
+from openai.types.responses import ResponseTextDeltaEvent
 from app.models.requests import ChatRequest, ChatSessionCreateRequest
 from app.models.responses import (
     ChatResponse, ChatMessage, ChatSessionMetadata, 
     ChatSessionDetail, ChatSessionListResponse
 )
-from app.agent import run
+from app.agent import run, run_streamed
+from app import cancellation, conversation_memory, metrics, retrieval_policy, semantic_cache
+from app.cancellation import CLIENT_CLOSED_REQUEST, ClientDisconnected, cancel_on_disconnect
+from app.llm_scheduler import SchedulerBusy, scheduler
+from app.vector_store import RetrievalUnavailable
 from datetime import datetime
 from typing import Optional
+import asyncio
+import json
+import time
 import uuid
 
 router = APIRouter()
@@ -194,89 +204,249 @@ async def delete_chat_session(session_id: str):
         del sessions_db[session_id]
         if session_id in messages_db:
             del messages_db[session_id]
+        conversation_memory.forget(session_id)
+        retrieval_policy.forget(session_id)
         return None
         
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error deleting chat session: {str(e)}")
 
 
+def _get_or_create_session(request: ChatRequest) -> str:
+    """Return the request's session ID, creating a session if none was given."""
+    session_id = request.conversation_id
+    
+    if not session_id:
+        session_id = str(uuid.uuid4())
+        timestamp = datetime.utcnow().isoformat()
+        sessions_db[session_id] = {
+            "id": session_id,
+            "class_id": request.class_id,
+            "title": request.message[:50] + "..." if len(request.message) > 50 else request.message,
+            "created_at": timestamp,
+            "updated_at": timestamp
+        }
+        messages_db[session_id] = []
+    elif session_id not in sessions_db:
+        raise HTTPException(status_code=404, detail=f"Conversation ID '{session_id}' not found")
+    
+    return session_id
+
+
+def _store_message(session_id: str, role: str, content: str) -> dict:
+    """Append a message to a session and bump the session's timestamp."""
+    timestamp = datetime.utcnow().isoformat()
+    message = {
+        "id": str(uuid.uuid4()),
+        "role": role,
+        "content": content,
+        "timestamp": timestamp,
+        "session_id": session_id
+    }
+    messages_db[session_id].append(message)
+    sessions_db[session_id]["updated_at"] = timestamp
+    return message
+
+
+def _discard_message(session_id: str, message: dict, created: bool) -> None:
+    """Undo storing a message whose answer was abandoned, and the session if it was made for it."""
+    session_messages = messages_db.get(session_id)
+    if session_messages is None:
+        return
+    messages_db[session_id] = [m for m in session_messages if m["id"] != message["id"]]
+    if created and not messages_db[session_id]:
+        del sessions_db[session_id]
+        del messages_db[session_id]
+        conversation_memory.forget(session_id)
+        retrieval_policy.forget(session_id)
+
+
+async def _cached_answer(request: ChatRequest, session_id: str):
+    """Look the question up in the class's semantic cache. Returns (answer or None, probe or None).
+    
+    Only a session's opening question is looked up: a follow-up's answer depends on the conversation.
+    """
+    if not request.use_cache or not semantic_cache.enabled(request.class_id):
+        return None, None
+    if len(messages_db[session_id]) > 1:
+        return None, None
+    return await run_in_threadpool(semantic_cache.lookup, request.class_id, request.message, request.focus)
+
+
+def _sse(event: str, data: dict) -> str:
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
 @router.post("/chat", response_model=ChatResponse)
-async def chat(request: ChatRequest):
+async def chat(request: ChatRequest, http_request: Request):
     """
     Send a chat message and get AI response. Creates session if conversation_id not provided.
     
+    If the client disconnects first, the model call is cancelled, the message is
+    removed from the session again and the request ends with 499.
+    
     Args:
         request: ChatRequest containing class_id, message, optional conversation_id, and focus
+        http_request: The underlying request, watched for client disconnect
         
     Returns:
         ChatResponse with the AI assistant's response and conversation_id
     """
     try:
-        # Create or get session
-        session_id = request.conversation_id
-        
-        if not session_id:
-            # Create new session
-            session_id = str(uuid.uuid4())
-            timestamp = datetime.utcnow().isoformat()
-            sessions_db[session_id] = {
-                "id": session_id,
-                "class_id": request.class_id,
-                "title": request.message[:50] + "..." if len(request.message) > 50 else request.message,
-                "created_at": timestamp,
-                "updated_at": timestamp
-            }
-            messages_db[session_id] = []
-        elif session_id not in sessions_db:
-            raise HTTPException(status_code=404, detail=f"Conversation ID '{session_id}' not found")
-        
-        # Store user message
-        timestamp = datetime.utcnow().isoformat()
-        user_message = {
-            "id": str(uuid.uuid4()),
-            "role": "user",
-            "content": request.message,
-            "timestamp": timestamp,
-            "session_id": session_id
-        }
-        messages_db[session_id].append(user_message)
-        
-        # Call the agent with chat mode
-        result = await run(
-            mode="chat",
-            class_id=request.class_id,
-            message=request.message,
-            focus=request.focus
-        )
-        
-        # Extract the response from the agent result
-        response_text = result.final_output if hasattr(result, 'final_output') else str(result)
-        
-        # Store assistant message
-        assistant_message = {
-            "id": str(uuid.uuid4()),
-            "role": "assistant",
-            "content": response_text,
-            "timestamp": datetime.utcnow().isoformat(),
-            "session_id": session_id
-        }
-        messages_db[session_id].append(assistant_message)
-        
-        # Update session timestamp
-        sessions_db[session_id]["updated_at"] = datetime.utcnow().isoformat()
+        # Create or get session, then store the user message
+        session_id = _get_or_create_session(request)
+        created = not request.conversation_id
+        user_message = _store_message(session_id, "user", request.message)
+        
+        # Stop paying for the answer if the client goes away, and leave no unanswered message behind
+        try:
+            response_text, cached = await cancel_on_disconnect(
+                http_request, _answer(request, session_id), "chat"
+            )
+        except ClientDisconnected:
+            _discard_message(session_id, user_message, created)
+            raise
+        
+        # Store assistant message and fold older turns into the summary in the background
+        _store_message(session_id, "assistant", response_text)
+        conversation_memory.schedule_update(session_id, messages_db[session_id])
         
         return ChatResponse(
             response=response_text,
             conversation_id=session_id,
-            timestamp=timestamp
+            timestamp=user_message["timestamp"],
+            cached=cached
         )
         
     except HTTPException:
         raise
+    except ClientDisconnected as e:
+        raise HTTPException(status_code=CLIENT_CLOSED_REQUEST, detail=str(e))
+    except (SchedulerBusy, RetrievalUnavailable) as e:
+        raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": str(e.retry_after)})
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error processing chat request: {str(e)}")
 
 
+async def _answer(request: ChatRequest, session_id: str):
+    """Answer the session's newest message. Returns (answer, whether it came from the cache)."""
+    # Repeated questions are answered from the semantic cache when the class opted in
+    response_text, probe = await _cached_answer(request, session_id)
+    if response_text is not None:
+        return response_text, True
+    
+    # Call the agent with chat mode, with the recent turns and a summary of older ones
+    result = await run(
+        mode="chat",
+        class_id=request.class_id,
+        message=request.message,
+        focus=request.focus,
+        history=conversation_memory.history_block(session_id, messages_db[session_id][:-1]),
+        session_id=session_id
+    )
+    
+    # Extract the response from the agent result
+    response_text = result.final_output if hasattr(result, 'final_output') else str(result)
+    if probe is not None:
+        semantic_cache.store(request.class_id, request.message, response_text, probe)
+    return response_text, False
+
+
+@router.post("/chat/stream")
+async def chat_stream(request: ChatRequest):
+    """
+    Send a chat message and stream the AI response as server-sent events.
+    
+    Events, in order: ``session`` (conversation_id), one ``token`` per text
+    delta, then ``done`` with the stored message ID and timings
+    (time_to_first_token_ms, total_ms), or ``error`` if generation fails.
+    The assistant message is saved to the session once the stream completes;
+    if the client disconnects before that, the model stream is cancelled and
+    the user message removed again. Responds 503 with Retry-After before streaming if the model queue is full.
+    Retrieval runs inside the stream, so when it is unavailable the stream ends
+    with an ``error`` event carrying ``retry_after``.
+    
+    Args:
+        request: ChatRequest containing class_id, message, optional conversation_id, and focus
+        
+    Returns:
+        StreamingResponse of text/event-stream
+    """
+    try:
+        scheduler.check_admission()
+    except SchedulerBusy as e:
+        raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": str(e.retry_after)})
+    
+    session_id = _get_or_create_session(request)
+    created = not request.conversation_id
+    user_message = _store_message(session_id, "user", request.message)
+    
+    async def events():
+        started = time.perf_counter()
+        time_to_first_token_ms = None
+        deltas = []
+        answered = False
+        yield _sse("session", {"conversation_id": session_id})
+        
+        try:
+            response_text, probe = await _cached_answer(request, session_id)
+            cached = response_text is not None
+            if cached:
+                # A cached answer is sent whole, as a single token event.
+                time_to_first_token_ms = round((time.perf_counter() - started) * 1000, 1)
+                yield _sse("token", {"delta": response_text})
+            else:
+                async with run_streamed(
+                    mode="chat",
+                    class_id=request.class_id,
+                    message=request.message,
+                    focus=request.focus,
+                    history=conversation_memory.history_block(session_id, messages_db[session_id][:-1]),
+                    session_id=session_id
+                ) as result:
+                    async for event in result.stream_events():
+                        if event.type != "raw_response_event" or not isinstance(event.data, ResponseTextDeltaEvent):
+                            continue
+                        if time_to_first_token_ms is None:
+                            time_to_first_token_ms = round((time.perf_counter() - started) * 1000, 1)
+                        deltas.append(event.data.delta)
+                        yield _sse("token", {"delta": event.data.delta})
+                
+                metrics.record_usage("chat", result.context_wrapper.usage)
+                response_text = result.final_output if isinstance(result.final_output, str) else "".join(deltas)
+                if probe is not None:
+                    semantic_cache.store(request.class_id, request.message, response_text, probe)
+            
+            assistant_message = _store_message(session_id, "assistant", response_text)
+            answered = True
+            conversation_memory.schedule_update(session_id, messages_db[session_id])
+            yield _sse("done", {
+                "conversation_id": session_id,
+                "message_id": assistant_message["id"],
+                "cached": cached,
+                "time_to_first_token_ms": time_to_first_token_ms,
+                "total_ms": round((time.perf_counter() - started) * 1000, 1),
+                "timestamp": assistant_message["timestamp"]
+            })
+        except (asyncio.CancelledError, GeneratorExit):
+            # The client went away; run_streamed has already cancelled the model stream.
+            if not answered:
+                _discard_message(session_id, user_message, created)
+                cancellation.record("chat_stream")
+            raise
+        except (SchedulerBusy, RetrievalUnavailable) as e:
+            # Retrieval and the scheduler slot are only reached once streaming has begun.
+            yield _sse("error", {"detail": str(e), "retry_after": e.retry_after})
+        except Exception as e:
+            yield _sse("error", {"detail": f"Error processing chat request: {str(e)}"})
+    
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+
 @router.delete("/chat/sessions/{session_id}/messages", status_code=204)
 async def clear_chat_history(session_id: str):
     """
@@ -293,6 +463,8 @@ async def clear_chat_history(session_id: str):
     
     try:
         messages_db[session_id] = []
+        conversation_memory.forget(session_id)
+        retrieval_policy.forget(session_id)
         sessions_db[session_id]["updated_at"] = datetime.utcnow().isoformat()
         return None
         
@@ -1,4 +1,74 @@
 """Class endpoints.
 
-Defines routes for listing and creating classes.
+Defines routes for listing and creating classes, and for exporting and
+importing class index snapshots.
 """
+from fastapi import APIRouter, HTTPException, UploadFile, File
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import StreamingResponse
+from app.models.responses import SnapshotImportResponse
+from app.snapshot import export_class, import_class
+from app.agent import schedule_pool_refresh
+from app import semantic_cache
+from datetime import datetime
+import tempfile
+
+router = APIRouter()
+
+
+@router.get("/classes/{class_id}/snapshot")
+async def export_class_snapshot(class_id: str):
+    """
+    Export a class's chunks and embeddings as a binary snapshot.
+
+    Args:
+        class_id: The class to export
+
+    Returns:
+        The snapshot file (application/octet-stream)
+    """
+    try:
+        buffer = tempfile.SpooledTemporaryFile(max_size=32 * 1024 * 1024)
+        header = await run_in_threadpool(export_class, class_id, buffer)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error exporting class snapshot: {str(e)}")
+
+    if header["chunk_count"] == 0:
+        buffer.close()
+        raise HTTPException(status_code=404, detail=f"No indexed content found for class '{class_id}'")
+
+    buffer.seek(0)
+
+    def iter_snapshot():
+        with buffer:
+            while chunk := buffer.read(64 * 1024):
+                yield chunk
+
+    return StreamingResponse(
+        iter_snapshot(),
+        media_type="application/octet-stream",
+        headers={"Content-Disposition": f'attachment; filename="{class_id}.sbsnap"'},
+    )
+
+
+@router.post("/classes/{class_id}/snapshot", response_model=SnapshotImportResponse, status_code=201)
+async def import_class_snapshot(class_id: str, snapshot: UploadFile = File(...)):
+    """
+    Replace a class's indexed content with an uploaded snapshot. No embeddings are recomputed.
+
+    Args:
+        class_id: The class to load the snapshot into (may differ from the exported class)
+        snapshot: Snapshot file produced by the export endpoint or `manage.py export`
+
+    Returns:
+        SnapshotImportResponse with the number of chunks imported
+    """
+    try:
+        result = await run_in_threadpool(import_class, snapshot.file, class_id)
+        semantic_cache.invalidate_class(class_id)
+        schedule_pool_refresh(class_id)
+        return SnapshotImportResponse(**result, timestamp=datetime.utcnow().isoformat())
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error importing class snapshot: {str(e)}")
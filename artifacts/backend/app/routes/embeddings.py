@@ -0,0 +1,76 @@
+"""Embedding migration endpoints.
+
+Starts and monitors online re-embedding migrations of the chunk index.
+"""
+from fastapi import APIRouter, HTTPException
+from fastapi.concurrency import run_in_threadpool
+from app.models.requests import EmbeddingMigrationRequest
+from app.models.responses import (
+    EmbeddingMigrationStatus, EmbeddingGeneration, EmbeddingGenerationListResponse
+)
+from app.embedding_migration import (
+    list_generations, migration_status, start_migration, stop_migration
+)
+
+router = APIRouter()
+
+
+@router.post("/embeddings/migrations", response_model=EmbeddingMigrationStatus, status_code=202)
+async def create_embedding_migration(request: EmbeddingMigrationRequest):
+    """
+    Start re-embedding all chunks with a new model in throttled background batches.
+
+    Queries keep using the active generation until the new one is complete.
+
+    Args:
+        request: EmbeddingMigrationRequest with model, dimensions, batch size and rate limit
+
+    Returns:
+        EmbeddingMigrationStatus for the new migration
+    """
+    try:
+        status = await run_in_threadpool(
+            start_migration,
+            request.model,
+            request.dimensions,
+            request.batch_size,
+            request.rows_per_second,
+        )
+        return EmbeddingMigrationStatus(**status)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error starting embedding migration: {str(e)}")
+
+
+@router.get("/embeddings/migrations/{name}", response_model=EmbeddingMigrationStatus)
+async def get_embedding_migration(name: str):
+    """Retrieve progress and throughput of a migration started by this server."""
+    try:
+        return EmbeddingMigrationStatus(**migration_status(name))
+    except KeyError:
+        raise HTTPException(status_code=404, detail=f"Embedding migration '{name}' not found")
+
+
+@router.post("/embeddings/migrations/{name}/stop", response_model=EmbeddingMigrationStatus)
+async def stop_embedding_migration(name: str):
+    """Stop a running migration after its current batch. Starting it again resumes it."""
+    try:
+        return EmbeddingMigrationStatus(**stop_migration(name))
+    except KeyError:
+        raise HTTPException(status_code=404, detail=f"Embedding migration '{name}' not found")
+
+
+@router.get("/embeddings/generations", response_model=EmbeddingGenerationListResponse)
+async def get_embedding_generations():
+    """List embedding generations and which one currently serves queries."""
+    try:
+        generations = await run_in_threadpool(list_generations)
+        return EmbeddingGenerationListResponse(
+            generations=[EmbeddingGeneration(**g) for g in generations],
+            total=len(generations)
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error retrieving embedding generations: {str(e)}")
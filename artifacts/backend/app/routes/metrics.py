@@ -0,0 +1,47 @@
+"""Metrics endpoints.
+
+Exposes in-process counters: model usage, caches, request coalescing, the LLM
+scheduler, cancellations, retrieval policy, model routing, hedging and the
+retrieval circuit breaker.
+"""
+from fastapi import APIRouter
+from app.models.responses import MetricsResponse
+from app.metrics import usage_snapshot
+from app import (
+    cancellation,
+    conversation_memory,
+    generation_pool,
+    model_router,
+    retrieval_policy,
+    semantic_cache,
+    vector_store,
+)
+from app.agent import generation_flights, hedger
+from app.llm_scheduler import scheduler
+from datetime import datetime
+
+router = APIRouter()
+
+
+@router.get("/metrics", response_model=MetricsResponse)
+async def get_metrics():
+    """
+    Retrieve token usage per mode and chat cache counters since this process started.
+    
+    Returns:
+        MetricsResponse with token counts per mode and the chat cache hit rate
+    """
+    return MetricsResponse(
+        usage=usage_snapshot(),
+        chat_cache=semantic_cache.stats(),
+        generation_flights=generation_flights.stats(),
+        llm_scheduler=scheduler.stats(),
+        conversation_memory=conversation_memory.stats(),
+        generation_pool=generation_pool.stats(),
+        cancellations=cancellation.stats(),
+        retrieval_policy=retrieval_policy.stats(),
+        model_router=model_router.stats(),
+        hedging=hedger.stats(),
+        retrieval_health=vector_store.retrieval_health(),
+        timestamp=datetime.utcnow().isoformat()
+    )
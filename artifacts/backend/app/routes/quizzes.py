@@ -2,16 +2,20 @@
 
 Handles CRUD operations for quizzes including creation, retrieval, update, deletion, and submission.
 """
-from fastapi import APIRouter, HTTPException
-from app.models.requests import QuizCreateRequest, QuizUpdateRequest, QuizSubmissionRequest
+from fastapi import APIRouter, HTTPException, Request
+from fastapi.concurrency import run_in_threadpool
+from app.models.requests import QuizCreateRequest, QuizFromBankRequest, QuizUpdateRequest, QuizSubmissionRequest
 from app.models.responses import (
     QuizMetadata, QuizDetail, QuizListResponse, QuizSubmissionResult, QuizQuestion,
-    QuizSubmissionHistoryResponse
+    QuizSubmissionHistoryResponse, QuestionBankFacets
 )
-from app.agent import run
+from app.agent import GenerationFormatError, generate
+from app.llm_scheduler import SchedulerBusy
+from app.vector_store import RetrievalUnavailable
+from app.cancellation import CLIENT_CLOSED_REQUEST, ClientDisconnected, cancel_on_disconnect
+from app import question_bank
 from datetime import datetime
 from typing import Optional
-import json
 import uuid
 
 router = APIRouter()
@@ -22,36 +26,32 @@ submissions_db = {}  # quiz_id -> list of QuizSubmissionResult dicts
 
 
 @router.post("/quizzes", response_model=QuizDetail, status_code=201)
-async def create_quiz(request: QuizCreateRequest):
+async def create_quiz(request: QuizCreateRequest, http_request: Request):
     """
     Create a new quiz for a class.
     
     Args:
         request: QuizCreateRequest with class_id, title, description, focus, question_count, difficulty
+        http_request: The underlying request; generation is cancelled if the client disconnects
         
     Returns:
         QuizDetail with generated questions
     """
     try:
         # Generate questions using the agent
-        result = await run(
-            mode="quiz",
-            class_id=request.class_id,
-            focus=request.focus,
-            message=f"Generate {request.question_count} quiz questions" + 
-                    (f" focusing on: {request.focus}" if request.focus else "")
-        )
-        
-        # Extract and parse the response
-        response_text = result.final_output if hasattr(result, 'final_output') else str(result)
-        
         try:
-            quiz_data = json.loads(response_text)
+            quiz_data = await cancel_on_disconnect(http_request, generate(
+                mode="quiz",
+                class_id=request.class_id,
+                focus=request.focus,
+                count=request.question_count,
+                use_cache=request.use_cache,
+            ), "quizzes")
             questions = []
             for i, q in enumerate(quiz_data):
                 question = QuizQuestion(**{**q, "id": q.get("id") or f"q{i+1}"})
                 questions.append(question)
-        except json.JSONDecodeError:
+        except GenerationFormatError:
             raise HTTPException(status_code=500, detail="Failed to parse quiz response from AI")
         
         # Create quiz record
@@ -75,10 +75,87 @@ async def create_quiz(request: QuizCreateRequest):
         
     except HTTPException:
         raise
+    except TimeoutError:
+        raise HTTPException(status_code=504, detail="Quiz generation timed out")
+    except ClientDisconnected as e:
+        raise HTTPException(status_code=CLIENT_CLOSED_REQUEST, detail=str(e))
+    except (SchedulerBusy, RetrievalUnavailable) as e:
+        raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": str(e.retry_after)})
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error creating quiz: {str(e)}")
 
 
+@router.post("/quizzes/from-bank", response_model=QuizDetail, status_code=201)
+async def create_quiz_from_bank(request: QuizFromBankRequest):
+    """
+    Assemble a quiz from the class's question bank, without calling the model.
+    
+    Args:
+        request: QuizFromBankRequest with class_id, title, question_count, optional
+            topic/difficulty/source filters and student_id to favour missed questions
+        
+    Returns:
+        QuizDetail with up to question_count questions
+    """
+    try:
+        if request.question_count < 1:
+            raise HTTPException(status_code=400, detail="question_count must be at least 1")
+        
+        bank_questions = await run_in_threadpool(
+            question_bank.sample,
+            request.class_id,
+            request.question_count,
+            request.topic,
+            request.difficulty,
+            request.source,
+            request.student_id,
+        )
+        if not bank_questions:
+            raise HTTPException(status_code=404, detail="No questions in the bank match these filters")
+        
+        quiz_id = str(uuid.uuid4())
+        timestamp = datetime.utcnow().isoformat()
+        
+        quiz = {
+            "id": quiz_id,
+            "class_id": request.class_id,
+            "title": request.title,
+            "description": request.description,
+            "difficulty": request.difficulty or "mixed",
+            "questions": [QuizQuestion(**q).model_dump() for q in bank_questions],
+            "created_at": timestamp,
+            "updated_at": timestamp
+        }
+        
+        quizzes_db[quiz_id] = quiz
+        
+        return QuizDetail(**quiz)
+        
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error creating quiz from question bank: {str(e)}")
+
+
+@router.get("/classes/{class_id}/question-bank", response_model=QuestionBankFacets)
+async def get_question_bank_facets(class_id: str):
+    """
+    Retrieve how many bank questions a class has, per topic, difficulty and source.
+    
+    Args:
+        class_id: The class whose question bank to describe
+        
+    Returns:
+        QuestionBankFacets with the total and per-facet counts
+    """
+    try:
+        counts = await run_in_threadpool(question_bank.facets, class_id)
+        return QuestionBankFacets(class_id=class_id, **counts)
+        
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error retrieving question bank: {str(e)}")
+
+
 @router.get("/quizzes", response_model=QuizListResponse)
 async def list_quizzes(class_id: Optional[str] = None):
     """
@@ -270,6 +347,15 @@ async def submit_quiz(quiz_id: str, request: QuizSubmissionRequest):
             submissions_db[quiz_id] = []
         submissions_db[quiz_id].append(submission.model_dump())
 
+        # Feed the student's misses back into question bank sampling
+        if request.student_id:
+            await run_in_threadpool(
+                question_bank.record_attempts,
+                request.student_id,
+                quiz["class_id"],
+                [(result["question_text"], result["is_correct"]) for result in results]
+            )
+
         return submission
 
     except Exception as e:
@@ -2,7 +2,7 @@
 
 Defines ingest, flashcards, and quiz generation routes.
 """
-from fastapi import APIRouter, HTTPException, UploadFile, File, Form
+from fastapi import APIRouter, HTTPException, Request, UploadFile, File, Form
 from app.models.requests import FlashcardRequest, QuizRequest
 from app.models.responses import (
     FlashcardResponse,
@@ -13,12 +13,17 @@ from app.models.responses import (
     IngestResponse,
     IngestedFile,
 )
-from app.agent import run
-from app.tools.ingest import ingest_files
+from app.agent import GenerationFormatError, generate, schedule_pool_refresh
+from app.llm_scheduler import SchedulerBusy
+from app.vector_store import RetrievalUnavailable
+from app.cancellation import CLIENT_CLOSED_REQUEST, ClientDisconnected, cancel_on_disconnect
+from app import semantic_cache
+from app.tools.ingest import ArchiveTooLarge, ingest_archive, ingest_files
+from fastapi.concurrency import run_in_threadpool
 from datetime import datetime
 from typing import Optional
-import json
 import uuid
+import zipfile
 
 router = APIRouter()
 
@@ -42,14 +47,19 @@ async def ingest_study_materials(
                 raise HTTPException(status_code=400, detail="Uploaded file must have a filename")
             payloads.append((uploaded_file.filename, await uploaded_file.read()))
 
-        file_summaries = ingest_files(class_id=class_id, files=payloads)
+        # Extraction, dedup signatures and embedding are blocking; keep them off the event loop.
+        file_summaries = await run_in_threadpool(ingest_files, class_id, payloads)
+        semantic_cache.invalidate_class(class_id)
         if not file_summaries:
             raise HTTPException(status_code=400, detail="No readable content found in uploaded files")
+        # Pre-generate flashcards and questions from the new material in the background
+        schedule_pool_refresh(class_id)
 
         return IngestResponse(
             class_id=class_id,
             files_indexed=len(file_summaries),
             chunks_indexed=sum(item["chunk_count"] for item in file_summaries),
+            duplicates_skipped=sum(item.get("chunks_skipped", 0) for item in file_summaries),
             files=[IngestedFile(**item) for item in file_summaries],
             timestamp=datetime.utcnow().isoformat(),
         )
@@ -61,36 +71,67 @@ async def ingest_study_materials(
         raise HTTPException(status_code=500, detail=f"Error ingesting files: {str(error)}")
 
 
+@router.post("/ingest/archive", response_model=IngestResponse, status_code=201)
+async def ingest_study_archive(
+    class_id: str = Form(...),
+    archive: UploadFile = File(...),
+):
+    """Ingest a zip of course materials (PDF, DOCX, TXT) in one batched write."""
+    try:
+        # The upload is spooled to disk, so entries are streamed out of it rather than read up front.
+        file_summaries = await run_in_threadpool(ingest_archive, class_id, archive.file)
+        semantic_cache.invalidate_class(class_id)
+        if not file_summaries:
+            raise HTTPException(status_code=400, detail="No readable content found in archive")
+        # Pre-generate flashcards and questions from the new material in the background
+        schedule_pool_refresh(class_id)
+
+        return IngestResponse(
+            class_id=class_id,
+            files_indexed=len(file_summaries),
+            chunks_indexed=sum(item["chunk_count"] for item in file_summaries),
+            duplicates_skipped=sum(item.get("chunks_skipped", 0) for item in file_summaries),
+            files=[IngestedFile(**item) for item in file_summaries],
+            timestamp=datetime.utcnow().isoformat(),
+        )
+    except HTTPException:
+        raise
+    except zipfile.BadZipFile:
+        raise HTTPException(status_code=400, detail="Uploaded file is not a valid zip archive")
+    except ArchiveTooLarge as error:
+        raise HTTPException(status_code=413, detail=str(error))
+    except ValueError as error:
+        raise HTTPException(status_code=400, detail=str(error))
+    except Exception as error:
+        raise HTTPException(status_code=500, detail=f"Error ingesting archive: {str(error)}")
+
+
 @router.post("/flashcards", response_model=FlashcardResponse, status_code=201)
-async def generate_flashcards(request: FlashcardRequest):
+async def generate_flashcards(request: FlashcardRequest, http_request: Request):
     """
     Generate flashcards for a class based on uploaded materials.
     
     Args:
         request: FlashcardRequest containing class_id, optional focus area, and count
+        http_request: The underlying request; generation is cancelled if the client disconnects
         
     Returns:
         FlashcardResponse with generated flashcards
     """
     try:
-        # Call the agent with flashcard mode
-        result = await run(
-            mode="flashcard",
-            class_id=request.class_id,
-            focus=request.focus,
-            message=f"Generate {request.count} flashcards" + (f" focusing on: {request.focus}" if request.focus else "")
-        )
-        
-        # Extract the response from the agent result
-        response_text = result.final_output if hasattr(result, 'final_output') else str(result)
-        
-        # Parse the JSON response from the agent
+        # Call the agent with flashcard mode and parse its JSON response
         try:
-            flashcards_data = json.loads(response_text)
+            flashcards_data = await cancel_on_disconnect(http_request, generate(
+                mode="flashcard",
+                class_id=request.class_id,
+                focus=request.focus,
+                count=request.count,
+                use_cache=request.use_cache,
+            ), "flashcards")
             if not isinstance(flashcards_data, list):
                 raise HTTPException(status_code=500, detail="Invalid flashcard response format from AI")
             flashcards = [Flashcard(**card) for card in flashcards_data]
-        except json.JSONDecodeError:
+        except GenerationFormatError:
             raise HTTPException(status_code=500, detail="Failed to parse flashcard response from AI")
 
         flashcard_set_id = str(uuid.uuid4())
@@ -120,6 +161,12 @@ async def generate_flashcards(request: FlashcardRequest):
         
     except HTTPException:
         raise
+    except TimeoutError:
+        raise HTTPException(status_code=504, detail="Flashcard generation timed out")
+    except ClientDisconnected as e:
+        raise HTTPException(status_code=CLIENT_CLOSED_REQUEST, detail=str(e))
+    except (SchedulerBusy, RetrievalUnavailable) as e:
+        raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": str(e.retry_after)})
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error generating flashcards: {str(e)}")
 
@@ -167,33 +214,29 @@ async def delete_flashcard_set(flashcard_id: str):
 
 
 @router.post("/quiz", response_model=QuizResponse)
-async def generate_quiz(request: QuizRequest):
+async def generate_quiz(request: QuizRequest, http_request: Request):
     """
     Generate quiz questions for a class based on uploaded materials.
     
     Args:
         request: QuizRequest containing class_id, optional focus area, and count
+        http_request: The underlying request; generation is cancelled if the client disconnects
         
     Returns:
         QuizResponse with generated quiz questions
     """
     try:
-        # Call the agent with quiz mode
-        result = await run(
-            mode="quiz",
-            class_id=request.class_id,
-            focus=request.focus,
-            message=f"Generate {request.count} quiz questions" + (f" focusing on: {request.focus}" if request.focus else "")
-        )
-        
-        # Extract the response from the agent result
-        response_text = result.final_output if hasattr(result, 'final_output') else str(result)
-        
-        # Parse the JSON response from the agent
+        # Call the agent with quiz mode and parse its JSON response
         try:
-            quiz_data = json.loads(response_text)
+            quiz_data = await cancel_on_disconnect(http_request, generate(
+                mode="quiz",
+                class_id=request.class_id,
+                focus=request.focus,
+                count=request.count,
+                use_cache=request.use_cache,
+            ), "quiz")
             questions = [QuizQuestion(**q) for q in quiz_data]
-        except json.JSONDecodeError:
+        except GenerationFormatError:
             raise HTTPException(status_code=500, detail="Failed to parse quiz response from AI")
         
         return QuizResponse(
@@ -205,5 +248,11 @@ async def generate_quiz(request: QuizRequest):
         
     except HTTPException:
         raise
+    except TimeoutError:
+        raise HTTPException(status_code=504, detail="Quiz generation timed out")
+    except ClientDisconnected as e:
+        raise HTTPException(status_code=CLIENT_CLOSED_REQUEST, detail=str(e))
+    except (SchedulerBusy, RetrievalUnavailable) as e:
+        raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": str(e.retry_after)})
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error generating quiz: {str(e)}")
\ No newline at end of file
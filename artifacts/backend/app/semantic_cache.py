@@ -0,0 +1,184 @@
+"""Semantic answer cache for chat.
+
+The chat routes check here before running the agent. For classes that opt in
+(``CHAT_CACHE_CLASSES``), a question whose vector is within the similarity
+threshold of a cached question with the same focus is answered from the
+cache, as long as the class's corpus version and embedding space are the ones
+the answer was produced with. Entries expire after a TTL and each class keeps
+at most ``CHAT_CACHE_MAX_ENTRIES``, least recently used first out.
+
+On the Supabase backend the question embedding shares the retrieval circuit
+breaker: while it is open the lookup is skipped, and a failed embedding or
+corpus version read is reported to it and treated as a miss, so an embeddings outage never fails a
+chat turn here.
+"""
+
+from __future__ import annotations
+
+from dataclasses import dataclass
+from pathlib import Path
+from threading import Lock
+from typing import Any
+import hashlib
+import logging
+import math
+import operator
+import os
+import time
+
+from dotenv import load_dotenv
+
+from app import vector_store
+from app.circuit_breaker import CLOSED
+
+load_dotenv(Path(__file__).resolve().parents[2] / ".env")
+
+# Comma-separated class IDs, or "*" for every class. Empty disables the cache.
+CHAT_CACHE_CLASSES = {name.strip() for name in os.getenv("CHAT_CACHE_CLASSES", "").split(",") if name.strip()}
+CHAT_CACHE_SIMILARITY = float(os.getenv("CHAT_CACHE_SIMILARITY", "0.92"))
+CHAT_CACHE_TTL_SECONDS = float(os.getenv("CHAT_CACHE_TTL_SECONDS", "86400"))
+CHAT_CACHE_MAX_ENTRIES = int(os.getenv("CHAT_CACHE_MAX_ENTRIES", "200"))
+
+# The local backend has no embeddings; questions are compared as hashed term vectors.
+_LEXICAL_DIMENSIONS = 1024
+
+_ENTRIES: dict[str, list[dict[str, Any]]] = {}
+_STATS = {"hits": 0, "misses": 0, "stores": 0, "evictions": 0}
+_LOCK = Lock()
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class Probe:
+	"""What a lookup computed, reused to store the answer on a miss."""
+
+	vector: list[float]
+	space: str
+	corpus_version: int
+	focus: str
+
+
+def enabled(class_id: str) -> bool:
+	return "*" in CHAT_CACHE_CLASSES or class_id in CHAT_CACHE_CLASSES
+
+
+def _normalize(vector: list[float]) -> list[float]:
+	norm = math.sqrt(sum(value * value for value in vector))
+	return [value / norm for value in vector] if norm else vector
+
+
+def _lexical_vector(text: str) -> list[float]:
+	vector = [0.0] * _LEXICAL_DIMENSIONS
+	for token in vector_store._tokenize(text):
+		bucket = int.from_bytes(hashlib.blake2b(token.encode("utf-8"), digest_size=4).digest(), "big")
+		vector[bucket % _LEXICAL_DIMENSIONS] += 1.0
+	return vector
+
+
+def _embed_question(text: str) -> tuple[list[float], str]:
+	"""Return the question's unit vector and the name of the space it lives in."""
+	if vector_store._use_supabase_backend():
+		generation = vector_store._active_generation()
+		return _normalize(vector_store.embed_query(text, generation)), generation["name"]
+	return _normalize(_lexical_vector(text)), "lexical"
+
+
+def lookup(class_id: str, question: str, focus: str | None = None) -> tuple[str | None, Probe | None]:
+	"""Return ``(cached answer or None, probe)``. Blocking; call from a worker thread.
+
+	The probe is None, and the answer is not stored, when the question could not be embedded.
+	"""
+	breaker = vector_store.retrieval_breaker
+	supabase = vector_store._use_supabase_backend()
+	if supabase and breaker.state != CLOSED:
+		_count_miss()
+		return None, None
+	try:
+		vector, space = _embed_question(question)
+		version = vector_store.corpus_version(class_id)
+	except Exception as error:
+		if supabase:
+			breaker.record_failure()
+		logger.warning("Chat cache lookup for class %s failed, treating it as a miss: %r", class_id, error)
+		_count_miss()
+		return None, None
+	probe = Probe(
+		vector=vector,
+		space=space,
+		corpus_version=version,
+		focus=" ".join((focus or "").lower().split()),
+	)
+	now = time.time()
+
+	with _LOCK:
+		entries = _ENTRIES.get(class_id, [])
+		live = [
+			entry
+			for entry in entries
+			if entry["expires_at"] > now
+			and entry["corpus_version"] == probe.corpus_version
+			and entry["space"] == probe.space
+		]
+		_STATS["evictions"] += len(entries) - len(live)
+		if live:
+			_ENTRIES[class_id] = live
+		else:
+			_ENTRIES.pop(class_id, None)
+
+		best, best_score = None, CHAT_CACHE_SIMILARITY
+		for entry in live:
+			if entry["focus"] != probe.focus:
+				continue
+			score = sum(map(operator.mul, vector, entry["vector"]))
+			if score >= best_score:
+				best, best_score = entry, score
+
+		if best is None:
+			_STATS["misses"] += 1
+			return None, probe
+		_STATS["hits"] += 1
+		# Most recently used entries move to the back, so eviction takes from the front.
+		live.remove(best)
+		live.append(best)
+		return best["answer"], probe
+
+
+def _count_miss() -> None:
+	with _LOCK:
+		_STATS["misses"] += 1
+
+
+def store(class_id: str, question: str, answer: str, probe: Probe) -> None:
+	with _LOCK:
+		entries = _ENTRIES.setdefault(class_id, [])
+		entries.append(
+			{
+				"question": question,
+				"answer": answer,
+				"vector": probe.vector,
+				"space": probe.space,
+				"corpus_version": probe.corpus_version,
+				"focus": probe.focus,
+				"expires_at": time.time() + CHAT_CACHE_TTL_SECONDS,
+			}
+		)
+		_STATS["stores"] += 1
+		while len(entries) > CHAT_CACHE_MAX_ENTRIES:
+			entries.pop(0)
+			_STATS["evictions"] += 1
+
+
+def invalidate_class(class_id: str) -> None:
+	with _LOCK:
+		_STATS["evictions"] += len(_ENTRIES.pop(class_id, []))
+
+
+def stats() -> dict[str, Any]:
+	with _LOCK:
+		lookups = _STATS["hits"] + _STATS["misses"]
+		return {
+			**_STATS,
+			"entries": sum(len(entries) for entries in _ENTRIES.values()),
+			"hit_rate": round(_STATS["hits"] / lookups, 4) if lookups else 0.0,
+		}
@@ -0,0 +1,69 @@
+"""Request coalescing.
+
+The orchestrator runs flashcard and quiz generations through a SingleFlight
+so that concurrent requests with the same key share one in-flight run and
+all receive its result. Each caller may give up on its own (timeout or
+client disconnect); the shared run is only cancelled once nobody waits on it.
+"""
+
+from __future__ import annotations
+
+from typing import Any, Awaitable, Callable, Hashable
+import asyncio
+import copy
+
+
+class _Flight:
+	def __init__(self, task: asyncio.Task):
+		self.task = task
+		self.waiters = 0
+
+
+class SingleFlight:
+	"""Coalesces concurrent async calls by key. Not thread-safe: use from one event loop."""
+
+	def __init__(self) -> None:
+		self._flights: dict[Hashable, _Flight] = {}
+		self._stats = {"started": 0, "coalesced": 0, "timeouts": 0, "abandoned": 0}
+
+	def _forget(self, key: Hashable, flight: _Flight) -> None:
+		if self._flights.get(key) is flight:
+			del self._flights[key]
+
+	async def do(
+		self,
+		key: Hashable,
+		factory: Callable[[], Awaitable[Any]],
+		timeout: float | None = None,
+	) -> Any:
+		"""Return the result of ``factory()``, sharing a run already in flight for ``key``.
+
+		Every caller gets its own deep copy of the result. Raises TimeoutError
+		if this caller waits longer than ``timeout`` seconds.
+		"""
+		flight = self._flights.get(key)
+		if flight is None:
+			flight = _Flight(asyncio.ensure_future(factory()))
+			self._flights[key] = flight
+			flight.task.add_done_callback(lambda _, key=key, flight=flight: self._forget(key, flight))
+			self._stats["started"] += 1
+		else:
+			self._stats["coalesced"] += 1
+
+		flight.waiters += 1
+		try:
+			result = await asyncio.wait_for(asyncio.shield(flight.task), timeout)
+		except TimeoutError:
+			self._stats["timeouts"] += 1
+			raise
+		finally:
+			flight.waiters -= 1
+			if flight.waiters == 0 and not flight.task.done():
+				# Everyone who asked has given up; stop paying for the run.
+				flight.task.cancel()
+				self._forget(key, flight)
+				self._stats["abandoned"] += 1
+		return copy.deepcopy(result)
+
+	def stats(self) -> dict[str, int]:
+		return {**self._stats, "in_flight": len(self._flights)}
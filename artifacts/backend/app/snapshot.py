@@ -0,0 +1,247 @@
+"""Class index snapshots.
+
+Exports a class's chunks and embeddings to a compact binary file and loads
+such a file into either vector store backend without calling the embedding
+API. Lexical statistics are not stored: both backends derive them from the
+chunk text on import. Used by the class routes and the manage.py CLI.
+
+Layout (gzip-compressed)::
+
+	b"SBSNAP01"
+	u32 header length, header JSON
+	per chunk: u32 metadata length, metadata JSON, float32[dimensions] embedding
+"""
+
+from __future__ import annotations
+
+from datetime import datetime
+from typing import Any, BinaryIO, Iterator
+import gzip
+import json
+import struct
+import uuid
+
+from app import dedup, vector_store
+
+MAGIC = b"SBSNAP01"
+_LENGTH = struct.Struct("<I")
+_CHUNK_FIELDS = (
+	"id",
+	"source",
+	"chunk_index",
+	"page",
+	"char_start",
+	"char_end",
+	"text",
+	"content_hash",
+	"file_hash",
+)
+
+
+def _write_block(stream: BinaryIO, payload: dict[str, Any]) -> None:
+	data = json.dumps(payload, separators=(",", ":")).encode("utf-8")
+	stream.write(_LENGTH.pack(len(data)))
+	stream.write(data)
+
+
+def _read_exact(stream: BinaryIO, size: int) -> bytes:
+	data = stream.read(size)
+	if len(data) != size:
+		raise ValueError("Snapshot is truncated")
+	return data
+
+
+def _read_block(stream: BinaryIO) -> dict[str, Any] | None:
+	prefix = stream.read(_LENGTH.size)
+	if not prefix:
+		return None
+	if len(prefix) != _LENGTH.size:
+		raise ValueError("Snapshot is truncated")
+	(size,) = _LENGTH.unpack(prefix)
+	return json.loads(_read_exact(stream, size))
+
+
+def _iter_local_chunks(class_id: str) -> Iterator[tuple[dict[str, Any], list[float] | None]]:
+	store = vector_store._load_store()
+	for chunk in store.get("classes", {}).get(class_id, []):
+		if not chunk.get("deleted_at"):
+			yield chunk, None
+
+
+def _iter_supabase_chunks(class_id: str) -> Iterator[tuple[dict[str, Any], list[float] | None]]:
+	vector_store._ensure_supabase_schema()
+	column = vector_store._active_generation()["column_name"]
+	with vector_store._get_db_connection() as connection:
+		# Named cursor: rows are streamed from the server instead of fetched at once.
+		with connection.cursor(name="snapshot_export") as cursor:
+			cursor.itersize = 500
+			cursor.execute(
+				f"""
+				SELECT id, source, chunk_index, page, char_start, char_end, content,
+					content_hash, file_hash, {column}::text
+				FROM study_chunks
+				WHERE class_id = %s AND deleted_at IS NULL
+				ORDER BY source, chunk_index
+				""",
+				(class_id,),
+			)
+			for row in cursor:
+				chunk = {
+					"id": str(row[0]),
+					"source": row[1],
+					"chunk_index": row[2],
+					"page": row[3],
+					"char_start": row[4],
+					"char_end": row[5],
+					"text": row[6],
+					"content_hash": row[7],
+					"file_hash": row[8],
+				}
+				yield chunk, [float(value) for value in row[9].strip("[]").split(",")]
+
+
+def _iter_class_chunks(class_id: str) -> Iterator[tuple[dict[str, Any], list[float] | None]]:
+	if vector_store._use_supabase_backend():
+		return _iter_supabase_chunks(class_id)
+	return _iter_local_chunks(class_id)
+
+
+def export_class(class_id: str, stream: BinaryIO) -> dict[str, Any]:
+	"""Write a snapshot of a class to ``stream`` and return its header with the chunk count."""
+	generation = vector_store._active_generation() if vector_store._use_supabase_backend() else None
+	header = {
+		"class_id": class_id,
+		"created_at": datetime.utcnow().isoformat(),
+		"embedding_model": generation["model"] if generation else None,
+		"embedding_dimensions": generation["dimensions"] if generation else 0,
+	}
+
+	# A single pass: the header only holds what is known up front, so rows
+	# (and their embeddings) are streamed straight from the store to the file.
+	chunk_count = 0
+	with gzip.GzipFile(fileobj=stream, mode="wb", compresslevel=6) as archive:
+		archive.write(MAGIC)
+		_write_block(archive, header)
+		vector_format = struct.Struct(f"<{header['embedding_dimensions']}f")
+		for chunk, embedding in _iter_class_chunks(class_id):
+			_write_block(archive, {field: chunk.get(field) for field in _CHUNK_FIELDS})
+			if header["embedding_dimensions"]:
+				archive.write(vector_format.pack(*embedding))
+			chunk_count += 1
+
+	return {**header, "chunk_count": chunk_count}
+
+
+def _iter_snapshot(stream: BinaryIO) -> tuple[dict[str, Any], Iterator[tuple[dict[str, Any], list[float] | None]]]:
+	archive = gzip.GzipFile(fileobj=stream, mode="rb")
+	try:
+		magic = archive.read(len(MAGIC))
+	except (OSError, EOFError):
+		magic = b""
+	if magic != MAGIC:
+		raise ValueError("Not a StudyBuddy class snapshot")
+	header = _read_block(archive)
+	if header is None:
+		raise ValueError("Snapshot is truncated")
+	dimensions = header["embedding_dimensions"]
+	vector_format = struct.Struct(f"<{dimensions}f")
+
+	def chunks() -> Iterator[tuple[dict[str, Any], list[float] | None]]:
+		with archive:
+			while (chunk := _read_block(archive)) is not None:
+				embedding = list(vector_format.unpack(_read_exact(archive, vector_format.size))) if dimensions else None
+				yield chunk, embedding
+
+	return header, chunks()
+
+
+def _import_local(class_id: str, chunks: Iterator[tuple[dict[str, Any], list[float] | None]]) -> int:
+	now = datetime.utcnow().isoformat()
+	records = [
+		{
+			**chunk,
+			"id": str(uuid.uuid4()),
+			"tokens": vector_store._tokenize(chunk["text"]),
+			"created_at": now,
+		}
+		for chunk, _ in chunks
+	]
+	store = vector_store._load_store()
+	store.setdefault("classes", {})[class_id] = records
+	vector_store._bump_corpus_version_local(store, class_id)
+	vector_store._save_store(store)
+	return len(records)
+
+
+def _import_supabase(
+	class_id: str,
+	header: dict[str, Any],
+	chunks: Iterator[tuple[dict[str, Any], list[float] | None]],
+) -> int:
+	vector_store._ensure_supabase_schema()
+
+	imported = 0
+	with vector_store._get_db_connection() as connection:
+		with connection.cursor() as cursor:
+			# Read the active generation under the lock a migration switch takes, not
+			# from this process's cache, so the rows land in the column queries use.
+			cursor.execute("LOCK TABLE embedding_generations IN SHARE MODE")
+			generation = next(
+				(row for row in vector_store._read_generations(cursor) if row["status"] == "active"),
+				vector_store._base_generation(),
+			)
+			if (header["embedding_model"], header["embedding_dimensions"]) != (generation["model"], generation["dimensions"]):
+				raise ValueError(
+					"Snapshot embeddings "
+					f"({header['embedding_model'] or 'none'}, {header['embedding_dimensions']} dims) "
+					f"do not match this server ({generation['model']}, {generation['dimensions']} dims)"
+				)
+			cursor.execute("DELETE FROM study_chunks WHERE class_id = %s", (class_id,))
+			batch: list[tuple] = []
+			for chunk, embedding in chunks:
+				batch.append(
+					(
+						str(uuid.uuid4()),
+						class_id,
+						chunk["source"],
+						chunk["chunk_index"],
+						chunk.get("page"),
+						chunk.get("char_start"),
+						chunk.get("char_end"),
+						chunk["text"],
+						chunk.get("content_hash"),
+						chunk.get("file_hash"),
+						vector_store._to_pgvector_literal(embedding),
+					)
+				)
+				if len(batch) >= 5000:
+					vector_store._insert_chunk_rows(cursor, [generation], batch, bulk=True)
+					imported += len(batch)
+					batch = []
+			if batch:
+				vector_store._insert_chunk_rows(cursor, [generation], batch, bulk=True)
+				imported += len(batch)
+			vector_store._bump_corpus_version_supabase(cursor, class_id)
+	return imported
+
+
+def import_class(stream: BinaryIO, class_id: str | None = None) -> dict[str, Any]:
+	"""Replace a class's chunks with the contents of a snapshot.
+
+	``class_id`` defaults to the class the snapshot was exported from; chunks get
+	fresh ids so a snapshot can be loaded next to its source class. Importing
+	into Supabase requires embeddings from the configured model; importing into
+	the local store only needs the text. Rows are loaded into the active
+	embedding generation; a migration in progress backfills them afterwards.
+	"""
+	header, chunks = _iter_snapshot(stream)
+	target = class_id or header["class_id"]
+
+	if vector_store._use_supabase_backend():
+		imported = _import_supabase(target, header, chunks)
+		vector_store._refresh_lexical_mirror_after_ingest(target)
+	else:
+		imported = _import_local(target, chunks)
+
+	dedup.drop_class_index(target)
+	return {"class_id": target, "source_class_id": header["class_id"], "chunks_imported": imported}
@@ -5,11 +5,51 @@ create table if not exists study_chunks (
     class_id text not null,
     source text not null,
     chunk_index integer not null,
+    page integer,
+    char_start integer,
+    char_end integer,
     content text not null,
+    content_hash text,
+    file_hash text,
     embedding vector(1536) not null,
-    created_at timestamptz not null default now()
+    created_at timestamptz not null default now(),
+    deleted_at timestamptz
 );
 
 create index if not exists idx_study_chunks_class_id on study_chunks (class_id);
+create index if not exists idx_study_chunks_live_source
+on study_chunks (class_id, source) where deleted_at is null;
 create index if not exists idx_study_chunks_embedding_hnsw
 on study_chunks using hnsw (embedding vector_cosine_ops);
+
+-- One row per embedding model/column. Queries use the 'active' generation;
+-- a 'migrating' generation is dual-written and backfilled until it is switched in.
+-- Columns added by a migration are nullable, so `embedding` loses its NOT NULL then.
+create table if not exists embedding_generations (
+    name text primary key,
+    model text not null,
+    dimensions integer not null,
+    column_name text not null unique,
+    status text not null,
+    created_at timestamptz not null default now(),
+    activated_at timestamptz,
+    -- Progress of the latest migration to this generation, so it survives restarts.
+    migration_status text,
+    migration_total integer,
+    migration_embedded integer,
+    migration_error text,
+    migration_started_at timestamptz,
+    migration_completed_at timestamptz,
+    migration_updated_at timestamptz
+);
+
+insert into embedding_generations (name, model, dimensions, column_name, status, activated_at)
+values ('base', 'text-embedding-3-small', 1536, 'embedding', 'active', now())
+on conflict (name) do nothing;
+
+-- Bumped whenever a class's chunks change; keys cached flashcard/quiz generations.
+create table if not exists class_corpus_versions (
+    class_id text primary key,
+    version bigint not null,
+    updated_at timestamptz not null default now()
+);
@@ -0,0 +1,155 @@
+"""Bulk index tool.
+
+Called by the manage.py CLI to index a directory tree of course materials
+offline, without going through the HTTP ingest route.
+"""
+
+from __future__ import annotations
+
+from multiprocessing import Pool
+from pathlib import Path
+from typing import Any, Iterator
+import json
+import time
+
+from app.tools.ingest import SUPPORTED_EXTENSIONS, hash_file, iter_segments
+from app.vector_store import add_text_documents, chunk_segments, refresh_lexical_mirror
+
+
+def discover_classes(root: Path, class_map: dict[str, str] | None = None) -> dict[str, Path]:
+	"""Map class ids to directories: each subdirectory of ``root`` is a class unless remapped."""
+	class_map = class_map or {}
+	classes: dict[str, Path] = {}
+	for directory in sorted(path for path in root.iterdir() if path.is_dir() and not path.name.startswith(".")):
+		classes[class_map.get(directory.name, directory.name)] = directory
+	return classes
+
+
+def _iter_class_files(directory: Path) -> Iterator[Path]:
+	for path in sorted(directory.rglob("*")):
+		if path.is_file() and path.suffix.lower() in SUPPORTED_EXTENSIONS and not path.name.startswith("."):
+			yield path
+
+
+def _checkpoint_key(class_id: str, source: str, stat) -> str:
+	return f"{class_id}\t{source}\t{stat.st_size}\t{stat.st_mtime_ns}"
+
+
+def _load_checkpoint(path: Path | None) -> set[str]:
+	if path is None or not path.exists():
+		return set()
+	with path.open(encoding="utf-8") as handle:
+		return {json.loads(line)["key"] for line in handle if line.strip()}
+
+
+def _prepare_document(job: tuple[str, str, str]) -> dict[str, Any]:
+	"""Worker: read, extract and chunk one file. Runs in a separate process."""
+	class_id, source, file_path = job
+	content = Path(file_path).read_bytes()
+	return {
+		"class_id": class_id,
+		"source": source,
+		"file_hash": hash_file(content),
+		"chunks": chunk_segments(iter_segments(filename=file_path, content=content)),
+		"size": len(content),
+	}
+
+
+def _safe_prepare_document(job: tuple[str, str, str]) -> dict[str, Any]:
+	try:
+		return _prepare_document(job)
+	except Exception as error:
+		return {"class_id": job[0], "source": job[1], "error": str(error)}
+
+
+def run_bulk_index(
+	root: Path,
+	class_map: dict[str, str] | None = None,
+	workers: int = 4,
+	batch_size: int = 50,
+	checkpoint: Path | None = None,
+	log=print,
+) -> dict[str, Any]:
+	"""Index every supported file under ``root`` and return a throughput summary.
+
+	Files are extracted and chunked in a process pool, then committed per class
+	in batches of ``batch_size`` documents (one embedding pass and one COPY per
+	batch on Supabase). Committed files are appended to ``checkpoint`` so an
+	interrupted run resumes where it left off.
+	"""
+	started = time.perf_counter()
+	done = _load_checkpoint(checkpoint)
+	stats = {
+		"files_indexed": 0,
+		"files_resumed": 0,
+		"files_failed": 0,
+		"chunks_indexed": 0,
+		"chunks_unchanged": 0,
+		"chunks_skipped": 0,
+		"bytes_read": 0,
+	}
+
+	jobs: list[tuple[str, str, str]] = []
+	keys: dict[tuple[str, str], str] = {}
+	for class_id, directory in discover_classes(root, class_map).items():
+		for path in _iter_class_files(directory):
+			source = path.relative_to(directory).as_posix()
+			key = _checkpoint_key(class_id, source, path.stat())
+			if key in done:
+				stats["files_resumed"] += 1
+				continue
+			keys[(class_id, source)] = key
+			jobs.append((class_id, source, str(path)))
+
+	batches: dict[str, list[dict[str, Any]]] = {}
+	changed: set[str] = set()
+	checkpoint_handle = checkpoint.open("a", encoding="utf-8") if checkpoint else None
+
+	def commit(class_id: str) -> None:
+		batch = batches.pop(class_id, [])
+		if not batch:
+			return
+		summaries = add_text_documents(class_id=class_id, documents=batch, bulk=True)
+		for summary in summaries:
+			stats["chunks_indexed"] += summary["chunk_count"]
+			stats["chunks_unchanged"] += summary["chunks_unchanged"]
+			stats["chunks_skipped"] += summary["chunks_skipped"]
+			if summary["chunk_count"] or summary["chunks_removed"]:
+				changed.add(class_id)
+		stats["files_indexed"] += len(batch)
+		if checkpoint_handle:
+			for document in batch:
+				checkpoint_handle.write(json.dumps({"key": keys[(class_id, document["source"])]}) + "\n")
+			checkpoint_handle.flush()
+		log(f"[{class_id}] committed {len(batch)} files ({stats['files_indexed']}/{len(jobs)} total)")
+
+	try:
+		with Pool(processes=workers) as pool:
+			for result in pool.imap_unordered(_safe_prepare_document, jobs, chunksize=4):
+				if "error" in result:
+					stats["files_failed"] += 1
+					log(f"[{result['class_id']}] failed {result['source']}: {result['error']}")
+					continue
+				stats["bytes_read"] += result.pop("size")
+				class_id = result.pop("class_id")
+				batches.setdefault(class_id, []).append(result)
+				if len(batches[class_id]) >= batch_size:
+					commit(class_id)
+		for class_id in list(batches):
+			commit(class_id)
+	finally:
+		if checkpoint_handle:
+			checkpoint_handle.close()
+		# Bulk commits skip the per-ingest mirror refresh; rebuild each changed class once.
+		for class_id in sorted(changed):
+			try:
+				refresh_lexical_mirror(class_id)
+			except Exception as error:
+				log(f"[{class_id}] lexical mirror refresh failed: {error}")
+
+	elapsed = time.perf_counter() - started
+	stats["elapsed_seconds"] = round(elapsed, 2)
+	stats["files_per_second"] = round(stats["files_indexed"] / elapsed, 2) if elapsed else 0.0
+	stats["chunks_per_second"] = round(stats["chunks_indexed"] / elapsed, 2) if elapsed else 0.0
+	stats["megabytes_per_second"] = round(stats["bytes_read"] / elapsed / 1_000_000, 2) if elapsed else 0.0
+	return stats
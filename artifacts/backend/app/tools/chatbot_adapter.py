@@ -1,6 +1,6 @@
 # backend/app/tools/chatbot_adapter.py
 
-import random
+from app.question_bank import QuestionIndex
 
 QUESTION_BANK = [
     {
@@ -33,11 +33,16 @@ QUESTION_BANK = [
 ]
 
 
-def generate_quiz(topic: str = "General", num_questions: int = 5):
-    matching = [q for q in QUESTION_BANK if topic.lower() in q["topic"].lower()]
-    pool = matching if len(matching) >= 2 else QUESTION_BANK
+_INDEX = QuestionIndex(facets=("topic", "difficulty"))
+for _question in QUESTION_BANK:
+    _INDEX.add(_question)
+
 
-    chosen = random.sample(pool, k=min(num_questions, len(pool)))
+def generate_quiz(topic: str = "General", num_questions: int = 5):
+    # Like the original substring match: "list" selects every topic whose name contains it.
+    topics = _INDEX.values_containing("topic", topic)
+    filters = {"topic": topics} if _INDEX.count(topic=topics) >= 2 else {}
+    chosen = _INDEX.sample(num_questions, filters)
 
     return {
         "topic": topic,
@@ -0,0 +1,167 @@
+"""Context packing tool.
+
+Called by the orchestrator to turn retrieved chunks into the excerpts block
+of a prompt. Chunks are selected by rank into a per-mode token budget,
+overlapping or adjacent chunks of the same page are merged into one passage
+with the repeated words removed, and exact duplicates are dropped.
+"""
+
+from __future__ import annotations
+
+from pathlib import Path
+from typing import Any
+import os
+
+from dotenv import load_dotenv
+
+from app.tools.retrieve import aretrieve_context, retrieve_context
+
+load_dotenv(Path(__file__).resolve().parents[3] / ".env")
+
+CONTEXT_TOKEN_BUDGETS = {
+	"chat": int(os.getenv("CONTEXT_TOKEN_BUDGET_CHAT", "1000")),
+	"flashcard": int(os.getenv("CONTEXT_TOKEN_BUDGET_FLASHCARD", "2000")),
+	"quiz": int(os.getenv("CONTEXT_TOKEN_BUDGET_QUIZ", "2000")),
+}
+CONTEXT_MAX_CANDIDATES = int(os.getenv("CONTEXT_MAX_CANDIDATES", "30"))
+
+# Roughly four characters per token for English text; used to size budgets.
+_CHARS_PER_TOKEN = 4
+_TYPICAL_CHUNK_TOKENS = 200
+# Fetch more candidates when at least this share of the budget is still free.
+_REFILL_THRESHOLD = 0.15
+
+
+def estimate_tokens(text: str) -> int:
+	return max(1, len(text) // _CHARS_PER_TOKEN)
+
+
+def _overlap_words(left: list[str], right: list[str]) -> int:
+	"""Length of the longest suffix of ``left`` that is a prefix of ``right``."""
+	for size in range(min(len(left), len(right)), 0, -1):
+		if left[-size:] == right[:size]:
+			return size
+	return 0
+
+
+def _continues(passage: dict[str, Any], chunk: dict[str, Any]) -> bool:
+	if passage["source"] != chunk["source"] or passage["page"] != chunk["page"]:
+		return False
+	if chunk.get("chunk_index") is not None and chunk["chunk_index"] == passage["last_index"] + 1:
+		return True
+	if chunk.get("char_start") is not None and passage["char_end"] is not None:
+		return chunk["char_start"] <= passage["char_end"]
+	return False
+
+
+def merge_chunks(chunks: list[dict[str, Any]]) -> list[dict[str, Any]]:
+	"""Merge retrieved chunks into passages, best-ranked first.
+
+	Chunks without position metadata are kept as their own passage. A passage
+	takes the best score of its chunks.
+	"""
+	seen_texts: set[str] = set()
+	positioned: list[tuple[int, dict[str, Any]]] = []
+	passages: list[dict[str, Any]] = []
+	for rank, chunk in enumerate(chunks):
+		if chunk["text"] in seen_texts:
+			continue
+		seen_texts.add(chunk["text"])
+		if chunk.get("chunk_index") is None:
+			passages.append({"source": chunk["source"], "page": chunk.get("page"), "text": chunk["text"], "rank": rank})
+		else:
+			positioned.append((rank, chunk))
+
+	positioned.sort(key=lambda item: (item[1]["source"], item[1].get("page") or 0, item[1]["chunk_index"]))
+	current: dict[str, Any] | None = None
+	for rank, chunk in positioned:
+		if current is not None and _continues(current, chunk):
+			words = chunk["text"].split(" ")
+			overlap = _overlap_words(current["words"], words)
+			current["words"].extend(words[overlap:])
+			current["last_index"] = chunk["chunk_index"]
+			current["char_end"] = chunk.get("char_end")
+			current["rank"] = min(current["rank"], rank)
+			continue
+		if current is not None:
+			passages.append(current)
+		current = {
+			"source": chunk["source"],
+			"page": chunk.get("page"),
+			"words": chunk["text"].split(" "),
+			"last_index": chunk["chunk_index"],
+			"char_end": chunk.get("char_end"),
+			"rank": rank,
+		}
+	if current is not None:
+		passages.append(current)
+
+	for passage in passages:
+		if "words" in passage:
+			passage["text"] = " ".join(passage.pop("words"))
+			del passage["last_index"], passage["char_end"]
+	passages.sort(key=lambda passage: passage["rank"])
+	return passages
+
+
+def pack_chunks(chunks: list[dict[str, Any]], budget: int) -> tuple[list[dict[str, Any]], int]:
+	"""Select chunks in rank order while their merged passages fit in ``budget`` tokens.
+
+	A chunk only costs the words it adds to what is already selected, so a
+	neighbour of a selected chunk is cheap. Returns (passages, tokens used).
+	"""
+	selected: list[dict[str, Any]] = []
+	passages: list[dict[str, Any]] = []
+	used = 0
+	for chunk in chunks:
+		merged = merge_chunks(selected + [chunk])
+		tokens = sum(estimate_tokens(passage["text"]) for passage in merged)
+		if tokens <= budget:
+			selected.append(chunk)
+			passages, used = merged, tokens
+		elif not selected:
+			# Even the best chunk is too long: keep as much of it as fits.
+			text = chunk["text"][: budget * _CHARS_PER_TOKEN].rsplit(" ", 1)[0]
+			return merge_chunks([{**chunk, "text": text}]), estimate_tokens(text)
+	return passages, used
+
+
+def _initial_top_k(budget: int) -> int:
+	return min(max(5, -(-budget // _TYPICAL_CHUNK_TOKENS)), CONTEXT_MAX_CANDIDATES)
+
+
+def _needs_refill(chunks: list[dict[str, Any]], top_k: int, used: int, budget: int) -> bool:
+	return len(chunks) == top_k and top_k < CONTEXT_MAX_CANDIDATES and budget - used >= budget * _REFILL_THRESHOLD
+
+
+def build_context(class_id: str, query: str, mode: str = "chat", budget: int | None = None) -> list[dict[str, Any]]:
+	"""Retrieve and pack passages for a query within the mode's token budget.
+
+	Starts with enough candidates to fill the budget with typical chunks and
+	fetches a larger candidate set once if merging left a noticeable part of
+	the budget free. ``budget`` overrides the mode's budget.
+	"""
+	budget = budget or CONTEXT_TOKEN_BUDGETS.get(mode, CONTEXT_TOKEN_BUDGETS["chat"])
+	top_k = _initial_top_k(budget)
+
+	chunks = retrieve_context(class_id=class_id, query=query, top_k=top_k)
+	packed, used = pack_chunks(chunks, budget)
+	if _needs_refill(chunks, top_k, used, budget):
+		top_k = min(top_k * 2, CONTEXT_MAX_CANDIDATES)
+		chunks = retrieve_context(class_id=class_id, query=query, top_k=top_k)
+		packed, used = pack_chunks(chunks, budget)
+	return packed
+
+
+async def abuild_context(class_id: str, query: str, mode: str = "chat", budget: int | None = None) -> list[dict[str, Any]]:
+	"""``build_context`` with awaitable retrieval, for use on the event loop."""
+	budget = budget or CONTEXT_TOKEN_BUDGETS.get(mode, CONTEXT_TOKEN_BUDGETS["chat"])
+	top_k = _initial_top_k(budget)
+
+	chunks = await aretrieve_context(class_id=class_id, query=query, top_k=top_k)
+	packed, used = pack_chunks(chunks, budget)
+	if _needs_refill(chunks, top_k, used, budget):
+		top_k = min(top_k * 2, CONTEXT_MAX_CANDIDATES)
+		chunks = await aretrieve_context(class_id=class_id, query=query, top_k=top_k)
+		packed, used = pack_chunks(chunks, budget)
+	return packed
@@ -5,29 +5,45 @@ Called by study routes to save notes into the store.
 
 from __future__ import annotations
 
+from concurrent.futures import Future, ThreadPoolExecutor
 from io import BytesIO
-from pathlib import Path
+from pathlib import Path, PurePosixPath
+from typing import BinaryIO, Iterator
+import hashlib
+import os
+import zipfile
 
 from app.vector_store import add_text_documents
 
 
 SUPPORTED_EXTENSIONS = {".pdf", ".txt", ".docx"}
+ARCHIVE_INGEST_WORKERS = int(os.getenv("ARCHIVE_INGEST_WORKERS", "4"))
+# Zip bomb limits, checked against the archive directory before anything is decompressed.
+ARCHIVE_MAX_ENTRIES = int(os.getenv("ARCHIVE_MAX_ENTRIES", "500"))
+ARCHIVE_MAX_ENTRY_BYTES = int(os.getenv("ARCHIVE_MAX_ENTRY_BYTES", str(50 * 1024 * 1024)))
+ARCHIVE_MAX_TOTAL_BYTES = int(os.getenv("ARCHIVE_MAX_TOTAL_BYTES", str(500 * 1024 * 1024)))
+ARCHIVE_MAX_COMPRESSION_RATIO = float(os.getenv("ARCHIVE_MAX_COMPRESSION_RATIO", "100"))
 
 
-def _extract_pdf_text(content: bytes) -> str:
+class ArchiveTooLarge(ValueError):
+	"""The archive exceeds an entry count or uncompressed size limit."""
+
+
+def _iter_pdf_segments(content: bytes) -> Iterator[tuple[int, str]]:
 	from pypdf import PdfReader
 
 	reader = PdfReader(BytesIO(content))
-	page_text = [page.extract_text() or "" for page in reader.pages]
-	return "\n".join(page_text).strip()
+	for page_number, page in enumerate(reader.pages, start=1):
+		yield page_number, page.extract_text() or ""
 
 
-def _extract_docx_text(content: bytes) -> str:
+def _iter_docx_segments(content: bytes) -> Iterator[tuple[int, str]]:
 	from docx import Document
 
 	document = Document(BytesIO(content))
-	paragraph_text = [paragraph.text for paragraph in document.paragraphs if paragraph.text]
-	return "\n".join(paragraph_text).strip()
+	for paragraph in document.paragraphs:
+		if paragraph.text:
+			yield 1, paragraph.text
 
 
 def _extract_txt_text(content: bytes) -> str:
@@ -37,26 +53,100 @@ def _extract_txt_text(content: bytes) -> str:
 		return content.decode("latin-1").strip()
 
 
-def extract_text(filename: str, content: bytes) -> str:
+def iter_segments(filename: str, content: bytes) -> Iterator[tuple[int, str]]:
+	"""Lazily yield ``(page, text)`` segments: PDF pages, DOCX paragraphs or the TXT body."""
 	extension = Path(filename).suffix.lower()
 	if extension not in SUPPORTED_EXTENSIONS:
 		raise ValueError(f"Unsupported file type: {extension}")
 
 	if extension == ".pdf":
-		return _extract_pdf_text(content)
+		return _iter_pdf_segments(content)
 	if extension == ".docx":
-		return _extract_docx_text(content)
-	return _extract_txt_text(content)
+		return _iter_docx_segments(content)
+	return iter([(1, _extract_txt_text(content))])
+
+
+def extract_text(filename: str, content: bytes) -> str:
+	return "\n".join(text for _, text in iter_segments(filename=filename, content=content)).strip()
+
+
+def hash_file(content: bytes) -> str:
+	return hashlib.sha256(content).hexdigest()
 
 
 def ingest_files(class_id: str, files: list[tuple[str, bytes]]) -> list[dict]:
-	documents: list[dict[str, str]] = []
+	documents: list[dict] = []
 
 	for filename, content in files:
-		text = extract_text(filename=filename, content=content)
-		if not text:
-			continue
-		documents.append({"source": filename, "text": text})
+		documents.append(
+			{
+				"source": filename,
+				"segments": iter_segments(filename=filename, content=content),
+				"file_hash": hash_file(content),
+			}
+		)
+
+	if not documents:
+		return []
+
+	return add_text_documents(class_id=class_id, documents=documents)
+
+
+def _is_archive_document(info: zipfile.ZipInfo) -> bool:
+	path = PurePosixPath(info.filename)
+	if info.is_dir() or path.suffix.lower() not in SUPPORTED_EXTENSIONS:
+		return False
+	# Skip macOS resource forks and hidden files that zip tools add.
+	return not any(part.startswith(".") or part == "__MACOSX" for part in path.parts)
+
+
+def _read_archive_document(archive: zipfile.ZipFile, info: zipfile.ZipInfo) -> dict:
+	content = archive.read(info)
+	return {
+		"source": info.filename,
+		"segments": list(iter_segments(filename=info.filename, content=content)),
+		"file_hash": hash_file(content),
+	}
+
+
+def _check_archive_limits(entries: list[zipfile.ZipInfo]) -> None:
+	# zipfile never inflates an entry past its declared file_size, so checking
+	# the directory bounds what reading the entries can allocate.
+	if len(entries) > ARCHIVE_MAX_ENTRIES:
+		raise ArchiveTooLarge(f"Archive has {len(entries)} documents; the limit is {ARCHIVE_MAX_ENTRIES}")
+	total = 0
+	for info in entries:
+		if info.file_size > ARCHIVE_MAX_ENTRY_BYTES:
+			raise ArchiveTooLarge(
+				f"'{info.filename}' is {info.file_size} bytes uncompressed; the limit is {ARCHIVE_MAX_ENTRY_BYTES}"
+			)
+		if info.file_size > ARCHIVE_MAX_COMPRESSION_RATIO * max(info.compress_size, 1):
+			raise ValueError(f"'{info.filename}' has a suspicious compression ratio")
+		total += info.file_size
+	if total > ARCHIVE_MAX_TOTAL_BYTES:
+		raise ArchiveTooLarge(f"Archive is {total} bytes uncompressed; the limit is {ARCHIVE_MAX_TOTAL_BYTES}")
+
+
+def ingest_archive(class_id: str, archive_file: BinaryIO) -> list[dict]:
+	"""Ingest every supported document in a zip archive with a single store write.
+
+	Entries are decompressed one at a time by a bounded worker pool, so at most
+	a few raw files are held in memory while text is extracted in parallel.
+	Raises ArchiveTooLarge past the entry count and uncompressed size limits,
+	and ValueError for an entry that inflates implausibly.
+	"""
+	with zipfile.ZipFile(archive_file) as archive:
+		entries = [info for info in archive.infolist() if _is_archive_document(info)]
+		_check_archive_limits(entries)
+		documents: list[dict] = []
+		pending: list[Future] = []
+
+		with ThreadPoolExecutor(max_workers=ARCHIVE_INGEST_WORKERS) as executor:
+			for info in entries:
+				if len(pending) >= ARCHIVE_INGEST_WORKERS * 2:
+					documents.append(pending.pop(0).result())
+				pending.append(executor.submit(_read_archive_document, archive, info))
+			documents.extend(future.result() for future in pending)
 
 	if not documents:
 		return []
@@ -0,0 +1,81 @@
+"""JSON repair tool.
+
+Called by the orchestrator when model output that should be JSON does not
+parse: strips code fences and surrounding prose, removes trailing commas,
+and closes output that was cut off mid-item by dropping the partial item.
+"""
+
+from __future__ import annotations
+
+import json
+import re
+
+_FENCE_PATTERN = re.compile(r"^```[a-zA-Z]*\s*|\s*```$")
+_TRAILING_COMMA_PATTERN = re.compile(r",(\s*[}\]])")
+
+
+def _outer_span(text: str) -> str:
+	starts = [index for index in (text.find("{"), text.find("[")) if index != -1]
+	if not starts:
+		return text
+	start = min(starts)
+	end = max(text.rfind("}"), text.rfind("]"))
+	return text[start : end + 1] if end > start else text[start:]
+
+
+def _close_truncated(text: str) -> str | None:
+	"""Cut ``text`` after its last complete nested value and close the open brackets."""
+	stack: list[str] = []
+	in_string = False
+	escaped = False
+	last_complete: tuple[int, list[str]] | None = None
+	for index, char in enumerate(text):
+		if in_string:
+			if escaped:
+				escaped = False
+			elif char == "\\":
+				escaped = True
+			elif char == '"':
+				in_string = False
+			continue
+		if char == '"':
+			in_string = True
+		elif char in "{[":
+			stack.append("}" if char == "{" else "]")
+		elif char in "}]":
+			if not stack or stack[-1] != char:
+				return None
+			stack.pop()
+			if not stack:
+				return text[: index + 1]
+			last_complete = (index + 1, list(stack))
+	if last_complete is None:
+		return None
+	end, still_open = last_complete
+	return text[:end] + "".join(reversed(still_open))
+
+
+def repair_json(text: str, wrap_key: str | None = None) -> str:
+	"""Return a parseable JSON string recovered from near-valid model output.
+
+	When ``wrap_key`` is given, a bare top-level array is wrapped as
+	``{wrap_key: [...]}``. Raises ValueError if nothing parseable is left.
+	"""
+	candidate = _outer_span(_FENCE_PATTERN.sub("", text.strip()))
+	# Cheapest fix first; valid JSON is never rewritten.
+	for fix in (
+		lambda raw: raw,
+		lambda raw: _TRAILING_COMMA_PATTERN.sub(r"\1", raw),
+		lambda raw: _TRAILING_COMMA_PATTERN.sub(r"\1", _close_truncated(raw) or ""),
+	):
+		try:
+			value = json.loads(fix(candidate))
+			break
+		except json.JSONDecodeError:
+			continue
+	else:
+		raise ValueError("Model output is not recoverable JSON")
+
+	if wrap_key and isinstance(value, list):
+		value = {wrap_key: value}
+	return json.dumps(value)
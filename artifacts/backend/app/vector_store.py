@@ -5,28 +5,71 @@ Tools call into this module to save and retrieve content.
 
 from __future__ import annotations
 
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
+import asyncio
+import functools
+import hashlib
+import io
+import logging
+import math
 import os
 from pathlib import Path
 from threading import Lock
-from typing import Any
+from typing import Any, Iterable, Iterator
 import json
 import re
+import time
 import uuid
 
 from dotenv import load_dotenv
 
+from app import dedup, lexical_mirror
+from app.circuit_breaker import CircuitBreaker
+
 load_dotenv(Path(__file__).resolve().parents[2] / ".env")
 
 VECTOR_BACKEND = os.getenv("VECTOR_BACKEND", "supabase").lower()
 SUPABASE_DB_URL = os.getenv("SUPABASE_DB_URL")
 EMBEDDING_MODEL = os.getenv("EMBEDDING_MODEL", "text-embedding-3-small")
 EMBEDDING_DIMENSIONS = int(os.getenv("EMBEDDING_DIMENSIONS", "1536"))
+EMBEDDING_BATCH_SIZE = int(os.getenv("EMBEDDING_BATCH_SIZE", "256"))
+
+# Threads for blocking retrieval work (local store scans, pgvector queries), kept off the event loop.
+RETRIEVAL_MAX_WORKERS = int(os.getenv("RETRIEVAL_MAX_WORKERS", "8"))
+# Supabase retrieval slower than this is abandoned for the lexical mirror. It also bounds the query
+# embedding call, the database connect and the pgvector statement, so no retrieval thread waits longer.
+RETRIEVAL_TIMEOUT_SECONDS = float(os.getenv("RETRIEVAL_TIMEOUT_SECONDS", "5"))
+RETRIEVAL_BREAKER_FAILURES = int(os.getenv("RETRIEVAL_BREAKER_FAILURES", "3"))
+RETRIEVAL_BREAKER_RESET_SECONDS = float(os.getenv("RETRIEVAL_BREAKER_RESET_SECONDS", "30"))
 
 STORE_PATH = Path(__file__).resolve().parents[1] / "data" / "vector_store.json"
 _STORE_LOCK = Lock()
 _SCHEMA_READY = False
 
+# Embedding generations are re-read periodically so every worker picks up a
+# migration switch without a restart.
+_GENERATIONS_TTL_SECONDS = 30.0
+_generations_cache: dict[str, Any] = {"loaded_at": 0.0, "rows": []}
+_generations_lock = Lock()
+_IDENTIFIER_PATTERN = re.compile(r"^[a-z_][a-z0-9_]{0,62}$")
+_RETRIEVAL_EXECUTOR = ThreadPoolExecutor(max_workers=RETRIEVAL_MAX_WORKERS, thread_name_prefix="retrieval")
+_async_openai_client = None
+
+logger = logging.getLogger(__name__)
+
+# Guards the embeddings API and pgvector on the query path; when open, retrieval uses the lexical mirror.
+retrieval_breaker = CircuitBreaker("retrieval", RETRIEVAL_BREAKER_FAILURES, RETRIEVAL_BREAKER_RESET_SECONDS)
+_FALLBACK_STATS = {"fallbacks": 0}
+
+
+class RetrievalUnavailable(Exception):
+	"""Supabase retrieval is down and the class has no lexical mirror; retry after ``retry_after`` seconds."""
+
+	def __init__(self, class_id: str):
+		super().__init__(f"Retrieval is unavailable for class '{class_id}', retry after {RETRIEVAL_BREAKER_RESET_SECONDS:.0f}s")
+		self.retry_after = max(1, math.ceil(RETRIEVAL_BREAKER_RESET_SECONDS))
+
 
 def _ensure_store_file() -> None:
 	STORE_PATH.parent.mkdir(parents=True, exist_ok=True)
@@ -49,6 +92,116 @@ def _tokenize(text: str) -> list[str]:
 	return re.findall(r"[a-zA-Z0-9_]+", text.lower())
 
 
+def _hash_text(text: str) -> str:
+	return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+def _document_segments(document: dict[str, Any]) -> Iterable[tuple[int, str]]:
+	"""Return the document's ``(page, text)`` segment stream.
+
+	Documents built by ingest carry a lazy ``segments`` iterator; plain
+	``{"source", "text"}`` documents are treated as a single page.
+	"""
+	segments = document.get("segments")
+	if segments is None:
+		return [(1, document.get("text", ""))]
+	return segments
+
+
+def _document_chunks(document: dict[str, Any], segments: Iterable[tuple[int, str]]) -> list[dict[str, Any]]:
+	# Offline indexers chunk in worker processes and hand over ready-made chunks.
+	if "chunks" in document:
+		return document["chunks"]
+	return chunk_segments(segments)
+
+
+def _document_file_hash(document: dict[str, Any]) -> tuple[str, Iterable[tuple[int, str]]]:
+	segments = _document_segments(document)
+	if document.get("file_hash"):
+		return document["file_hash"], segments
+
+	segments = list(segments)
+	return _hash_text("\f".join(f"{page}:{text}" for page, text in segments)), segments
+
+
+def chunk_segments(segments: Iterable[tuple[int, str]]) -> list[dict[str, Any]]:
+	"""Chunk a segment stream and attach a content hash to each chunk."""
+	chunks: list[dict[str, Any]] = []
+	for chunk in _iter_chunks(segments):
+		chunk["content_hash"] = _hash_text(chunk["text"])
+		chunks.append(chunk)
+	return chunks
+
+
+def _plan_reingest(existing: list[dict[str, Any]], chunks: list[dict[str, Any]]) -> dict[str, Any]:
+	"""Diff new chunks against the live chunks of the same source by content hash.
+
+	Returns which new chunks must be inserted (with their final index), which
+	existing chunk ids are kept (with their new index) and which are tombstoned.
+	"""
+	available: dict[str, list[dict[str, Any]]] = {}
+	for row in existing:
+		if row.get("content_hash"):
+			available.setdefault(row["content_hash"], []).append(row)
+
+	insert: list[tuple[int, dict[str, Any]]] = []
+	keep: list[tuple[str, int]] = []
+	for index, chunk in enumerate(chunks):
+		matches = available.get(chunk["content_hash"])
+		if matches:
+			keep.append((matches.pop()["id"], index))
+		else:
+			insert.append((index, chunk))
+
+	kept_ids = {chunk_id for chunk_id, _ in keep}
+	remove = [row["id"] for row in existing if row["id"] not in kept_ids]
+	return {"insert": insert, "keep": keep, "remove": remove}
+
+
+def _drop_near_duplicates(
+	index: dedup.LSHIndex | None,
+	plan: dict[str, Any],
+) -> tuple[list[tuple[int, dict[str, Any]]], int]:
+	"""Assign ids to planned inserts and drop near-duplicates of chunks already in the class.
+
+	Tombstoned chunks leave the index first so a revised chunk is not matched
+	against its own previous version. Accepted chunks join the index right
+	away, which also catches duplicates within the same upload.
+	"""
+	if index is not None:
+		for chunk_id in plan["remove"]:
+			index.remove(chunk_id)
+
+	accepted: list[tuple[int, dict[str, Any]]] = []
+	skipped = 0
+	for position, chunk in plan["insert"]:
+		chunk["id"] = str(uuid.uuid4())
+		if index is not None:
+			signature = dedup.minhash(chunk["text"])
+			if index.find_duplicate(signature) is not None:
+				skipped += 1
+				continue
+			index.add(chunk["id"], signature)
+		accepted.append((position, chunk))
+	return accepted, skipped
+
+
+def _summary(
+	source: str,
+	added: int,
+	unchanged: int = 0,
+	removed: int = 0,
+	skipped: int = 0,
+) -> dict[str, Any]:
+	return {
+		"filename": source,
+		"chunk_count": added,
+		"chunks_unchanged": unchanged,
+		"chunks_removed": removed,
+		"chunks_skipped": skipped,
+	}
+
+
 def _use_supabase_backend() -> bool:
 	return VECTOR_BACKEND == "supabase" and bool(SUPABASE_DB_URL)
 
@@ -59,20 +212,118 @@ def _get_openai_client():
 	return OpenAI()
 
 
+def _get_async_openai_client():
+	# Shared so query embeddings reuse one connection pool.
+	global _async_openai_client
+	if _async_openai_client is None:
+		from openai import AsyncOpenAI
+
+		_async_openai_client = AsyncOpenAI()
+	return _async_openai_client
+
+
 def _to_pgvector_literal(vector: list[float]) -> str:
 	return "[" + ",".join(f"{value:.12f}" for value in vector) + "]"
 
 
-def _embed_texts(texts: list[str]) -> list[list[float]]:
+def _embed_texts(texts: list[str], generation: dict[str, Any] | None = None) -> list[list[float]]:
+	"""Embed texts with the model of ``generation`` (the active one by default)."""
+	generation = generation or _active_generation()
+	options = _embedding_options(generation)
+
 	client = _get_openai_client()
-	response = client.embeddings.create(model=EMBEDDING_MODEL, input=texts)
-	return [item.embedding for item in response.data]
+	embeddings: list[list[float]] = []
+	for start in range(0, len(texts), EMBEDDING_BATCH_SIZE):
+		response = client.embeddings.create(input=texts[start : start + EMBEDDING_BATCH_SIZE], **options)
+		embeddings.extend(item.embedding for item in response.data)
+	return embeddings
+
+
+def embed_query(text: str, generation: dict[str, Any]) -> list[float]:
+	"""Embed a query-time text within ``RETRIEVAL_TIMEOUT_SECONDS``, without retries.
+
+	Failures are left to the retrieval circuit breaker instead of being retried
+	while a request waits.
+	"""
+	client = _get_openai_client().with_options(timeout=RETRIEVAL_TIMEOUT_SECONDS, max_retries=0)
+	return client.embeddings.create(input=[text], **_embedding_options(generation)).data[0].embedding
+
+
+def _embedding_options(generation: dict[str, Any]) -> dict[str, Any]:
+	options: dict[str, Any] = {"model": generation["model"]}
+	# Older models (text-embedding-ada-002) reject the dimensions parameter.
+	if _supports_dimensions(generation["model"]):
+		options["dimensions"] = generation["dimensions"]
+	return options
+
+
+def _supports_dimensions(model: str) -> bool:
+	"""Whether the embedding model can shorten its vectors to a requested size."""
+	return model.startswith("text-embedding-3")
+
+
+def _base_generation() -> dict[str, Any]:
+	return {
+		"name": "base",
+		"model": EMBEDDING_MODEL,
+		"dimensions": EMBEDDING_DIMENSIONS,
+		"column_name": "embedding",
+		"status": "active",
+	}
+
+
+def _embedding_generations(refresh: bool = False) -> list[dict[str, Any]]:
+	"""Active and migrating embedding generations, cached for a few seconds."""
+	if not _use_supabase_backend():
+		return [_base_generation()]
+
+	with _generations_lock:
+		if refresh or time.monotonic() - _generations_cache["loaded_at"] > _GENERATIONS_TTL_SECONDS:
+			_ensure_supabase_schema()
+			with _get_db_connection(connect_timeout=RETRIEVAL_TIMEOUT_SECONDS) as connection:
+				with connection.cursor() as cursor:
+					generations = _read_generations(cursor)
+			_generations_cache.update(loaded_at=time.monotonic(), rows=generations)
+		return list(_generations_cache["rows"])
+
+
+def _read_generations(cursor) -> list[dict[str, Any]]:
+	cursor.execute(
+		"""
+		SELECT name, model, dimensions, column_name, status
+		FROM embedding_generations
+		WHERE status IN ('active', 'migrating')
+		ORDER BY created_at
+		"""
+	)
+	generations = [
+		{"name": row[0], "model": row[1], "dimensions": row[2], "column_name": row[3], "status": row[4]}
+		for row in cursor.fetchall()
+	]
+	for generation in generations:
+		if not _IDENTIFIER_PATTERN.match(generation["column_name"]):
+			raise ValueError(f"Invalid embedding column name: {generation['column_name']}")
+	return generations
+
 
+def _active_generation() -> dict[str, Any]:
+	for generation in _embedding_generations():
+		if generation["status"] == "active":
+			return generation
+	return _base_generation()
 
-def _get_db_connection():
+
+def _write_generations() -> list[dict[str, Any]]:
+	"""Generations new chunks must be embedded for: the active one plus any being migrated to."""
+	return _embedding_generations() or [_base_generation()]
+
+
+def _get_db_connection(connect_timeout: float | None = None):
 	import psycopg2
 
-	return psycopg2.connect(SUPABASE_DB_URL)
+	if connect_timeout is None:
+		return psycopg2.connect(SUPABASE_DB_URL)
+	return psycopg2.connect(SUPABASE_DB_URL, connect_timeout=max(1, math.ceil(connect_timeout)))
 
 
 def _ensure_supabase_schema() -> None:
@@ -102,72 +353,357 @@ def _ensure_supabase_schema() -> None:
 				ON study_chunks (class_id);
 				"""
 			)
+			cursor.execute(
+				"""
+				ALTER TABLE study_chunks
+					ADD COLUMN IF NOT EXISTS page INTEGER,
+					ADD COLUMN IF NOT EXISTS char_start INTEGER,
+					ADD COLUMN IF NOT EXISTS char_end INTEGER,
+					ADD COLUMN IF NOT EXISTS content_hash TEXT,
+					ADD COLUMN IF NOT EXISTS file_hash TEXT,
+					ADD COLUMN IF NOT EXISTS deleted_at TIMESTAMPTZ;
+				"""
+			)
+			cursor.execute(
+				"""
+				CREATE INDEX IF NOT EXISTS idx_study_chunks_live_source
+				ON study_chunks (class_id, source)
+				WHERE deleted_at IS NULL;
+				"""
+			)
+			cursor.execute(
+				"""
+				CREATE TABLE IF NOT EXISTS embedding_generations (
+					name TEXT PRIMARY KEY,
+					model TEXT NOT NULL,
+					dimensions INTEGER NOT NULL,
+					column_name TEXT NOT NULL UNIQUE,
+					status TEXT NOT NULL,
+					created_at TIMESTAMPTZ NOT NULL DEFAULT NOW(),
+					activated_at TIMESTAMPTZ
+				);
+				"""
+			)
+			cursor.execute(
+				"""
+				ALTER TABLE embedding_generations
+					ADD COLUMN IF NOT EXISTS migration_status TEXT,
+					ADD COLUMN IF NOT EXISTS migration_total INTEGER,
+					ADD COLUMN IF NOT EXISTS migration_embedded INTEGER,
+					ADD COLUMN IF NOT EXISTS migration_error TEXT,
+					ADD COLUMN IF NOT EXISTS migration_started_at TIMESTAMPTZ,
+					ADD COLUMN IF NOT EXISTS migration_completed_at TIMESTAMPTZ,
+					ADD COLUMN IF NOT EXISTS migration_updated_at TIMESTAMPTZ;
+				"""
+			)
+			cursor.execute(
+				"""
+				INSERT INTO embedding_generations (name, model, dimensions, column_name, status, activated_at)
+				VALUES ('base', %s, %s, 'embedding', 'active', NOW())
+				ON CONFLICT (name) DO NOTHING;
+				""",
+				(EMBEDDING_MODEL, EMBEDDING_DIMENSIONS),
+			)
+			cursor.execute(
+				"""
+				CREATE TABLE IF NOT EXISTS class_corpus_versions (
+					class_id TEXT PRIMARY KEY,
+					version BIGINT NOT NULL,
+					updated_at TIMESTAMPTZ NOT NULL DEFAULT NOW()
+				);
+				"""
+			)
 
 	_SCHEMA_READY = True
 
 
-def _add_text_documents_supabase(class_id: str, documents: list[dict[str, str]]) -> list[dict[str, Any]]:
+def _bump_corpus_version_supabase(cursor, class_id: str) -> int:
+	cursor.execute(
+		"""
+		INSERT INTO class_corpus_versions (class_id, version)
+		VALUES (%s, 1)
+		ON CONFLICT (class_id) DO UPDATE
+		SET version = class_corpus_versions.version + 1, updated_at = NOW()
+		RETURNING version
+		""",
+		(class_id,),
+	)
+	return cursor.fetchone()[0]
+
+
+def _bump_corpus_version_local(store: dict[str, Any], class_id: str) -> int:
+	versions = store.setdefault("corpus_versions", {})
+	versions[class_id] = versions.get(class_id, 0) + 1
+	return versions[class_id]
+
+
+def _corpus_version_supabase(cursor, class_id: str) -> int:
+	cursor.execute("SELECT version FROM class_corpus_versions WHERE class_id = %s", (class_id,))
+	row = cursor.fetchone()
+	return row[0] if row else 0
+
+
+def corpus_version(class_id: str) -> int:
+	"""Return a counter that changes whenever a class's indexed content changes."""
+	if _use_supabase_backend():
+		_ensure_supabase_schema()
+		# Read on the request path (caches, generation); bounded like retrieval.
+		with _get_db_connection(connect_timeout=RETRIEVAL_TIMEOUT_SECONDS) as connection:
+			with connection.cursor() as cursor:
+				cursor.execute("SET LOCAL statement_timeout = %s", (int(RETRIEVAL_TIMEOUT_SECONDS * 1000),))
+				return _corpus_version_supabase(cursor, class_id)
+
+	return _load_store().get("corpus_versions", {}).get(class_id, 0)
+
+
+def _fetch_live_chunks_supabase(cursor, class_id: str, source: str) -> list[dict[str, Any]]:
+	cursor.execute(
+		"""
+		SELECT id, chunk_index, content_hash, file_hash
+		FROM study_chunks
+		WHERE class_id = %s AND source = %s AND deleted_at IS NULL
+		""",
+		(class_id, source),
+	)
+	return [
+		{"id": str(row[0]), "chunk_index": row[1], "content_hash": row[2], "file_hash": row[3]}
+		for row in cursor.fetchall()
+	]
+
+
+def _class_dedup_index_supabase(cursor, class_id: str, version: int) -> dedup.LSHIndex | None:
+	if not dedup.DEDUP_ENABLED:
+		return None
+
+	def load_chunks() -> list[tuple[str, str]]:
+		cursor.execute(
+			"SELECT id, content FROM study_chunks WHERE class_id = %s AND deleted_at IS NULL",
+			(class_id,),
+		)
+		return [(str(row[0]), row[1]) for row in cursor.fetchall()]
+
+	return dedup.class_index(class_id, version, load_chunks)
+
+
+def _copy_value(value: Any) -> str:
+	if value is None:
+		return "\\N"
+	return (
+		str(value)
+		.replace("\\", "\\\\")
+		.replace("\t", "\\t")
+		.replace("\n", "\\n")
+		.replace("\r", "\\r")
+	)
+
+
+def _copy_rows(cursor, table: str, columns: list[str], rows: list[tuple]) -> None:
+	"""Bulk load rows with COPY ... FROM STDIN in Postgres text format."""
+	buffer = io.StringIO()
+	for row in rows:
+		buffer.write("\t".join(_copy_value(value) for value in row))
+		buffer.write("\n")
+	buffer.seek(0)
+	cursor.copy_expert(f"COPY {table} ({', '.join(columns)}) FROM STDIN", buffer)
+
+
+_CHUNK_COLUMNS = [
+	"id",
+	"class_id",
+	"source",
+	"chunk_index",
+	"page",
+	"char_start",
+	"char_end",
+	"content",
+	"content_hash",
+	"file_hash",
+]
+
+
+def _insert_chunk_rows(cursor, generations: list[dict[str, Any]], rows: list[tuple], bulk: bool = False) -> None:
+	"""Insert chunk rows; each row ends with one pgvector literal per generation."""
+	from psycopg2.extras import execute_values
+
+	if not rows:
+		return
+
+	columns = _CHUNK_COLUMNS + [generation["column_name"] for generation in generations]
+	if bulk:
+		_copy_rows(cursor, "study_chunks", columns, rows)
+		return
+
+	template = "(" + ", ".join(["%s"] * len(_CHUNK_COLUMNS) + ["%s::vector"] * len(generations)) + ")"
+	execute_values(
+		cursor,
+		f"INSERT INTO study_chunks ({', '.join(columns)}) VALUES %s",
+		rows,
+		template=template,
+		page_size=500,
+	)
+
+
+def _add_text_documents_supabase(
+	class_id: str,
+	documents: list[dict[str, Any]],
+	bulk: bool = False,
+) -> list[dict[str, Any]]:
+	from psycopg2.extras import execute_values
+
 	_ensure_supabase_schema()
 
 	summaries: list[dict[str, Any]] = []
-	rows_to_insert: list[tuple[str, str, str, int, str, str]] = []
+	removals: list[str] = []
+	updates: list[tuple[str, int, str]] = []
+	inserts: list[tuple[str, int, dict[str, Any], str]] = []
 
-	for document in documents:
-		source = document["source"]
-		chunks = _chunk_text(document["text"])
-		summaries.append({"filename": source, "chunk_count": len(chunks)})
-
-		if not chunks:
-			continue
+	with _get_db_connection() as connection:
+		with connection.cursor() as cursor:
+			version = _corpus_version_supabase(cursor, class_id)
+			new_version = version
+			index = _class_dedup_index_supabase(cursor, class_id, version)
+			for document in documents:
+				source = document["source"]
+				file_hash, segments = _document_file_hash(document)
+				existing = _fetch_live_chunks_supabase(cursor, class_id, source)
+
+				if existing and all(row["file_hash"] == file_hash for row in existing):
+					summaries.append(_summary(source, added=0, unchanged=len(existing)))
+					continue
+
+				chunks = _document_chunks(document, segments)
+				if not chunks and not existing:
+					continue
+
+				plan = _plan_reingest(existing, chunks)
+				accepted, skipped = _drop_near_duplicates(index, plan)
+				removals.extend(plan["remove"])
+				updates.extend((chunk_id, position, file_hash) for chunk_id, position in plan["keep"])
+				inserts.extend((source, position, chunk, file_hash) for position, chunk in accepted)
+				summaries.append(
+					_summary(
+						source,
+						added=len(accepted),
+						unchanged=len(plan["keep"]),
+						removed=len(plan["remove"]),
+						skipped=skipped,
+					)
+				)
 
-		embeddings = _embed_texts(chunks)
-		for index, (chunk, embedding) in enumerate(zip(chunks, embeddings)):
-			rows_to_insert.append(
+			# One batched embedding pass per generation and one write per statement
+			# for the whole upload. During a migration new chunks are dual-written.
+			texts = [chunk["text"] for _, _, chunk, _ in inserts]
+			embedded = {
+				generation["name"]: _embed_texts(texts, generation) if inserts else []
+				for generation in _write_generations()
+			}
+			# This process's generation cache can predate a migration start or switch.
+			# Re-read the generations under a lock a switch must wait for, and embed
+			# for any the cache missed, so every committed row has the active vector.
+			cursor.execute("LOCK TABLE embedding_generations IN SHARE MODE")
+			current = _read_generations(cursor)
+			if [generation["name"] for generation in current] != list(embedded):
+				with _generations_lock:
+					_generations_cache.update(loaded_at=time.monotonic(), rows=current)
+			generations = current or [_base_generation()]
+			for generation in generations:
+				if generation["name"] not in embedded:
+					embedded[generation["name"]] = _embed_texts(texts, generation) if inserts else []
+			vectors = [embedded[generation["name"]] for generation in generations] if inserts else []
+
+			if removals:
+				cursor.execute(
+					"UPDATE study_chunks SET deleted_at = NOW() WHERE id = ANY(%s::uuid[])",
+					(removals,),
+				)
+			if updates:
+				execute_values(
+					cursor,
+					"""
+					UPDATE study_chunks AS chunk
+					SET chunk_index = data.chunk_index, file_hash = data.file_hash
+					FROM (VALUES %s) AS data (id, chunk_index, file_hash)
+					WHERE chunk.id = data.id::uuid
+					""",
+					updates,
+				)
+			rows = [
 				(
-					str(uuid.uuid4()),
+					chunk["id"],
 					class_id,
 					source,
-					index,
-					chunk,
-					_to_pgvector_literal(embedding),
+					position,
+					chunk["page"],
+					chunk["start"],
+					chunk["end"],
+					chunk["text"],
+					chunk["content_hash"],
+					file_hash,
+					*(_to_pgvector_literal(generation_vectors[row]) for generation_vectors in vectors),
 				)
-			)
+				for row, (source, position, chunk, file_hash) in enumerate(inserts)
+			]
+			_insert_chunk_rows(cursor, generations, rows, bulk=bulk)
+			if removals or inserts:
+				new_version = _bump_corpus_version_supabase(cursor, class_id)
+
+	if new_version != version:
+		dedup.advance_class_index(class_id, version, new_version)
+	return summaries
 
-	if not rows_to_insert:
-		return summaries
 
-	with _get_db_connection() as connection:
-		with connection.cursor() as cursor:
-			cursor.executemany(
-				"""
-				INSERT INTO study_chunks (id, class_id, source, chunk_index, content, embedding)
-				VALUES (%s, %s, %s, %s, %s, %s::vector)
-				""",
-				rows_to_insert,
-			)
+def _retrieve_chunks_supabase(class_id: str, query: str, top_k: int) -> list[dict[str, Any]]:
+	generation = _query_generation()
+	query_vector = _to_pgvector_literal(embed_query(query, generation))
+	return _query_chunks_supabase(class_id, generation["column_name"], query_vector, top_k)
 
-	return summaries
 
+async def _aretrieve_chunks_supabase(class_id: str, query: str, top_k: int) -> list[dict[str, Any]]:
+	# The embedding call is awaited on the async client; only the database work takes a thread.
+	generation = await _run_retrieval(_query_generation)
+	client = _get_async_openai_client().with_options(timeout=RETRIEVAL_TIMEOUT_SECONDS, max_retries=0)
+	response = await client.embeddings.create(input=[query], **_embedding_options(generation))
+	query_vector = _to_pgvector_literal(response.data[0].embedding)
+	return await _run_retrieval(_query_chunks_supabase, class_id, generation["column_name"], query_vector, top_k)
 
-def _retrieve_chunks_supabase(class_id: str, query: str, top_k: int) -> list[dict[str, Any]]:
+
+def _query_generation() -> dict[str, Any]:
 	_ensure_supabase_schema()
-	query_vector = _to_pgvector_literal(_embed_texts([query])[0])
+	# Queries are always served from the active generation; a migrating one is
+	# only read after it has been switched in.
+	return _active_generation()
 
-	with _get_db_connection() as connection:
+
+def _query_chunks_supabase(class_id: str, column: str, query_vector: str, top_k: int) -> list[dict[str, Any]]:
+	# Bounded, so a retrieval abandoned by ``aretrieve_chunks`` frees its thread soon after.
+	with _get_db_connection(connect_timeout=RETRIEVAL_TIMEOUT_SECONDS) as connection:
 		with connection.cursor() as cursor:
+			cursor.execute("SET LOCAL statement_timeout = %s", (int(RETRIEVAL_TIMEOUT_SECONDS * 1000),))
 			cursor.execute(
-				"""
-				SELECT source, content, 1 - (embedding <=> %s::vector) AS score
+				f"""
+				SELECT source, content, 1 - ({column} <=> %s::vector) AS score,
+					chunk_index, page, char_start, char_end
 				FROM study_chunks
-				WHERE class_id = %s
-				ORDER BY embedding <=> %s::vector
+				WHERE class_id = %s AND deleted_at IS NULL
+				ORDER BY {column} <=> %s::vector
 				LIMIT %s
 				""",
 				(query_vector, class_id, query_vector, top_k),
 			)
 			rows = cursor.fetchall()
 
-	return [{"source": row[0], "text": row[1], "score": float(row[2])} for row in rows]
+	return [
+		{
+			"source": row[0],
+			"text": row[1],
+			"score": float(row[2]),
+			"chunk_index": row[3],
+			"page": row[4],
+			"char_start": row[5],
+			"char_end": row[6],
+		}
+		for row in rows
+	]
 
 
 def _has_class_content_supabase(class_id: str) -> bool:
@@ -175,74 +711,284 @@ def _has_class_content_supabase(class_id: str) -> bool:
 
 	with _get_db_connection() as connection:
 		with connection.cursor() as cursor:
-			cursor.execute("SELECT 1 FROM study_chunks WHERE class_id = %s LIMIT 1", (class_id,))
+			cursor.execute(
+				"SELECT 1 FROM study_chunks WHERE class_id = %s AND deleted_at IS NULL LIMIT 1",
+				(class_id,),
+			)
 			return cursor.fetchone() is not None
 
 
-def _chunk_text(text: str, chunk_size: int = 900, overlap: int = 120) -> list[str]:
-	normalized = " ".join(text.split())
-	if not normalized:
-		return []
+def _list_class_chunks_supabase(class_id: str) -> list[dict[str, Any]]:
+	_ensure_supabase_schema()
 
-	chunks: list[str] = []
-	start = 0
-	while start < len(normalized):
-		end = min(start + chunk_size, len(normalized))
-		chunks.append(normalized[start:end])
-		if end == len(normalized):
-			break
-		start = max(0, end - overlap)
-	return chunks
+	with _get_db_connection() as connection:
+		with connection.cursor() as cursor:
+			cursor.execute(
+				"""
+				SELECT source, content, chunk_index, page, char_start, char_end, content_hash
+				FROM study_chunks
+				WHERE class_id = %s AND deleted_at IS NULL
+				ORDER BY source, chunk_index
+				""",
+				(class_id,),
+			)
+			rows = cursor.fetchall()
+
+	return [
+		{
+			"source": row[0],
+			"text": row[1],
+			"chunk_index": row[2],
+			"page": row[3],
+			"char_start": row[4],
+			"char_end": row[5],
+			"content_hash": row[6] or _hash_text(row[1]),
+		}
+		for row in rows
+	]
+
+
+_WORD_PATTERN = re.compile(r"\S+")
+_SENTENCE_END_PATTERN = re.compile(r"[.!?][\"')\]]*$")
+
+
+def _iter_words(segments: Iterable[tuple[int, str]], chunk_size: int) -> Iterator[tuple[int, str, int, int]]:
+	"""Yield ``(page, word, start, end)`` with offsets relative to the page text."""
+	current_page: int | None = None
+	page_offset = 0
+	for page, text in segments:
+		if page != current_page:
+			current_page = page
+			page_offset = 0
+		for match in _WORD_PATTERN.finditer(text):
+			start, end = match.span()
+			# Split words that would never fit in a chunk on their own.
+			for piece_start in range(start, end, chunk_size):
+				piece_end = min(piece_start + chunk_size, end)
+				yield page, text[piece_start:piece_end], page_offset + piece_start, page_offset + piece_end
+		page_offset += len(text) + 1
+
+
+def _iter_chunks(
+	segments: Iterable[tuple[int, str]],
+	chunk_size: int = 900,
+	overlap: int = 120,
+) -> Iterator[dict[str, Any]]:
+	"""Stream whitespace-normalized chunks with page and character offsets.
+
+	Words are consumed lazily from ``(page, text)`` segments, so the document is
+	never copied as a whole. A chunk is cut at the last sentence boundary in the
+	second half of the size budget (or at a word boundary when there is none),
+	the next chunk repeats up to ``overlap`` characters of trailing words, and
+	chunks never span pages.
+	"""
+	buffer: list[tuple[str, int, int]] = []
+	length = 0
+	fresh = 0
+	page: int | None = None
+
+	def emit(words: list[tuple[str, int, int]]) -> dict[str, Any]:
+		return {
+			"text": " ".join(word for word, _, _ in words),
+			"page": page,
+			"start": words[0][1],
+			"end": words[-1][2],
+		}
+
+	def cut_point() -> int:
+		prefix = -1
+		cut = len(buffer)
+		for index, (word, _, _) in enumerate(buffer):
+			prefix += len(word) + 1
+			if prefix >= chunk_size // 2 and _SENTENCE_END_PATTERN.search(word):
+				cut = index + 1
+		return cut
+
+	def overlap_tail(words: list[tuple[str, int, int]]) -> list[tuple[str, int, int]]:
+		tail: list[tuple[str, int, int]] = []
+		size = -1
+		for word in reversed(words[1:]):
+			if size + len(word[0]) + 1 > overlap:
+				break
+			tail.append(word)
+			size += len(word[0]) + 1
+		tail.reverse()
+		return tail
+
+	for word_page, word, start, end in _iter_words(segments, chunk_size):
+		if word_page != page:
+			if fresh:
+				yield emit(buffer)
+			buffer, length, fresh, page = [], 0, 0, word_page
+
+		if buffer and length + 1 + len(word) > chunk_size:
+			cut = cut_point()
+			emitted, pending = buffer[:cut], buffer[cut:]
+			yield emit(emitted)
+			tail = overlap_tail(emitted)
+			buffer = tail + pending
+			length = sum(len(w) for w, _, _ in buffer) + max(len(buffer) - 1, 0)
+			fresh = len(pending)
+
+		buffer.append((word, start, end))
+		length += len(word) + (1 if len(buffer) > 1 else 0)
+		fresh += 1
+
+	if fresh:
+		yield emit(buffer)
 
 
-def add_text_documents(class_id: str, documents: list[dict[str, str]]) -> list[dict[str, Any]]:
-	"""Add raw text documents to a class store and return ingest summary per file."""
+def _chunk_text(text: str, chunk_size: int = 900, overlap: int = 120) -> list[str]:
+	return [chunk["text"] for chunk in _iter_chunks([(1, text)], chunk_size=chunk_size, overlap=overlap)]
+
+
+def add_text_documents(
+	class_id: str,
+	documents: list[dict[str, Any]],
+	bulk: bool = False,
+) -> list[dict[str, Any]]:
+	"""Add raw text documents to a class store and return ingest summary per file.
+
+	Each document is ``{"source", "text"}`` or ``{"source", "segments", "file_hash"}``
+	where ``segments`` is a (possibly lazy) stream of ``(page, text)`` pairs.
+	Re-ingesting a known source only stores chunks whose content changed and
+	tombstones the chunks that disappeared. ``bulk`` loads new rows with COPY
+	on the Supabase backend, for offline indexing jobs.
+	"""
 	if _use_supabase_backend():
-		return _add_text_documents_supabase(class_id=class_id, documents=documents)
+		try:
+			summaries = _add_text_documents_supabase(class_id=class_id, documents=documents, bulk=bulk)
+		except Exception:
+			# The transaction rolled back; rebuild the dedup index from what was committed.
+			dedup.drop_class_index(class_id)
+			raise
+		# Bulk jobs refresh the mirror once per class when they finish.
+		if not bulk and any(summary["chunk_count"] or summary["chunks_removed"] for summary in summaries):
+			_refresh_lexical_mirror_after_ingest(class_id)
+		return summaries
 
+	try:
+		return _add_text_documents_local(class_id=class_id, documents=documents)
+	except Exception:
+		# Nothing was saved; rebuild the dedup index from the store.
+		dedup.drop_class_index(class_id)
+		raise
+
+
+def _add_text_documents_local(class_id: str, documents: list[dict[str, Any]]) -> list[dict[str, Any]]:
 	store = _load_store()
 	class_chunks = store.setdefault("classes", {}).setdefault(class_id, [])
 
 	summaries: list[dict[str, Any]] = []
+	changed = False
 	now = datetime.utcnow().isoformat()
+	version = store.get("corpus_versions", {}).get(class_id, 0)
+	index = (
+		dedup.class_index(
+			class_id,
+			version,
+			lambda: [(c["id"], c["text"]) for c in class_chunks if not c.get("deleted_at")],
+		)
+		if dedup.DEDUP_ENABLED
+		else None
+	)
 
 	for document in documents:
 		source = document["source"]
-		text = document["text"]
-		chunks = _chunk_text(text)
-		for chunk in chunks:
+		file_hash, segments = _document_file_hash(document)
+		existing = [c for c in class_chunks if c["source"] == source and not c.get("deleted_at")]
+
+		if existing and all(c.get("file_hash") == file_hash for c in existing):
+			summaries.append(_summary(source, added=0, unchanged=len(existing)))
+			continue
+
+		chunks = _document_chunks(document, segments)
+		if not chunks and not existing:
+			continue
+
+		plan = _plan_reingest(existing, chunks)
+		inserts, skipped = _drop_near_duplicates(index, plan)
+		by_id = {c["id"]: c for c in existing}
+		for chunk_id in plan["remove"]:
+			by_id[chunk_id]["deleted_at"] = now
+		for chunk_id, position in plan["keep"]:
+			by_id[chunk_id]["chunk_index"] = position
+			by_id[chunk_id]["file_hash"] = file_hash
+		for position, chunk in inserts:
 			class_chunks.append(
 				{
-					"id": str(uuid.uuid4()),
+					"id": chunk["id"],
 					"source": source,
-					"text": chunk,
-					"tokens": _tokenize(chunk),
+					"chunk_index": position,
+					"page": chunk["page"],
+					"char_start": chunk["start"],
+					"char_end": chunk["end"],
+					"text": chunk["text"],
+					"tokens": _tokenize(chunk["text"]),
+					"content_hash": chunk["content_hash"],
+					"file_hash": file_hash,
 					"created_at": now,
 				}
 			)
-		summaries.append({"filename": source, "chunk_count": len(chunks)})
 
+		changed = changed or bool(inserts or plan["remove"])
+		summaries.append(
+			_summary(
+				source,
+				added=len(inserts),
+				unchanged=len(plan["keep"]),
+				removed=len(plan["remove"]),
+				skipped=skipped,
+			)
+		)
+
+	new_version = _bump_corpus_version_local(store, class_id) if changed else version
 	_save_store(store)
+	if changed:
+		dedup.advance_class_index(class_id, version, new_version)
 	return summaries
 
 
+def _retrieved(chunk: dict[str, Any], score: float) -> dict[str, Any]:
+	return {
+		"source": chunk["source"],
+		"text": chunk["text"],
+		"score": score,
+		"chunk_index": chunk.get("chunk_index"),
+		"page": chunk.get("page"),
+		"char_start": chunk.get("char_start"),
+		"char_end": chunk.get("char_end"),
+	}
+
+
 def retrieve_chunks(class_id: str, query: str, top_k: int = 5) -> list[dict[str, Any]]:
-	"""Retrieve best matching chunks for a class using lexical overlap scoring."""
+	"""Retrieve best matching chunks for a class using lexical overlap scoring.
+
+	Each result carries ``source``, ``text`` and ``score`` plus the chunk's
+	position (``chunk_index``, ``page``, ``char_start``, ``char_end``) when known.
+	"""
 	if _use_supabase_backend():
-		return _retrieve_chunks_supabase(class_id=class_id, query=query, top_k=top_k)
+		if not retrieval_breaker.allow():
+			return _retrieve_from_mirror(class_id, query, top_k)
+		try:
+			chunks = _retrieve_chunks_supabase(class_id=class_id, query=query, top_k=top_k)
+		except Exception as error:
+			retrieval_breaker.record_failure()
+			return _retrieve_from_mirror(class_id, query, top_k, error)
+		retrieval_breaker.record_success()
+		return chunks
 
 	store = _load_store()
-	chunks: list[dict[str, Any]] = store.get("classes", {}).get(class_id, [])
+	chunks: list[dict[str, Any]] = [
+		c for c in store.get("classes", {}).get(class_id, []) if not c.get("deleted_at")
+	]
 	if not chunks:
 		return []
 
 	query_tokens = set(_tokenize(query))
 	if not query_tokens:
 		# No query tokens: return most recent chunks
-		return [
-			{"source": c["source"], "text": c["text"], "score": 0}
-			for c in chunks[-top_k:]
-		]
+		return [_retrieved(c, 0) for c in chunks[-top_k:]]
 
 	scored: list[tuple[int, dict[str, Any]]] = []
 	for chunk in chunks:
@@ -254,15 +1000,92 @@ def retrieve_chunks(class_id: str, query: str, top_k: int = 5) -> list[dict[str,
 
 	# If no token overlap found, return most recent chunks as fallback
 	if scored[0][0] == 0:
-		return [
-			{"source": c["source"], "text": c["text"], "score": 0}
-			for c in chunks[-top_k:]
-		]
+		return [_retrieved(c, 0) for c in chunks[-top_k:]]
+
+	return [_retrieved(chunk, score) for score, chunk in scored[:top_k]]
+
+
+async def _run_retrieval(function: Any, *args: Any) -> Any:
+	return await asyncio.get_running_loop().run_in_executor(_RETRIEVAL_EXECUTOR, functools.partial(function, *args))
+
+
+async def aretrieve_chunks(class_id: str, query: str, top_k: int = 5) -> list[dict[str, Any]]:
+	"""Awaitable ``retrieve_chunks`` that never blocks the event loop.
+
+	The Supabase backend awaits the query embedding natively and runs the
+	pgvector query on the bounded retrieval thread pool; the local backend runs
+	its whole scan there. At most ``RETRIEVAL_MAX_WORKERS`` retrievals block a
+	thread at once; more wait for one to free up. A Supabase retrieval that
+	fails or takes longer than ``RETRIEVAL_TIMEOUT_SECONDS`` is answered from
+	the lexical mirror instead.
+	"""
+	if not _use_supabase_backend():
+		return await _run_retrieval(retrieve_chunks, class_id, query, top_k)
+
+	if not retrieval_breaker.allow():
+		return _retrieve_from_mirror(class_id, query, top_k)
+	try:
+		chunks = await asyncio.wait_for(
+			_aretrieve_chunks_supabase(class_id=class_id, query=query, top_k=top_k),
+			RETRIEVAL_TIMEOUT_SECONDS,
+		)
+	except Exception as error:
+		retrieval_breaker.record_failure()
+		return _retrieve_from_mirror(class_id, query, top_k, error)
+	retrieval_breaker.record_success()
+	return chunks
 
-	return [
-		{"source": chunk["source"], "text": chunk["text"], "score": score}
-		for score, chunk in scored[:top_k]
+
+def _retrieve_from_mirror(
+	class_id: str,
+	query: str,
+	top_k: int,
+	error: Exception | None = None,
+) -> list[dict[str, Any]]:
+	"""Lexical fallback for Supabase retrieval; re-raises ``error`` if the class has no mirror."""
+	if not lexical_mirror.has_class(class_id):
+		if error is not None:
+			raise error
+		raise RetrievalUnavailable(class_id)
+	_FALLBACK_STATS["fallbacks"] += 1
+	if error is not None:
+		logger.warning("Supabase retrieval failed, serving class %s from the lexical mirror: %r", class_id, error)
+	return [_retrieved(chunk, score) for score, chunk in lexical_mirror.search(class_id, set(_tokenize(query)), top_k)]
+
+
+def refresh_lexical_mirror(class_id: str) -> int:
+	"""Rebuild the class's lexical mirror from Supabase. Returns the number of chunks mirrored.
+
+	Does nothing on the local backend, which is lexical already.
+	"""
+	if not _use_supabase_backend():
+		return 0
+	chunks = [
+		{
+			"source": chunk["source"],
+			"text": chunk["text"],
+			"chunk_index": chunk["chunk_index"],
+			"page": chunk["page"],
+			"char_start": chunk["char_start"],
+			"char_end": chunk["char_end"],
+			"tokens": _tokenize(chunk["text"]),
+		}
+		for chunk in _list_class_chunks_supabase(class_id)
 	]
+	lexical_mirror.replace(class_id, chunks)
+	return len(chunks)
+
+
+def _refresh_lexical_mirror_after_ingest(class_id: str) -> None:
+	# The ingest itself is committed; a stale mirror only matters while Supabase is down.
+	try:
+		refresh_lexical_mirror(class_id)
+	except Exception:
+		logger.exception("Could not refresh the lexical mirror of class %s", class_id)
+
+
+def retrieval_health() -> dict[str, Any]:
+	return {**retrieval_breaker.stats(), **_FALLBACK_STATS, **lexical_mirror.stats()}
 
 
 def has_class_content(class_id: str) -> bool:
@@ -270,4 +1093,24 @@ def has_class_content(class_id: str) -> bool:
 		return _has_class_content_supabase(class_id=class_id)
 
 	store = _load_store()
-	return bool(store.get("classes", {}).get(class_id))
+	return any(not c.get("deleted_at") for c in store.get("classes", {}).get(class_id, []))
+
+
+def list_class_chunks(class_id: str) -> list[dict[str, Any]]:
+	"""Return every live chunk of a class, ordered by source and position, without embeddings.
+
+	Each chunk carries ``source``, ``text``, ``content_hash`` and its position fields.
+	"""
+	if _use_supabase_backend():
+		return _list_class_chunks_supabase(class_id=class_id)
+
+	store = _load_store()
+	chunks = [c for c in store.get("classes", {}).get(class_id, []) if not c.get("deleted_at")]
+	chunks.sort(key=lambda c: (c["source"], c.get("chunk_index") or 0))
+	return [
+		{
+			**_retrieved(c, 0),
+			"content_hash": c.get("content_hash") or _hash_text(c["text"]),
+		}
+		for c in chunks
+	]
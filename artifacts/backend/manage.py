@@ -0,0 +1,147 @@
+"""Command-line entry point for offline maintenance jobs.
+
+Run ``python manage.py --help`` from artifacts/backend to list the commands.
+"""
+
+import argparse
+import json
+from pathlib import Path
+
+
+def _parse_class_map(pairs):
+    class_map = {}
+    for pair in pairs or []:
+        directory, _, class_id = pair.partition("=")
+        if not directory or not class_id:
+            raise argparse.ArgumentTypeError(f"Expected DIRECTORY=CLASS_ID, got '{pair}'")
+        class_map[directory] = class_id
+    return class_map
+
+
+def index_command(args):
+    from app.tools.bulk_index import run_bulk_index
+
+    stats = run_bulk_index(
+        root=Path(args.root),
+        class_map=_parse_class_map(args.map),
+        workers=args.workers,
+        batch_size=args.batch_size,
+        checkpoint=Path(args.checkpoint) if args.checkpoint else None,
+    )
+    print(json.dumps(stats, indent=2))
+
+
+def export_command(args):
+    from app.snapshot import export_class
+
+    with open(args.output, "wb") as stream:
+        header = export_class(args.class_id, stream)
+    print(f"Exported {header['chunk_count']} chunks of '{args.class_id}' to {args.output}")
+
+
+def import_command(args):
+    from app.snapshot import import_class
+
+    with open(args.snapshot, "rb") as stream:
+        result = import_class(stream, class_id=args.class_id)
+    print(f"Imported {result['chunks_imported']} chunks into '{result['class_id']}'")
+
+
+def migrate_embeddings_command(args):
+    from app.embedding_migration import start_migration
+
+    def report(status):
+        print(
+            f"{status['status']}: {status['embedded']}/{status['total']} chunks "
+            f"({status['progress']:.1%}), {status['rows_per_second']} rows/s"
+        )
+
+    status = start_migration(
+        args.model,
+        args.dimensions,
+        batch_size=args.batch_size,
+        rows_per_second=args.rows_per_second,
+        background=False,
+        on_progress=report,
+    )
+    report(status)
+    if status["error"]:
+        raise SystemExit(status["error"])
+
+
+def pregenerate_command(args):
+    import asyncio
+    from app.agent import refresh_pool
+
+    for class_id in args.class_ids:
+        result = asyncio.run(refresh_pool(class_id))
+        print(f"'{class_id}': {result['generated']} pool items generated, {result['failed']} windows failed")
+
+
+def sync_lexical_mirror_command(args):
+    from app.vector_store import refresh_lexical_mirror
+
+    for class_id in args.class_ids:
+        print(f"'{class_id}': {refresh_lexical_mirror(class_id)} chunks mirrored")
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(description="StudyBuddy maintenance commands")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    index = commands.add_parser(
+        "index",
+        help="Index a directory tree of course materials (one subdirectory per class)",
+    )
+    index.add_argument("root", help="Directory whose subdirectories hold each class's files")
+    index.add_argument(
+        "--map",
+        action="append",
+        metavar="DIRECTORY=CLASS_ID",
+        help="Index a subdirectory under a different class id (repeatable)",
+    )
+    index.add_argument("--workers", type=int, default=4, help="Extraction/chunking processes")
+    index.add_argument("--batch-size", type=int, default=50, help="Documents committed per write")
+    index.add_argument("--checkpoint", help="Checkpoint file used to resume an interrupted run")
+    index.set_defaults(handler=index_command)
+
+    export = commands.add_parser("export", help="Export a class index to a snapshot file")
+    export.add_argument("class_id")
+    export.add_argument("output", help="Snapshot file to write")
+    export.set_defaults(handler=export_command)
+
+    load = commands.add_parser("import", help="Load a snapshot file into the configured backend")
+    load.add_argument("snapshot", help="Snapshot file to read")
+    load.add_argument("--class-id", help="Import under this class id instead of the exported one")
+    load.set_defaults(handler=import_command)
+
+    migrate = commands.add_parser(
+        "migrate-embeddings",
+        help="Re-embed every chunk with a new model, then switch queries over to it",
+    )
+    migrate.add_argument("model", help="Embedding model, e.g. text-embedding-3-large")
+    migrate.add_argument("--dimensions", type=int, required=True)
+    migrate.add_argument("--batch-size", type=int, default=100)
+    migrate.add_argument("--rows-per-second", type=float, default=200.0, help="Throttle (0 disables)")
+    migrate.set_defaults(handler=migrate_embeddings_command)
+
+    pregenerate = commands.add_parser(
+        "pregenerate",
+        help="Bring the flashcard and quiz pools of classes up to date (e.g. after `index`)",
+    )
+    pregenerate.add_argument("class_ids", nargs="+")
+    pregenerate.set_defaults(handler=pregenerate_command)
+
+    mirror = commands.add_parser(
+        "sync-lexical-mirror",
+        help="Rebuild the lexical retrieval fallback of classes indexed before it existed",
+    )
+    mirror.add_argument("class_ids", nargs="+")
+    mirror.set_defaults(handler=sync_lexical_mirror_command)
+
+    return parser
+
+
+if __name__ == "__main__":
+    arguments = build_parser().parse_args()
+    arguments.handler(arguments)